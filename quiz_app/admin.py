@@ -1,6 +1,7 @@
 from django.contrib import admin
 from .models import (
-    Category, Quiz, Question, Choice, QuizAttempt, UserAnswer, QuizAnalytics, UserProfile
+    Category, Quiz, Question, Choice, QuizAttempt, UserAnswer, QuizAnalytics, UserProfile,
+    IngestionJob, LLMUsage
 )
 
 @admin.register(Category)
@@ -27,7 +28,7 @@ class QuestionInline(admin.TabularInline):
 @admin.register(Quiz)
 class QuizAdmin(admin.ModelAdmin):
     list_display = ('title', 'category', 'creator', 'difficulty', 'status', 'question_count', 'total_attempts', 'average_score', 'created_at')
-    list_filter = ('difficulty', 'status', 'category', 'created_at', 'pdf_processed')
+    list_filter = ('difficulty', 'status', 'category', 'created_at', 'pdf_processed', 'processing_status')
     search_fields = ('title', 'description', 'creator__username', 'category__name')
     readonly_fields = ('id', 'slug', 'total_attempts', 'average_score', 'created_at', 'updated_at', 'published_at')
     prepopulated_fields = {'slug': ('title',)}
@@ -41,7 +42,7 @@ class QuizAdmin(admin.ModelAdmin):
             'fields': ('time_limit', 'passing_score', 'max_attempts')
         }),
         ('File Management', {
-            'fields': ('pdf_file', 'pdf_processed')
+            'fields': ('pdf_file', 'pdf_processed', 'processing_status', 'vector_backend')
         }),
         ('Statistics', {
             'fields': ('total_attempts', 'average_score'),
@@ -161,3 +162,31 @@ class UserProfileAdmin(admin.ModelAdmin):
     def created_at(self, obj):
         return obj.user.date_joined
     created_at.short_description = 'Joined'
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ('quiz', 'status', 'progress', 'num_questions', 'attempts', 'reserved_tokens', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('quiz__title', 'worker', 'error')
+    readonly_fields = ('id', 'created_at', 'updated_at', 'started_at', 'finished_at')
+    actions = ['retry_jobs']
+    
+    def retry_jobs(self, request, queryset):
+        from .ingestion import retry_job
+        retried = sum(1 for job in queryset if retry_job(job))
+        self.message_user(request, f"{retried} job(s) queued again.")
+    retry_jobs.short_description = 'Retry selected failed jobs'
+
+
+@admin.register(LLMUsage)
+class LLMUsageAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'quiz', 'window_start', 'calls', 'cached_calls', 'prompt_tokens', 'completion_tokens', 'total_tokens')
+    list_filter = ('kind', 'window_start')
+    search_fields = ('user__username', 'quiz__title')
+    date_hierarchy = 'window_start'
+    list_select_related = ('user', 'quiz')
+    readonly_fields = ('user', 'quiz', 'kind', 'window_start', 'calls', 'cached_calls', 'prompt_tokens', 'completion_tokens')
+    
+    def total_tokens(self, obj):
+        return obj.total_tokens
+    total_tokens.short_description = 'Total tokens'
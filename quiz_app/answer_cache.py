@@ -0,0 +1,238 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .global_index import global_index_enabled, get_global_index
+from .store_cache import store_signature
+
+# Per-quiz semantic cache of AI tutor answers.
+#
+# Students reading the same PDF ask the tutor near-identical questions. A
+# question is embedded and compared (cosine) with earlier questions about
+# the same quiz; at QUIZ_ANSWER_CACHE_THRESHOLD or above, the earlier answer
+# is served without retrieval or an LLM call. Only standalone questions take
+# part, since a follow-up ("why is that?") depends on the conversation, and
+# answers are only stored when they were written without any chat history.
+#
+# A quiz's entries belong to one version of its vector store (the store
+# files, or its range in the global index): when the store changes they are
+# dropped. Entries expire after QUIZ_ANSWER_CACHE_TTL seconds, and both
+# quizzes and the entries within a quiz are evicted least-recently-used
+# first. Like the vector store cache, each worker process has its own.
+
+# Words that may point back at earlier turns. Deliberately broad: "Explain
+# the theory that ..." is excluded too, as a relative "that" looks like a
+# back reference. A false match only costs a cache miss; a missed follow-up
+# would serve an answer to the wrong question.
+_FOLLOW_UP = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|his|her|above|previous|earlier|again|else|more|also)\b",
+    re.IGNORECASE,
+)
+
+
+def answer_cache_enabled():
+    return getattr(settings, 'QUIZ_ANSWER_CACHE', True)
+
+
+def is_standalone(question):
+    """True for questions that mean the same whatever was said before them"""
+    return len(re.findall(r"\w+", question)) >= 3 and not _FOLLOW_UP.search(question)
+
+
+def store_version(quiz):
+    """Identifies the current contents of the quiz's vector store, or None if it has none"""
+    if global_index_enabled():
+        entry = get_global_index().catalog()['documents'].get(quiz.document_key)
+        return (quiz.document_key, tuple(sorted(entry.items()))) if entry else None
+    if not os.path.isdir(quiz.vector_store_path):
+        return None
+    return quiz.document_key, store_signature(quiz.vector_store_path)[0]
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _QuizAnswers:
+    """Cached answers for one quiz: question text -> (unit vector, answer, created), oldest use first"""
+
+    def __init__(self, version):
+        self.version = version
+        self.entries = OrderedDict()
+        self._matrix = None  # stacked vectors, rebuilt after any change
+
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = np.stack([entry[0] for entry in self.entries.values()])
+        return self._matrix
+
+    def changed(self):
+        self._matrix = None
+
+
+class SemanticAnswerCache:
+    """
+    Bounded in-memory cache of tutor answers per quiz, looked up by
+    embedding similarity of the question.
+    """
+
+    def __init__(self, threshold=0.92, ttl=24 * 3600, max_entries=200, max_quizzes=256):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries  # per quiz
+        self.max_quizzes = max_quizzes
+        self._quizzes = OrderedDict()  # quiz id -> _QuizAnswers
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _current(self, quiz_id, version):
+        """The quiz's answers if they match ``version``; stale ones are dropped"""
+        answers = self._quizzes.get(quiz_id)
+        if answers is not None and answers.version != version:
+            del self._quizzes[quiz_id]
+            self.invalidations += 1
+            metrics.incr('answer_cache.invalidation')
+            answers = None
+        return answers
+
+    def _expire(self, answers, now):
+        expired = [key for key, entry in answers.entries.items() if now - entry[2] > self.ttl]
+        for key in expired:
+            del answers.entries[key]
+        if expired:
+            answers.changed()
+            self.expirations += len(expired)
+            metrics.incr('answer_cache.expired', len(expired))
+
+    def lookup(self, quiz_id, version, vector):
+        """The answer to the most similar earlier question, or None below the threshold"""
+        vector = _normalize(vector)
+        with self._lock:
+            answers = self._current(quiz_id, version)
+            if answers is not None:
+                self._quizzes.move_to_end(quiz_id)
+                self._expire(answers, time.time())
+            if answers is None or not answers.entries:
+                self.misses += 1
+                metrics.incr('answer_cache.miss')
+                return None
+            scores = answers.matrix() @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                metrics.incr('answer_cache.miss')
+                return None
+            key = list(answers.entries)[best]
+            answers.entries.move_to_end(key)
+            answers.changed()
+            self.hits += 1
+            metrics.incr('answer_cache.hit')
+            return answers.entries[key][1]
+
+    def store(self, quiz_id, version, question, vector, answer):
+        with self._lock:
+            answers = self._current(quiz_id, version)
+            if answers is None:
+                answers = self._quizzes[quiz_id] = _QuizAnswers(version)
+            self._quizzes.move_to_end(quiz_id)
+            key = ' '.join(question.lower().split())
+            answers.entries[key] = (_normalize(vector), answer, time.time())
+            answers.entries.move_to_end(key)
+            while len(answers.entries) > self.max_entries:
+                answers.entries.popitem(last=False)
+                self.evictions += 1
+                metrics.incr('answer_cache.eviction')
+            answers.changed()
+            while len(self._quizzes) > self.max_quizzes:
+                _, dropped = self._quizzes.popitem(last=False)
+                self.evictions += len(dropped.entries)
+                metrics.incr('answer_cache.eviction', len(dropped.entries))
+            self.stored += 1
+            metrics.incr('answer_cache.stored')
+
+    def invalidate(self, quiz_id):
+        """Drop every answer cached for the quiz (e.g. when it is deleted)"""
+        with self._lock:
+            if self._quizzes.pop(quiz_id, None) is not None:
+                self.invalidations += 1
+                metrics.incr('answer_cache.invalidation')
+
+    def clear(self):
+        with self._lock:
+            self._quizzes.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'quizzes': len(self._quizzes),
+                'entries': sum(len(answers.entries) for answers in self._quizzes.values()),
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stored': self.stored,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+class AnswerLookup:
+    """
+    One chat question's use of the cache: embeds the question once, then
+    ``get()`` before building the prompt and ``put()`` with the finished
+    answer. Blocking (embedding, file stats); async views run it on the
+    search executor.
+    """
+
+    def __init__(self, cache, quiz, question, embeddings):
+        self.cache = cache
+        self.quiz_id = quiz.id
+        self.question = question
+        self.version = store_version(quiz)
+        self.vector = embeddings.embed_query(question) if self.version else None
+        # Cleared when the prompt carried chat history, which may have shaped the answer
+        self.storable = self.version is not None
+
+    def get(self):
+        if self.version is None:
+            return None
+        with metrics.timer('answer_cache.lookup'):
+            return self.cache.lookup(self.quiz_id, self.version, self.vector)
+
+    def put(self, answer):
+        if self.storable and answer:
+            self.cache.store(self.quiz_id, self.version, self.question, self.vector, answer)
+
+
+def answer_lookup(session, question, embeddings):
+    """An AnswerLookup for a standalone question in a PDF quiz session, else None"""
+    if not answer_cache_enabled() or not session.quiz or not session.quiz.pdf_file:
+        return None
+    if not is_standalone(question):
+        metrics.incr('answer_cache.skipped')
+        return None
+    return AnswerLookup(semantic_answer_cache, session.quiz, question, embeddings)
+
+
+semantic_answer_cache = SemanticAnswerCache(
+    threshold=getattr(settings, 'QUIZ_ANSWER_CACHE_THRESHOLD', 0.92),
+    ttl=getattr(settings, 'QUIZ_ANSWER_CACHE_TTL', 24 * 3600),
+    max_entries=getattr(settings, 'QUIZ_ANSWER_CACHE_ENTRIES', 200),
+    max_quizzes=getattr(settings, 'QUIZ_ANSWER_CACHE_QUIZZES', 256),
+)
+
+metrics.register_gauge('answer_cache', semantic_answer_cache.stats)
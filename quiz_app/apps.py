@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class QuizAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quiz_app'
+
+    def ready(self):
+        # Optionally load the embedding model / LLM client once per worker at
+        # startup instead of on the first chat message.
+        if getattr(settings, 'QUIZ_WARM_MODELS', False):
+            from . import model_registry
+            model_registry.warm_up()
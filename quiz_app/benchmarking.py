@@ -0,0 +1,209 @@
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Helpers shared by the bench_* management commands.
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model that sleeps for a fixed latency and returns a canned reply"""
+    latency: float = 0.2
+    reply: str = "This section explains the key concepts of the document in a few sentences."
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+
+def synthetic_documents(count, words_per_chunk=150):
+    """Return ``count`` distinct chunk-sized Documents"""
+    documents = []
+    for i in range(count):
+        words = [f"concept{i}_{j % 37}" for j in range(words_per_chunk)]
+        documents.append(Document(page_content=" ".join(words), metadata={'page': i // 3}))
+    return documents
+
+
+def clustered_vectors(count, dim, clusters=64, seed=0):
+    """Gaussian-mixture vectors, roughly shaped like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    return (centers[labels] + 0.6 * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+class LookupEmbeddings(Embeddings):
+    """Returns precomputed vectors for known texts, so indexes can be built without a model"""
+
+    def __init__(self, texts, vectors):
+        self._vectors = dict(zip(texts, vectors))
+
+    def embed_documents(self, texts):
+        return [self._vectors[text].tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self._vectors[text].tolist()
+
+
+def time_call(func, *args, **kwargs):
+    """Run ``func`` and return (result, seconds)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def write_synthetic_pdf(path, pages, lines_per_page=45, words_per_line=12, seed=0):
+    """Write a plain-text PDF with ``pages`` pages of pseudo-random words"""
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(2000)] + ["the", "of", "and", "process", "system", "energy", "model"]
+
+    objects = []  # object bodies, object number = index + 1
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(None)  # pages tree, filled in once the kids are known
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    kids = []
+    for _ in range(pages):
+        lines = [" ".join(rng.choice(vocabulary) for _ in range(words_per_line)) for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 14 TL 40 800 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        stream = stream.encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        kids.append(len(objects))
+
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+    )
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref_offset = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+    return path
+
+
+def _proc_status_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    value = _proc_status_kb('VmRSS')
+    return value / 1024 if value is not None else 0.0
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak-RSS counter for this process (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    value = _proc_status_kb('VmHWM')
+    if value is None:
+        # ru_maxrss is in KB on Linux (lifetime peak only)
+        value = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return value / 1024
+
+
+def _child(queue, func, args, kwargs):
+    try:
+        queue.put(('ok', func(*args, **kwargs)))
+    except Exception as e:
+        queue.put(('error', repr(e)))
+
+
+def run_isolated(func, *args, **kwargs):
+    """
+    Run ``func`` in a forked child process so peak-RSS measurements of one
+    run are not polluted by earlier runs. ``func`` must return a picklable value.
+    """
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, func, args, kwargs))
+    process.start()
+    status, value = queue.get()
+    process.join()
+    if status == 'error':
+        raise RuntimeError(value)
+    return value
+
+
+def directory_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / (1024 * 1024)
+
+
+def run_metadata():
+    """Where and on what a benchmark ran, stored with its results"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def write_results(path, suite, results, **extra):
+    """Write benchmark results as JSON (``-`` for stdout) and return the document"""
+    document = {'suite': suite, 'schema': 1, **run_metadata(), **extra, 'results': results}
+    text = json.dumps(document, indent=2, sort_keys=False)
+    if path == '-':
+        sys.stdout.write(text + '\n')
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    return document
@@ -0,0 +1,207 @@
+import copy
+import threading
+from django.conf import settings
+
+from . import metrics, model_registry
+
+# Token-budgeted chat history.
+#
+# Every ChatMessage records its size in tokens_used. The prompt gets the
+# newest messages that fit in QUIZ_CHAT_HISTORY_TOKENS, plus the session's
+# running summary of everything older. When the unsummarized messages
+# outgrow the budget, the oldest are folded into that summary with one LLM
+# call (old summary + just those messages), down to QUIZ_CHAT_HISTORY_KEEP of
+# the budget, so folds happen every few turns rather than on every turn.
+# The newest message is always in the prompt, cut down to the budget if it
+# is larger on its own, so a follow-up like "why?" keeps its context.
+
+ROLE_NAMES = {'user': 'Student', 'assistant': 'Teacher', 'system': 'System'}
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(getattr(settings, 'QUIZ_TOKENIZER', 'cl100k_base'))
+                except Exception as e:
+                    # No tiktoken, or its vocabulary can't be downloaded (offline): estimate
+                    print(f"⚠️ tiktoken unavailable, estimating token counts: {e}")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of tokens in ``text`` (tiktoken, or ~4 characters per token without it)"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_tokens(text, max_tokens):
+    """The beginning of ``text``, at most ``max_tokens`` tokens long"""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def format_history(messages):
+    return "\n".join(f"{ROLE_NAMES.get(m.message_type, m.message_type)}: {m.content}" for m in messages)
+
+
+class ChatMemory:
+    """
+    History of one ChatSession under a token budget. ``history()`` returns
+    what goes into the prompt; ``update()`` folds old turns into the
+    session's summary and is meant to run after a reply has been saved.
+    Both have async twins for async views.
+    """
+
+    def __init__(self, session, llm=None, budget=None, keep=None, max_messages=200, meter=None):
+        self.session = session
+        self.llm = llm  # model that writes the summary; the shared client by default
+        self.meter = meter  # llm_usage.UsageMeter that the fold calls are charged to
+        self.budget = budget or getattr(settings, 'QUIZ_CHAT_HISTORY_TOKENS', 1500)
+        self.keep = keep or getattr(settings, 'QUIZ_CHAT_HISTORY_KEEP', 0.6)
+        self.max_messages = max_messages
+
+    def _pending(self):
+        """Messages not yet folded into the summary, newest first"""
+        messages = self.session.messages.order_by('-timestamp')
+        if self.session.summarized_until:
+            messages = messages.filter(timestamp__gt=self.session.summarized_until)
+        return messages[:self.max_messages]
+
+    def _count(self, messages):
+        """Fill in tokens_used for messages saved without it; returns those needing a save"""
+        missing = [m for m in messages if not m.tokens_used and m.content]
+        for message in missing:
+            message.tokens_used = count_tokens(message.content)
+        return missing
+
+    def _window(self, newest_first, current=None):
+        """Chronological messages that fit in the budget"""
+        if newest_first and current is not None and newest_first[0].message_type == 'user' \
+                and newest_first[0].content == current:
+            # The question being answered is already in the prompt on its own
+            newest_first = newest_first[1:]
+        window, used = [], 0
+        for message in newest_first:
+            if used + message.tokens_used > self.budget:
+                if not window:
+                    # Too large on its own: keep its beginning rather than dropping the latest turn
+                    message = copy.copy(message)
+                    message.content = truncate_tokens(message.content, self.budget) + " […]"
+                    message.tokens_used = self.budget
+                    window.append(message)
+                    used = self.budget
+                break
+            window.append(message)
+            used += message.tokens_used
+        window.reverse()
+        metrics.incr('chat.history_prompts')
+        metrics.incr('chat.history_tokens', used)
+        return window
+
+    def _to_fold(self, newest_first):
+        """Oldest messages to fold so the rest fit in ``keep`` of the budget (always keeps the last turn)"""
+        total = sum(m.tokens_used for m in newest_first)
+        if total <= self.budget:
+            return []
+        target = self.budget * self.keep
+        kept, used = 0, 0
+        for message in newest_first:
+            if kept >= 2 and used + message.tokens_used > target:
+                break
+            kept += 1
+            used += message.tokens_used
+        return list(reversed(newest_first[kept:]))
+
+    def _fold_prompt(self, messages):
+        return f"""
+        You maintain a running summary of a tutoring conversation between a student and an AI teacher.
+
+        Summary so far:
+        {self.session.history_summary or "(empty)"}
+
+        New messages to add:
+        {format_history(messages)}
+
+        Return the updated summary in at most 150 words: the topics covered, what the student
+        understood or struggled with, and any open questions. Do not add anything else.
+        """
+
+    def _apply_fold(self, messages, prompt, response):
+        if self.meter is not None:
+            self.meter.record(prompt, response)
+        self.session.history_summary = response.content.strip()
+        self.session.summarized_until = messages[-1].timestamp
+        metrics.incr('chat.history_folds')
+        metrics.incr('chat.history_folded_messages', len(messages))
+
+    def _load(self):
+        pending = list(self._pending())
+        missing = self._count(pending)
+        if missing:
+            type(pending[0]).objects.bulk_update(missing, ['tokens_used'])
+        return pending
+
+    async def _aload(self):
+        pending = [message async for message in self._pending()]
+        missing = self._count(pending)
+        if missing:
+            await type(pending[0]).objects.abulk_update(missing, ['tokens_used'])
+        return pending
+
+    def history(self, current=None):
+        """(running summary, chronological messages within the budget)"""
+        pending = self._load()
+        return self.session.history_summary, self._window(pending, current)
+
+    def update(self):
+        """Fold the oldest pending messages into the summary if they outgrew the budget"""
+        to_fold = self._to_fold(self._load())
+        if not to_fold:
+            return False
+        try:
+            llm = self.llm or model_registry.get_llm()
+            prompt = self._fold_prompt(to_fold)
+            with metrics.timer('chat.history_fold'):
+                response = llm.invoke(prompt)
+        except Exception as e:
+            # Nothing is lost: the messages stay pending and are folded next time
+            print(f"⚠️ Chat history summary failed: {e}")
+            return False
+        self._apply_fold(to_fold, prompt, response)
+        self.session.save(update_fields=['history_summary', 'summarized_until'])
+        return True
+
+    async def ahistory(self, current=None):
+        pending = await self._aload()
+        return self.session.history_summary, self._window(pending, current)
+
+    async def aupdate(self):
+        to_fold = self._to_fold(await self._aload())
+        if not to_fold:
+            return False
+        try:
+            llm = self.llm or model_registry.get_llm()
+            prompt = self._fold_prompt(to_fold)
+            with metrics.timer('chat.history_fold'):
+                response = await llm.ainvoke(prompt)
+        except Exception as e:
+            print(f"⚠️ Chat history summary failed: {e}")
+            return False
+        self._apply_fold(to_fold, prompt, response)
+        await self.session.asave(update_fields=['history_summary', 'summarized_until'])
+        return True
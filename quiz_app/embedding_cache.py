@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from . import metrics
+from .file_lock import exclusive_file_lock
+
+# On-disk cache of chunk embeddings, shared by every worker process.
+#
+# Layout of a cache directory (one per embedding model):
+#   meta.json    {"model": ..., "dim": ...}
+#   vectors.f32  raw float32 rows, append-only, opened with np.memmap
+#   keys.bin     append-only records of (sha256(text) [32 bytes], row [uint64])
+#
+# Vectors are written before their key record, so a crash can leave an
+# orphaned vector row but never a key pointing at missing data.
+
+_KEY_RECORD = struct.Struct('<32sQ')
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    """Append-only, memory-mapped store of float32 vectors keyed by text hash"""
+
+    def __init__(self, directory, model_name):
+        self.directory = directory
+        self.model_name = model_name
+        self.dim = None
+        self._rows = {}  # digest -> row
+        self._keys_offset = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, 'meta.json')
+        self._vectors_path = os.path.join(directory, 'vectors.f32')
+        self._keys_path = os.path.join(directory, 'keys.bin')
+        self._lock_path = os.path.join(directory, '.lock')
+        self._refresh()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _load_meta(self):
+        """Read the vector size, which another process may have written since we started"""
+        if self.dim is None and os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self.dim = json.load(f)['dim']
+
+    def _refresh(self):
+        """Pick up key records appended by other processes"""
+        self._load_meta()
+        if not os.path.exists(self._keys_path):
+            return
+        with open(self._keys_path, 'rb') as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        usable = len(data) - len(data) % _KEY_RECORD.size
+        for digest, row in _KEY_RECORD.iter_unpack(data[:usable]):
+            self._rows[digest] = row
+        self._keys_offset += usable
+
+    def _matrix(self, min_rows):
+        """Memory-mapped view of the vector file covering at least ``min_rows`` rows"""
+        if self._vectors is None or self._vectors.shape[0] < min_rows:
+            rows = os.path.getsize(self._vectors_path) // (self.dim * 4)
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return self._vectors
+
+    def get_many(self, digests):
+        """Return {digest: vector} for the digests present in the cache"""
+        with self._lock:
+            if any(d not in self._rows for d in digests):
+                self._refresh()
+            found = {d: self._rows[d] for d in digests if d in self._rows}
+            if not found:
+                return {}
+            matrix = self._matrix(max(found.values()) + 1)
+            return {d: np.array(matrix[row]) for d, row in found.items()}
+
+    def add_many(self, digests, vectors):
+        """Append new vectors; digests already present are skipped"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, exclusive_file_lock(self._lock_path):
+            self._load_meta()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._meta_path, 'w') as f:
+                    json.dump({'model': self.model_name, 'dim': self.dim}, f)
+            self._refresh()
+
+            new = [(d, v) for d, v in zip(digests, vectors) if d not in self._rows]
+            if not new:
+                return 0
+            row_bytes = self.dim * 4
+            if os.path.exists(self._vectors_path):
+                size = os.path.getsize(self._vectors_path)
+                if size % row_bytes:
+                    # A writer crashed mid-row; no key points at the partial row, so drop it
+                    # rather than shift every row appended after it
+                    os.truncate(self._vectors_path, size - size % row_bytes)
+            with open(self._vectors_path, 'ab') as f:
+                first_row = f.tell() // row_bytes
+                f.write(np.stack([v for _, v in new]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._keys_path, 'ab') as f:
+                f.write(b''.join(_KEY_RECORD.pack(d, first_row + i) for i, (d, _) in enumerate(new)))
+            self._refresh()
+            return len(new)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model: document chunks seen before (by any worker,
+    in any PDF) are served from the disk cache and only the misses are
+    encoded, in batches. Queries are always encoded directly.
+    """
+
+    def __init__(self, embeddings, cache, batch_size=64):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.batch_size = batch_size
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.embed_seconds = 0.0
+
+    def embed_documents(self, texts):
+        digests = [text_digest(text) for text in texts]
+        cached = self.cache.get_many(digests)
+
+        # Embed each distinct missing text once, in batches
+        missing = {}
+        for digest, text in zip(digests, texts):
+            if digest not in cached and digest not in missing:
+                missing[digest] = text
+        missing_digests = list(missing)
+        start = time.perf_counter()
+        for i in range(0, len(missing_digests), self.batch_size):
+            batch = missing_digests[i:i + self.batch_size]
+            vectors = self.embeddings.embed_documents([missing[d] for d in batch])
+            self.cache.add_many(batch, vectors)
+            cached.update(zip(batch, np.asarray(vectors, dtype=np.float32)))
+        seconds = time.perf_counter() - start
+
+        hits = len(texts) - len(missing_digests)
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += len(missing_digests)
+            self.embed_seconds += seconds
+        metrics.incr('embedding_cache.hit', hits)
+        metrics.incr('embedding_cache.miss', len(missing_digests))
+        if missing_digests:
+            metrics.observe('embedding_cache.embed_batch', seconds)
+
+        return [cached[d].tolist() for d in digests]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            seconds_per_miss = (self.embed_seconds / self.misses) if self.misses else 0.0
+            return {
+                'entries': len(self.cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+                'embed_seconds': self.embed_seconds,
+                'estimated_seconds_saved': self.hits * seconds_per_miss,
+            }
+
+
+def cache_directory(root, model_name):
+    return os.path.join(root, re.sub(r'[^\w.-]', '_', model_name))
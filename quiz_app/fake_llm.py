@@ -0,0 +1,135 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+# Offline stand-in for the Groq chat model (QUIZ_LLM_BACKEND = "fake").
+#
+# Replies are shaped after the prompts PDFProcessor and the chat views send:
+# question prompts get a JSON array of well-formed MCQs, summary prompts get
+# a few sentences built from the content, anything else gets a short answer.
+# Output depends only on the seed, the prompt and how many times that prompt
+# was seen before, so runs are reproducible while repeated question batches
+# still differ. Latency, jitter and an error rate simulate the network.
+
+_QUESTION_PROMPT = re.compile(r'generate (\d+) unique (\w+) level multiple choice', re.IGNORECASE)
+_WORD = re.compile(r'[A-Za-z][A-Za-z_]{4,}')
+_STOPWORDS = {
+    'following', 'summary', 'content', 'question', 'questions', 'format', 'return', 'option', 'options',
+    'correct', 'level', 'unique', 'choice', 'multiple', 'based', 'generate', 'sentences', 'focus',
+    'technical', 'concepts', 'explanations', 'avoid', 'lists', 'include', 'markdown', 'array', 'items',
+    'follow', 'summarize', 'these', 'their', 'there', 'which', 'about', 'would', 'should', 'could',
+}
+
+
+class FakeLLMError(RuntimeError):
+    pass
+
+
+def _topics(text, rng, count):
+    words = [w.lower() for w in _WORD.findall(text) if w.lower() not in _STOPWORDS]
+    if not words:
+        words = ['energy', 'system', 'process', 'structure', 'function', 'model']
+    return [rng.choice(words) for _ in range(count)]
+
+
+def fake_questions(prompt, rng, count, difficulty):
+    questions = []
+    for _ in range(count):
+        a, b, c, d, e = _topics(prompt, rng, 5)
+        correct = rng.choice('ABCD')
+        options = {letter: f"{rng.choice(['It links', 'It separates', 'It measures', 'It limits'])} {x} and {y}"
+                   for letter, x, y in zip('ABCD', (a, b, c, d), (e, a, b, c))}
+        questions.append({
+            'mcq': f"At the {difficulty} level, how does {a} relate to {b} in the context of {c} "
+                   f"(case {rng.randint(1, 10**6)})?",
+            'options': options,
+            'correct': correct,
+        })
+    return json.dumps(questions, indent=2)
+
+
+def fake_summary(prompt, rng):
+    a, b, c, d, e, f = _topics(prompt, rng, 6)
+    return (f"This section explains how {a} and {b} shape {c}. "
+            f"It describes the role of {d} and its effect on {e}. "
+            f"The key idea is that {f} connects these concepts.")
+
+
+def fake_reply(prompt, rng):
+    match = _QUESTION_PROMPT.search(prompt)
+    if match:
+        return fake_questions(prompt, rng, int(match.group(1)), match.group(2))
+    if 'summar' in prompt.lower():
+        return fake_summary(prompt, rng)
+    a, b = _topics(prompt, rng, 2)
+    return f"Good question! In short, {a} determines how {b} behaves; the PDF explains this with an example."
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model with simulated latency, jitter and failures"""
+    seed: int = 0
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    temperature: float = 0.7
+    model_name: str = "fake-llm"
+
+    _calls: dict = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _draw(self, prompt):
+        """The rng for this call of ``prompt`` and the simulated delay"""
+        with self._lock:
+            call = self._calls.get(prompt, 0)
+            self._calls[prompt] = call + 1
+        rng = random.Random(f"{self.seed}:{call}:{prompt}")
+        return rng, self.latency + rng.uniform(-self.jitter, self.jitter)
+
+    def _respond(self, prompt, rng):
+        if rng.random() < self.error_rate:
+            raise FakeLLMError("Simulated LLM failure")
+        return fake_reply(prompt, rng)
+
+    def reply(self, prompt):
+        """Sleep, maybe fail, and return the reply text for ``prompt``"""
+        rng, delay = self._draw(prompt)
+        if delay > 0:
+            time.sleep(delay)
+        return self._respond(prompt, rng)
+
+    async def areply(self, prompt):
+        """reply() without blocking the event loop while "waiting" for the model"""
+        rng, delay = self._draw(prompt)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._respond(prompt, rng)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply(prompt)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # The latency is spent before the first chunk, then words arrive as fast as they are read
+        prompt = "\n".join(str(message.content) for message in messages)
+        for word in re.findall(r'\S+\s*', self.reply(prompt)):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=await self.areply(prompt)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        for word in re.findall(r'\S+\s*', await self.areply(prompt)):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+    @property
+    def _llm_type(self):
+        return "fake"
@@ -0,0 +1,38 @@
+import time
+from contextlib import contextmanager
+
+# Cross-process exclusive lock on a lock file, used by the on-disk embedding
+# cache and the global index. fcntl.flock on POSIX, msvcrt.locking on
+# Windows; both are imported when a lock is taken, so the modules that use
+# this still import on hosts that lack one of them.
+
+
+@contextmanager
+def exclusive_file_lock(path):
+    """Hold an exclusive lock on the file at ``path`` (created if missing) for the ``with`` block"""
+    with open(path, 'w') as lock_file:
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return
+
+        import msvcrt
+        while True:
+            try:
+                # LK_LOCK gives up after ~10 seconds; keep waiting like flock does
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,348 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from langchain_core.vectorstores import VectorStore
+
+from . import metrics
+from .file_lock import exclusive_file_lock
+from .native_store import NativeVectorStore
+from .store_cache import vector_store_cache
+
+# One vector index shared by every PDF quiz (QUIZ_GLOBAL_INDEX = True), split
+# into shards of at most QUIZ_GLOBAL_INDEX_SHARD_CHUNKS chunks.
+#
+# Layout of MEDIA_ROOT/vector_stores/global:
+#   catalog.json       {"shards":    {name: {"path", "count", "dead"}},
+#                       "documents": {key: {"shard", "start", "end"}},
+#                       "quizzes":   {quiz_id: {"document", "creator"}},
+#                       "next_shard": n}
+#   shard_<n>-<hex>/   flat native store holding several documents back to back
+#   summaries/<key>.json
+#
+# A document's chunks are contiguous rows of one shard, so filtering by quiz or
+# by creator scans a few row ranges instead of checking metadata per chunk.
+# Quizzes built from the same PDF share the document's rows. Shards are never
+# modified in place: a changed shard is written to a new directory and the
+# catalog is swapped atomically, so readers always see a complete shard.
+
+
+def global_index_enabled():
+    return getattr(settings, 'QUIZ_GLOBAL_INDEX', False)
+
+
+def _empty_catalog():
+    return {'shards': {}, 'documents': {}, 'quizzes': {}, 'next_shard': 0}
+
+
+class GlobalIndex:
+    """Sharded index of the chunks of every PDF quiz, filterable by quiz or creator"""
+
+    def __init__(self, root, max_shard_chunks=20000, model_name=''):
+        self.root = root
+        self.max_shard_chunks = max_shard_chunks
+        self.model_name = model_name
+        self.catalog_path = os.path.join(root, 'catalog.json')
+        self._lock_path = os.path.join(root, '.lock')
+        self._catalog = None
+        self._catalog_stamp = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # --- catalog ------------------------------------------------------------
+
+    def catalog(self):
+        """The current catalog, re-read when another process has replaced it"""
+        try:
+            stat = os.stat(self.catalog_path)
+        except FileNotFoundError:
+            return _empty_catalog()
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stamp != self._catalog_stamp:
+                with open(self.catalog_path, encoding='utf-8') as f:
+                    self._catalog = json.load(f)
+                self._catalog_stamp = stamp
+            return self._catalog
+
+    def _write_catalog(self, catalog):
+        tmp_path = f'{self.catalog_path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(catalog, f)
+        os.replace(tmp_path, self.catalog_path)
+
+    @contextmanager
+    def _exclusive(self):
+        """Serialize writers across threads and processes; yields a private copy of the catalog"""
+        with self._write_lock, exclusive_file_lock(self._lock_path):
+            yield json.loads(json.dumps(self.catalog()))
+
+    def has_document(self, key):
+        return key in self.catalog()['documents']
+
+    def has_quiz(self, quiz_id):
+        return str(quiz_id) in self.catalog()['quizzes']
+
+    def has_creator(self, creator_id):
+        return any(q['creator'] == creator_id for q in self.catalog()['quizzes'].values())
+
+    # --- writes -------------------------------------------------------------
+
+    def add_document(self, key, vector_store, quiz_id, creator_id):
+        """Append the chunks of a freshly built store as document ``key`` and register the quiz"""
+        if not isinstance(vector_store, NativeVectorStore):
+            vector_store = NativeVectorStore.from_faiss(vector_store)
+        vector_store._consolidate()
+        count = len(vector_store)
+        documents = []
+        for position in range(count):
+            chunk = vector_store.get_chunk(position)
+            chunk.metadata = dict(chunk.metadata, quiz_id=str(quiz_id), creator_id=creator_id, document=key)
+            documents.append(chunk)
+        ids = [vector_store.get_chunk_id(position) for position in range(count)]
+
+        with self._exclusive() as catalog:
+            if key not in catalog['documents']:
+                shard = self._shard_with_room(catalog, count)
+                start = catalog['shards'][shard]['count'] if shard in catalog['shards'] else 0
+                retired = self._write_shard(catalog, shard, [(None, 0, start), (vector_store, 0, count)],
+                                            documents=documents, ids=ids)
+                catalog['documents'][key] = {'shard': shard, 'start': start, 'end': start + count}
+                metrics.incr('global_index.documents_added')
+            else:
+                retired = None
+            catalog['quizzes'][str(quiz_id)] = {'document': key, 'creator': creator_id}
+            self._write_catalog(catalog)
+            self._retire(retired)
+
+    def add_quiz(self, quiz_id, key, creator_id):
+        """Point another quiz at an already indexed document"""
+        with self._exclusive() as catalog:
+            if key not in catalog['documents']:
+                raise KeyError(f"Document {key} is not in the global index")
+            catalog['quizzes'][str(quiz_id)] = {'document': key, 'creator': creator_id}
+            self._write_catalog(catalog)
+
+    def remove_quiz(self, quiz_id):
+        """
+        Unregister a quiz. Its document's rows are dropped once no quiz uses
+        them, and a shard that is at least half dead rows is compacted.
+        Returns True if the document itself was removed.
+        """
+        with self._exclusive() as catalog:
+            entry = catalog['quizzes'].pop(str(quiz_id), None)
+            if entry is None:
+                return False
+            key = entry['document']
+            removed = not any(q['document'] == key for q in catalog['quizzes'].values())
+            retired = None
+            if removed:
+                document = catalog['documents'].pop(key, None)
+                if document:
+                    shard = catalog['shards'][document['shard']]
+                    shard['dead'] += document['end'] - document['start']
+                    if shard['dead'] * 2 >= shard['count']:
+                        retired = self._compact(catalog, document['shard'])
+            self._write_catalog(catalog)
+            self._retire(retired)
+            return removed
+
+    def _shard_with_room(self, catalog, count):
+        for name, shard in sorted(catalog['shards'].items()):
+            if shard['count'] + count <= self.max_shard_chunks:
+                return name
+        # Documents bigger than a shard get a shard of their own
+        name = f"shard_{catalog['next_shard']:04d}"
+        catalog['next_shard'] += 1
+        return name
+
+    def _write_shard(self, catalog, name, pieces, documents=(), ids=()):
+        """
+        Write shard ``name`` as the concatenation of ``pieces`` — (store, start,
+        end) row ranges, where store None means the shard's current contents —
+        followed by ``documents``' rows, and point the catalog at it. Returns
+        the directory of the replaced shard, to delete once the catalog is saved.
+        """
+        old = catalog['shards'].get(name)
+        current = self.shard_store(name, catalog) if old else None
+        vectors, chunks, chunk_ids = [], [], []
+        for store, start, end in pieces:
+            store = current if store is None else store
+            if store is None or end <= start:
+                continue
+            vectors.append(np.asarray(store._vectors[start:end], dtype=np.float32))
+            if store is current:
+                chunks.extend(store.get_chunk(i) for i in range(start, end))
+                chunk_ids.extend(store.get_chunk_id(i) for i in range(start, end))
+        chunks.extend(documents)
+        chunk_ids.extend(ids)
+
+        path = f'{name}-{uuid.uuid4().hex[:8]}'
+        if chunks:
+            NativeVectorStore(None, vectors=np.vstack(vectors), documents=chunks, ids=chunk_ids).save(
+                os.path.join(self.root, path), model_name=self.model_name, index_mode='flat')
+            catalog['shards'][name] = {'path': path, 'count': len(chunks), 'dead': 0}
+        else:
+            catalog['shards'].pop(name, None)
+        return os.path.join(self.root, old['path']) if old else None
+
+    def _retire(self, path):
+        """
+        Delete a replaced shard. Readers that already loaded it keep working,
+        as NativeVectorStore maps its arrays and opens chunks.jsonl on load.
+        """
+        if path:
+            vector_store_cache.evict(path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _compact(self, catalog, name):
+        """Rewrite a shard without the rows of removed documents"""
+        live = sorted((doc['start'], doc['end'], key) for key, doc in catalog['documents'].items()
+                      if doc['shard'] == name)
+        pieces, offset = [], 0
+        for start, end, key in live:
+            pieces.append((None, start, end))
+            catalog['documents'][key].update(start=offset, end=offset + end - start)
+            offset += end - start
+        metrics.incr('global_index.compactions')
+        return self._write_shard(catalog, name, pieces)
+
+    # --- reads --------------------------------------------------------------
+
+    def shard_store(self, name, catalog=None):
+        catalog = catalog or self.catalog()
+        path = os.path.join(self.root, catalog['shards'][name]['path'])
+        return vector_store_cache.get(path, path, lambda p: NativeVectorStore.load(p, None))
+
+    def _ranges(self, catalog, quiz_ids=None, creator_id=None):
+        """{shard: [(start, end), ...]} for the documents matching the filter"""
+        if quiz_ids is not None:
+            keys = {catalog['quizzes'][str(q)]['document'] for q in quiz_ids if str(q) in catalog['quizzes']}
+        elif creator_id is not None:
+            keys = {q['document'] for q in catalog['quizzes'].values() if q['creator'] == creator_id}
+        else:
+            keys = set(catalog['documents'])
+        ranges = {}
+        for key in keys:
+            document = catalog['documents'][key]
+            ranges.setdefault(document['shard'], []).append((document['start'], document['end']))
+        return ranges
+
+    def search(self, embedding, k=4, quiz_ids=None, creator_id=None):
+        """Top-k (Document, distance) pairs across all shards, restricted to a set of quizzes or a creator"""
+        catalog = self.catalog()
+        results = []
+        with metrics.timer('global_index.search'):
+            for name, ranges in self._ranges(catalog, quiz_ids, creator_id).items():
+                store = self.shard_store(name, catalog)
+                results.extend((distance, store, position)
+                               for position, distance in store.search_ranges(embedding, k, ranges))
+        results.sort(key=lambda result: result[0])
+        return [(store.get_chunk(position), distance) for distance, store, position in results[:k]]
+
+    def document_chunk(self, key, position):
+        return self.document_chunks(key, position, position + 1)[0]
+
+    def document_chunks(self, key, start, end):
+        """Chunks ``start``..``end - 1`` of a document; the shard store is resolved once for the range"""
+        catalog = self.catalog()
+        document = catalog['documents'][key]
+        store = self.shard_store(document['shard'], catalog)
+        return [store.get_chunk(document['start'] + position) for position in range(start, end)]
+
+    def document_size(self, key):
+        document = self.catalog()['documents'][key]
+        return document['end'] - document['start']
+
+    def view(self, embedding, quiz_ids=None, creator_id=None):
+        return GlobalIndexView(self, embedding, quiz_ids=quiz_ids, creator_id=creator_id)
+
+    def stats(self):
+        catalog = self.catalog()
+        shards = catalog['shards'].values()
+        return {
+            'shards': len(catalog['shards']),
+            'documents': len(catalog['documents']),
+            'quizzes': len(catalog['quizzes']),
+            'chunks': sum(shard['count'] for shard in shards),
+            'dead_chunks': sum(shard['dead'] for shard in shards),
+        }
+
+
+class GlobalIndexView(VectorStore):
+    """
+    Read-only VectorStore over the global index, scoped to some quizzes or to
+    one creator's materials. A view of a single quiz also exposes its chunks in
+    document order (len / get_chunk / get_chunks), like NativeVectorStore.
+    """
+
+    def __init__(self, index, embedding, quiz_ids=None, creator_id=None):
+        self.index = index
+        self.embedding = embedding
+        self.quiz_ids = [str(q) for q in quiz_ids] if quiz_ids is not None else None
+        self.creator_id = creator_id
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def _document_key(self):
+        if not self.quiz_ids or len(self.quiz_ids) != 1:
+            raise ValueError("Chunk access needs a view of exactly one quiz")
+        return self.index.catalog()['quizzes'][self.quiz_ids[0]]['document']
+
+    def __len__(self):
+        return self.index.document_size(self._document_key())
+
+    def get_chunk(self, position):
+        return self.index.document_chunk(self._document_key(), position)
+
+    def get_chunks(self, start, end):
+        return self.index.document_chunks(self._document_key(), start, end)
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("Add documents through GlobalIndex.add_document")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("Build a store with a vector backend and add it with GlobalIndex.add_document")
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        return self.index.search(embedding, k=k, quiz_ids=self.quiz_ids, creator_id=self.creator_id)
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+
+_global_index = None
+_global_index_lock = threading.Lock()
+
+
+def get_global_index():
+    """The process-wide GlobalIndex under MEDIA_ROOT/vector_stores/global"""
+    global _global_index
+    if _global_index is None:
+        with _global_index_lock:
+            if _global_index is None:
+                from .model_registry import EMBEDDING_MODEL_NAME
+                _global_index = GlobalIndex(
+                    os.path.join(settings.MEDIA_ROOT, 'vector_stores', 'global'),
+                    max_shard_chunks=getattr(settings, 'QUIZ_GLOBAL_INDEX_SHARD_CHUNKS', 20000),
+                    model_name=EMBEDDING_MODEL_NAME,
+                )
+                metrics.register_gauge('global_index', _global_index.stats)
+    return _global_index
@@ -0,0 +1,334 @@
+import hashlib
+import os
+import shutil
+import socket
+import time
+import traceback
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Quiz, Question, Choice, IngestionJob
+from .vector_store import PDFProcessor
+from .llm_usage import UsageMeter, is_exempt, release_tokens
+from .store_cache import vector_store_cache
+from .global_index import global_index_enabled, get_global_index
+from .answer_cache import semantic_answer_cache
+from . import metrics
+
+# DB-backed queue for PDF quiz ingestion. The web request only stores the
+# upload and queues a job; `manage.py process_ingestion_jobs` workers claim
+# jobs and run the slow parse / embed / LLM steps.
+#
+# Quiz.processing_status follows the job only until the quiz has questions.
+# Jobs that add questions to a quiz that already has some report progress on
+# the IngestionJob alone, so the quiz stays open while they run or if they fail.
+
+
+def _awaiting_questions(quiz_ids):
+    """The quizzes, among ``quiz_ids``, whose status still follows their ingestion job"""
+    return Quiz.objects.filter(id__in=quiz_ids, questions__isnull=True)
+
+
+def enqueue_pdf_quiz(quiz, num_questions, reserved_tokens=0):
+    """Queue a PDF quiz for background processing (``reserved_tokens``: LLM quota already taken for it)"""
+    if not quiz.questions.exists():
+        quiz.processing_status = 'queued'
+        quiz.pdf_processed = False
+        quiz.save(update_fields=['processing_status', 'pdf_processed', 'updated_at'])
+    return IngestionJob.objects.create(quiz=quiz, num_questions=num_questions, reserved_tokens=reserved_tokens)
+
+
+def retry_job(job, reserved_tokens=0):
+    """Put a failed job back on the queue; the uploaded PDF is reused"""
+    if job.status != 'failed':
+        return False
+    job.status = 'queued'
+    job.reserved_tokens = reserved_tokens
+    job.progress = 0
+    job.error = ''
+    job.worker = ''
+    job.started_at = None
+    job.finished_at = None
+    job.save()
+    _awaiting_questions([job.quiz_id]).update(processing_status='queued', updated_at=timezone.now())
+    return True
+
+
+def claim_next_job(worker_name):
+    """Atomically claim the oldest queued job, or return None"""
+    while True:
+        job_id = (IngestionJob.objects.filter(status='queued')
+                  .order_by('created_at').values_list('id', flat=True).first())
+        if job_id is None:
+            return None
+        # The conditional update guarantees only one worker wins the job
+        claimed = IngestionJob.objects.filter(id=job_id, status='queued').update(
+            status='running',
+            worker=worker_name,
+            started_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            job = IngestionJob.objects.select_related('quiz').get(id=job_id)
+            job.attempts += 1
+            job.save(update_fields=['attempts'])
+            return job
+
+
+def fail_stale_jobs(max_age_minutes):
+    """Mark jobs whose worker stopped updating them as failed so they can be retried"""
+    cutoff = timezone.now() - timedelta(minutes=max_age_minutes)
+    stale = IngestionJob.objects.filter(status='running', updated_at__lt=cutoff)
+    quiz_ids = []
+    for job in stale.select_related('quiz__creator'):
+        # Re-checked per job, in case its worker has just sent a heartbeat
+        if stale.filter(id=job.id).update(status='failed', error='Worker stopped responding',
+                                          finished_at=timezone.now()):
+            quiz_ids.append(job.quiz_id)
+            release_tokens(job.quiz.creator, take_reservation(job))
+    if quiz_ids:
+        _awaiting_questions(quiz_ids).update(processing_status='failed')
+    return len(quiz_ids)
+
+
+def take_reservation(job):
+    """
+    Clear the job's reserved LLM tokens and return them. Whoever clears them
+    settles them (the worker, stale job cleanup or deleting the quiz), so a
+    reservation is never given back twice.
+    """
+    while True:
+        reserved = IngestionJob.objects.filter(id=job.id).values_list('reserved_tokens', flat=True).first()
+        if not reserved:
+            return 0
+        if IngestionJob.objects.filter(id=job.id, reserved_tokens=reserved).update(reserved_tokens=0):
+            return reserved
+
+
+def release_quiz_reservations(quiz):
+    """Give back the quota still reserved by a quiz's jobs (before the quiz is deleted)"""
+    for job in quiz.ingestion_jobs.filter(reserved_tokens__gt=0):
+        release_tokens(quiz.creator, take_reservation(job))
+
+
+def hash_uploaded_file(uploaded_file):
+    """SHA-256 of an uploaded file, read in chunks"""
+    hasher = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.hexdigest()
+
+
+def ensure_vector_store(processor, quiz):
+    """
+    Return the quiz's vector store, building it from the PDF only when no
+    quiz with the same content has built it yet.
+    """
+    if global_index_enabled():
+        return _ensure_in_global_index(processor, quiz)
+
+    store_path = quiz.vector_store_path
+    if os.path.exists(store_path):
+        try:
+            vector_store = vector_store_cache.get(store_path, store_path, processor.load_vector_store)
+            metrics.incr('ingestion.store_reused')
+            return vector_store
+        except Exception as e:
+            print(f"Error loading vector store, rebuilding from PDF: {e}")
+            vector_store_cache.evict(store_path)
+            shutil.rmtree(store_path, ignore_errors=True)
+
+    pdf_path = _pdf_path(quiz)
+    # Quizzes sharing a PDF share its store, so the first one to build it picks the backend
+    backend = quiz.vector_backend or None
+    vector_store = processor.process_pdf(pdf_path, backend=backend)
+
+    # Save next to the final location and rename, so a half-written store is
+    # never visible and two workers embedding the same PDF don't clash.
+    tmp_path = f"{store_path}.tmp-{uuid.uuid4().hex}"
+    processor.save_vector_store(vector_store, tmp_path, backend=backend)
+    try:
+        os.rename(tmp_path, store_path)
+    except OSError:
+        # Another worker finished the same document first; keep theirs
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    vector_store_cache.put(store_path, store_path, vector_store)
+    metrics.incr('ingestion.store_built')
+    return vector_store
+
+
+def _pdf_path(quiz):
+    pdf_path = os.path.join(settings.MEDIA_ROOT, str(quiz.pdf_file))
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"Uploaded PDF is missing: {quiz.pdf_file}")
+    return pdf_path
+
+
+def _ensure_in_global_index(processor, quiz):
+    """Global index variant of ensure_vector_store: returns a view scoped to the quiz"""
+    index = get_global_index()
+    if index.has_document(quiz.document_key):
+        if not index.has_quiz(quiz.id):
+            index.add_quiz(quiz.id, quiz.document_key, quiz.creator_id)
+        metrics.incr('ingestion.store_reused')
+    else:
+        # Shards are flat NumPy stores, whatever backend the quiz asks for
+        vector_store = processor.process_pdf(_pdf_path(quiz), backend='numpy')
+        index.add_document(quiz.document_key, vector_store, quiz.id, quiz.creator_id)
+        metrics.incr('ingestion.store_built')
+    return index.view(processor.embeddings, quiz_ids=[quiz.id])
+
+
+def release_vector_store(quiz):
+    """Delete the quiz's vector store unless another quiz still references it"""
+    semantic_answer_cache.invalidate(quiz.id)
+    if global_index_enabled():
+        # The index keeps its own quiz -> document references
+        removed = get_global_index().remove_quiz(quiz.id)
+        if removed and os.path.exists(quiz.summary_path):
+            os.remove(quiz.summary_path)
+        return removed
+
+    store_path = quiz.vector_store_path
+    if quiz.content_hash:
+        still_used = Quiz.objects.filter(content_hash=quiz.content_hash).exclude(id=quiz.id).exists()
+        if still_used:
+            return False
+    vector_store_cache.evict(store_path)
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    return True
+
+
+class JobLost(Exception):
+    """The job was marked stale (and possibly retried) while this worker was still running it"""
+
+
+def _owned(job):
+    # A retried job is claimed again with a new started_at, even by the same worker
+    return IngestionJob.objects.filter(id=job.id, status='running', worker=job.worker, started_at=job.started_at)
+
+
+def _set_stage(job, stage, progress):
+    job.progress = progress
+    if not _owned(job).update(progress=progress, updated_at=timezone.now()):
+        raise JobLost(f"Job {job.id} was taken over while {stage}")
+    _awaiting_questions([job.quiz_id]).update(processing_status=stage, updated_at=timezone.now())
+
+
+def job_heartbeat(job, interval=60):
+    """
+    Callable that refreshes the job's updated_at, at most every ``interval``
+    seconds, so fail_stale_jobs only catches workers that really stopped.
+    Raises JobLost once the job is no longer this worker's.
+    """
+    last_beat = time.monotonic()
+
+    def beat():
+        nonlocal last_beat
+        if time.monotonic() - last_beat < interval:
+            return
+        last_beat = time.monotonic()
+        if not _owned(job).update(updated_at=timezone.now()):
+            raise JobLost(f"Job {job.id} was taken over")
+        Quiz.objects.filter(id=job.quiz_id).update(updated_at=timezone.now())
+
+    return beat
+
+
+def save_questions(quiz, questions):
+    """Create Question/Choice rows for generated questions, all or nothing"""
+    with transaction.atomic():
+        question_order = quiz.questions.count()
+        for q_data in questions:
+            question = Question.objects.create(
+                quiz=quiz,
+                text=q_data['mcq'],
+                order=question_order
+            )
+
+            choice_order = 0
+            for option_letter, option_text in q_data['options'].items():
+                Choice.objects.create(
+                    question=question,
+                    text=option_text,
+                    is_correct=(option_letter == q_data['correct']),
+                    order=choice_order
+                )
+                choice_order += 1
+            question_order += 1
+
+
+def run_job(job):
+    """Run one claimed ingestion job to completion"""
+    quiz = job.quiz
+    # Tokens are charged to the quiz creator; the worker settles the quota
+    # reserved at upload, unless the reservation was already given back
+    meter = UsageMeter(quiz.creator_id, 'quiz', quiz_id=quiz.id, charge_quota=not is_exempt(quiz.creator))
+    try:
+        with metrics.timer('ingestion.job'):
+            processor = PDFProcessor(meter=meter, heartbeat=job_heartbeat(job))
+
+            # Re-uploads of the same PDF and retried jobs reuse the saved store
+            _set_stage(job, 'processing_pdf', 10)
+            vector_store = ensure_vector_store(processor, quiz)
+
+            _set_stage(job, 'generating_questions', 40)
+            # Summary is computed once per document and reused by later runs
+            summary = processor.load_or_create_summary(vector_store, quiz.summary_path)
+            print(f"Requesting {job.num_questions} questions...")
+            questions = processor.generate_questions(
+                vector_store,
+                quiz.difficulty,
+                job.num_questions,
+                quiz_id=quiz.id,
+                summary=summary
+            )
+            if not questions:
+                raise Exception("Failed to generate questions")
+
+            # Questions and the final status are only written while the job is still ours
+            with transaction.atomic():
+                _set_stage(job, 'generating_questions', 90)
+                save_questions(quiz, questions)
+                job.status = 'succeeded'
+                job.progress = 100
+                job.error = ''
+                job.finished_at = timezone.now()
+                _owned(job).update(status='succeeded', progress=100, error='', finished_at=job.finished_at,
+                                   updated_at=job.finished_at)
+                Quiz.objects.filter(id=quiz.id).update(
+                    processing_status='ready', pdf_processed=True, updated_at=timezone.now()
+                )
+            print(f"Successfully generated {len(questions)} questions out of {job.num_questions} requested")
+        metrics.incr('ingestion.succeeded')
+    except JobLost as e:
+        # Whoever took the job over owns its status now; leave the rows alone
+        print(f"⚠️ {e}; discarding this worker's result")
+        job.status = 'failed'
+        job.error = str(e)
+        metrics.incr('ingestion.lost')
+    except Exception as e:
+        traceback.print_exc()
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        if _owned(job).update(status='failed', error=job.error, finished_at=job.finished_at,
+                              updated_at=job.finished_at):
+            _awaiting_questions([quiz.id]).update(processing_status='failed', updated_at=timezone.now())
+        metrics.incr('ingestion.failed')
+    finally:
+        try:
+            meter.reserved = take_reservation(job)
+            meter.flush()
+        except Exception as e:
+            print(f"⚠️ Could not record LLM usage for quiz {quiz.id}: {e}")
+    return job
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
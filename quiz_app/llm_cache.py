@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from langchain_core.messages import AIMessage
+
+from . import metrics
+
+# Disk cache of LLM responses, keyed by sha256(model, temperature, prompt).
+#
+# Stored in one SQLite file (WAL mode) so every worker process shares it.
+# Entries expire after ``ttl`` seconds, and the least recently used ones are
+# evicted once the cached text exceeds ``max_bytes``. Caching is opt-in per
+# call: CachedLLM.invoke(prompt, cache=True).
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    temperature REAL NOT NULL,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    latency REAL NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+def prompt_text(prompt):
+    """Canonical text of a prompt: a string or a list of chat messages"""
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, (list, tuple)):
+        return '\n'.join(f"{getattr(m, 'type', '')}: {getattr(m, 'content', m)}" for m in prompt)
+    return repr(prompt)
+
+
+def cache_key(model, temperature, prompt):
+    text = f"{model}\0{temperature}\0{prompt_text(prompt)}"
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """SQLite-backed response store with TTL and size-based LRU eviction"""
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_bytes=100 * 1024 * 1024, evict_every=50):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.seconds_saved = 0.0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """Return (content, original latency) or None"""
+        now = time.time()
+        row = self._connection().execute(
+            'SELECT content, latency, created FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or now - row[2] > self.ttl:
+            with self._stats_lock:
+                self.misses += 1
+            metrics.incr('llm_cache.miss')
+            return None
+        self._connection().execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, key))
+        with self._stats_lock:
+            self.hits += 1
+            self.seconds_saved += row[1]
+        metrics.incr('llm_cache.hit')
+        metrics.observe('llm_cache.saved', row[1])
+        return row[0], row[1]
+
+    def put(self, key, model, temperature, content, latency):
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, model, temperature, content, len(content.encode('utf-8')), latency, now, now),
+        )
+        with self._stats_lock:
+            self._puts += 1
+            due = self._puts % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def record_bypass(self):
+        with self._stats_lock:
+            self.bypassed += 1
+        metrics.incr('llm_cache.bypass')
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under ``max_bytes``"""
+        connection = self._connection()
+        expired = connection.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,)).rowcount
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        evicted = 0
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            keys = []
+            for key, size in connection.execute('SELECT key, size FROM responses ORDER BY last_used'):
+                keys.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            connection.executemany('DELETE FROM responses WHERE key = ?', keys)
+            evicted = len(keys)
+        metrics.incr('llm_cache.evicted', expired + evicted)
+        return expired + evicted
+
+    def clear(self):
+        self._connection().execute('DELETE FROM responses')
+
+    def stats(self):
+        entries, size = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+                'seconds_saved': self.seconds_saved,
+            }
+
+
+class CachedLLM:
+    """
+    Wraps a chat model. ``invoke(prompt, cache=True)`` serves repeated prompts
+    from the cache; calls that need a fresh sample (``diverse=True`` at a
+    non-zero temperature, e.g. several question batches from one prompt)
+    always reach the model. Every call is reported to ``meter`` (a
+    llm_usage.UsageMeter) when one is attached.
+    """
+
+    def __init__(self, llm, cache=None, meter=None):
+        self.llm = llm
+        self.cache = cache
+        self.meter = meter
+        self.model_name = getattr(llm, 'model_name', None) or type(llm).__name__
+        self.temperature = getattr(llm, 'temperature', None) or 0.0
+
+    def _record(self, prompt, response, cached=False):
+        if self.meter is not None:
+            self.meter.record(prompt, response, cached=cached)
+        return response
+
+    def invoke(self, prompt, cache=False, diverse=False, **kwargs):
+        if not cache or self.cache is None:
+            return self._record(prompt, self.llm.invoke(prompt, **kwargs))
+        if diverse and self.temperature > 0:
+            self.cache.record_bypass()
+            return self._record(prompt, self.llm.invoke(prompt, **kwargs))
+
+        key = cache_key(self.model_name, self.temperature, prompt)
+        hit = self.cache.get(key)
+        if hit is not None:
+            return self._record(prompt, AIMessage(content=hit[0]), cached=True)
+        start = time.perf_counter()
+        response = self.llm.invoke(prompt, **kwargs)
+        latency = time.perf_counter() - start
+        if isinstance(response.content, str) and response.content:
+            self.cache.put(key, self.model_name, self.temperature, response.content, latency)
+        return self._record(prompt, response)
+
+    async def ainvoke(self, prompt, cache=False, diverse=False, **kwargs):
+        """invoke() on the model's async client; cache reads and writes run in a thread"""
+        if not cache or self.cache is None:
+            return self._record(prompt, await self.llm.ainvoke(prompt, **kwargs))
+        if diverse and self.temperature > 0:
+            self.cache.record_bypass()
+            return self._record(prompt, await self.llm.ainvoke(prompt, **kwargs))
+
+        key = cache_key(self.model_name, self.temperature, prompt)
+        hit = await asyncio.to_thread(self.cache.get, key)
+        if hit is not None:
+            return self._record(prompt, AIMessage(content=hit[0]), cached=True)
+        start = time.perf_counter()
+        response = await self.llm.ainvoke(prompt, **kwargs)
+        latency = time.perf_counter() - start
+        if isinstance(response.content, str) and response.content:
+            await asyncio.to_thread(self.cache.put, key, self.model_name, self.temperature, response.content, latency)
+        return self._record(prompt, response)
+
+    def stream(self, prompt, cache=False, **kwargs):
+        """
+        Yield the reply as text chunks. A cache hit arrives as one chunk; a
+        miss is streamed from the model and stored once it is complete.
+        """
+        if cache and self.cache is not None:
+            key = cache_key(self.model_name, self.temperature, prompt)
+            hit = self.cache.get(key)
+            if hit is not None:
+                self._record(prompt, hit[0], cached=True)
+                yield hit[0]
+                return
+        start = time.perf_counter()
+        parts = []
+        try:
+            for chunk in self.llm.stream(prompt, **kwargs):
+                parts.append(chunk.content)
+                yield chunk.content
+        finally:
+            # Also counts the tokens of a reply cut short by an error or a disconnect
+            self._record(prompt, ''.join(parts))
+        content = ''.join(parts)
+        if content and cache and self.cache is not None:
+            self.cache.put(key, self.model_name, self.temperature, content, time.perf_counter() - start)
+
+    async def astream(self, prompt, cache=False, **kwargs):
+        """Async stream(): text chunks from the model's async client"""
+        if cache and self.cache is not None:
+            key = cache_key(self.model_name, self.temperature, prompt)
+            hit = await asyncio.to_thread(self.cache.get, key)
+            if hit is not None:
+                self._record(prompt, hit[0], cached=True)
+                yield hit[0]
+                return
+        start = time.perf_counter()
+        parts = []
+        try:
+            async for chunk in self.llm.astream(prompt, **kwargs):
+                parts.append(chunk.content)
+                yield chunk.content
+        finally:
+            self._record(prompt, ''.join(parts))
+        content = ''.join(parts)
+        if content and cache and self.cache is not None:
+            await asyncio.to_thread(self.cache.put, key, self.model_name, self.temperature, content,
+                                    time.perf_counter() - start)
@@ -0,0 +1,170 @@
+import ast
+import json
+import re
+import warnings
+
+# Tolerant parsing of JSON produced by LLMs.
+#
+# Model output is often almost-JSON: wrapped in prose or ``` fences, with
+# trailing commas, Python-style quoting, or cut off before the closing
+# bracket. JSONObjectStream scans the text once, tracking brackets and
+# strings, and emits every complete object that sits directly in an array
+# (or at the top level) as soon as its closing brace arrives. A broken or
+# truncated object only loses itself, not the rest of the batch.
+#
+# Nothing here evaluates code: the Python-literal fallback is ast.literal_eval.
+
+_FENCE = re.compile(r'```(?:json|JSON)?')
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+_ELEMENT_BOUNDARY = re.compile(r'}\s*,\s*{')
+
+
+def strip_fences(text):
+    return _FENCE.sub('', text).strip()
+
+
+def loads_lenient(text):
+    """json.loads, then with trailing commas removed, then as a Python literal; raises ValueError"""
+    # Any failure means "not parseable this way": besides ValueError, deep
+    # nesting raises RecursionError and a repaired "{{...}}" is a set of
+    # dicts, which literal_eval rejects with TypeError
+    try:
+        return json.loads(text)
+    except Exception:
+        pass
+    repaired = _TRAILING_COMMA.sub(r'\1', text)
+    try:
+        return json.loads(repaired)
+    except Exception:
+        pass
+    try:
+        # Single quotes / True / None, as produced by "Python-ish" answers
+        with warnings.catch_warnings():
+            # Invalid escapes in model text would print a SyntaxWarning per attempt
+            warnings.simplefilter('ignore')
+            return ast.literal_eval(repaired)
+    except Exception:
+        raise ValueError("Not valid JSON") from None
+
+
+class JSONObjectStream:
+    """
+    Incremental scanner: ``feed()`` text as it arrives and get back the
+    objects completed so far. Objects nested inside another object (like a
+    question's "options") are returned as part of their parent, and wrapper
+    objects such as {"questions": [...]} yield their array elements.
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._stack = []  # [opener, start offset if a candidate object, contains candidates]
+        self._quote = None
+        self._escape = False
+        self._last = None  # last significant character outside strings, and its offset
+        self._last_pos = None
+        self.skipped = 0  # complete-looking objects that could not be repaired
+
+    @property
+    def in_sync(self):
+        """False if the text so far left a string or bracket open, e.g. after a missing quote"""
+        return not self._quote and not self._stack
+
+    def feed(self, text):
+        objects = []
+        offset = len(self._text)
+        self._text += text
+        for i, char in enumerate(text, start=offset):
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+                    self._last, self._last_pos = char, i
+                continue
+            if char in '"\'' and self._stack:
+                # Quotes only count inside brackets, so an apostrophe in surrounding prose is harmless
+                self._quote = char
+            elif char in '{[':
+                if char == '{' and self._last == ',' and len(self._stack) > 1 and \
+                        self._stack[-1][0] == '{' and self._stack[-2][0] == '[':
+                    # "..., {" inside an element: its closing brace is missing, it ended at the comma
+                    objects.extend(self._close(self._stack.pop(), self._last_pos, '}'))
+                candidate = char == '{' and (not self._stack or self._stack[-1][0] == '[')
+                self._stack.append([char, i if candidate else None, False])
+            elif char in '}]':
+                opener = '{' if char == '}' else '['
+                # Ignore stray closers; close any brackets the model forgot
+                if not any(entry[0] == opener for entry in self._stack):
+                    continue
+                closers = ''
+                entry = self._stack.pop()
+                while entry[0] != opener:
+                    # An object left open by the model is completed with the closers it is missing
+                    closers += '}' if entry[0] == '{' else ']'
+                    objects.extend(self._close(entry, i, closers))
+                    entry = self._stack.pop()
+                objects.extend(self._close(entry, i + 1))
+            if not char.isspace():
+                self._last, self._last_pos = char, i
+        return objects
+
+    def _close(self, entry, end, suffix=''):
+        start, has_children = entry[1], entry[2]
+        if start is None:
+            return []
+        for ancestor in reversed(self._stack):
+            if ancestor[1] is not None:
+                ancestor[2] = True
+                break
+        if has_children:
+            return []
+        try:
+            return [loads_lenient(self._text[start:end] + suffix)]
+        except ValueError:
+            self.skipped += 1
+            return []
+
+
+def extract_json_objects(text):
+    """Every complete top-level or array-element object in ``text``, in order"""
+    text = strip_fences(text)
+    stream = JSONObjectStream()
+    objects = stream.feed(text)
+    if not stream.skipped and stream.in_sync:
+        return objects
+    # A broken string (e.g. a missing quote) throws the scan out of sync for
+    # the rest of the text: later objects are skipped, or swallowed by a string
+    # that never ends. Retry element by element and keep the better result
+    pieces = _ELEMENT_BOUNDARY.split(text)
+    recovered = []
+    for i, piece in enumerate(pieces):
+        piece = ('{' if i else '') + piece + ('}' if i < len(pieces) - 1 else '')
+        recovered.extend(JSONObjectStream().feed(piece))
+    return recovered if len(recovered) > len(objects) else objects
+
+
+def parse_json_lenient(text, default=None):
+    """
+    Parse a whole JSON value out of LLM output. Falls back to the outermost
+    bracketed span, then to the objects that can be recovered, then ``default``.
+    """
+    text = strip_fences(text)
+    try:
+        return loads_lenient(text)
+    except ValueError:
+        pass
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    if starts:
+        start = min(starts)
+        end = text.rfind(']' if text[start] == '[' else '}')
+        if end > start:
+            try:
+                return loads_lenient(text[start:end + 1])
+            except ValueError:
+                pass
+    objects = JSONObjectStream().feed(text)
+    if objects:
+        return objects if len(objects) > 1 or text.lstrip().startswith('[') else objects[0]
+    return default
@@ -0,0 +1,308 @@
+import threading
+import time
+import uuid
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .chat_memory import count_tokens
+from .llm_cache import prompt_text
+
+# LLM token accounting and quotas.
+#
+# A UsageMeter rides along with a PDFProcessor (CachedLLM reports every call
+# to it) and adds the tokens to LLMUsage rows, one per user / quiz / kind /
+# hour. Each user also has a token bucket in the Django cache: requests
+# reserve an estimate up front, which is a couple of cache operations and
+# rejects over-quota users before any model, index or LLM work, and the
+# meter settles the difference once the real usage is known. A bucket may go
+# into debt; the user then waits until it refills.
+#
+# The bucket lives in CACHES[QUIZ_LLM_QUOTA_CACHE]. With several worker
+# processes that must be a shared cache (Redis, Memcached, database), not
+# the per-process LocMemCache.
+
+
+def quota_enabled():
+    return getattr(settings, 'QUIZ_LLM_QUOTA', True)
+
+
+def chat_estimate():
+    """Tokens reserved for one chat turn"""
+    return getattr(settings, 'QUIZ_LLM_CHAT_ESTIMATE', 2500)
+
+
+def quiz_estimate(num_questions):
+    """Tokens reserved for generating ``num_questions`` questions (plus the document summary)"""
+    per_question = getattr(settings, 'QUIZ_LLM_QUESTION_ESTIMATE', 400)
+    return getattr(settings, 'QUIZ_LLM_SUMMARY_ESTIMATE', 4000) + per_question * num_questions
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"LLM usage limit reached, try again in {retry_after}s")
+
+
+class TokenBucketQuota:
+    """Per-user token bucket kept in a Django cache: ``capacity`` tokens, refilled at ``refill_per_hour``"""
+
+    def __init__(self, cache, capacity, refill_per_hour, prefix='llm_quota'):
+        self.cache = cache
+        self.capacity = capacity
+        self.rate = refill_per_hour / 3600.0
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return f'{self.prefix}:{user_id}'
+
+    def _lock(self, user_id, attempts=20):
+        """
+        Best-effort lock (cache.add is atomic); gives up after ~100ms rather
+        than block a request. Returns the token to unlock with, or None.
+        """
+        token = uuid.uuid4().hex
+        for _ in range(attempts):
+            if self.cache.add(f'{self._key(user_id)}:lock', token, timeout=2):
+                return token
+            time.sleep(0.005)
+        return None
+
+    def _unlock(self, user_id, token):
+        # Only release our own lock: after the timeout another request may hold it
+        key = f'{self._key(user_id)}:lock'
+        if token and self.cache.get(key) == token:
+            self.cache.delete(key)
+
+    def _level(self, user_id, now):
+        state = self.cache.get(self._key(user_id))
+        if state is None:
+            return float(self.capacity)
+        level, updated = state
+        return min(float(self.capacity), level + (now - updated) * self.rate)
+
+    def _store(self, user_id, level, now):
+        if level >= self.capacity:
+            # A full bucket is the default; no need to keep the key
+            self.cache.delete(self._key(user_id))
+            return
+        # Expire once it would have refilled anyway
+        timeout = int((self.capacity - level) / self.rate) + 60 if self.rate else None
+        self.cache.set(self._key(user_id), (level, now), timeout=timeout)
+
+    def level(self, user_id):
+        return self._level(user_id, time.time())
+
+    def retry_after(self, level, tokens):
+        if not self.rate:
+            return None
+        return max(1, int((min(tokens, self.capacity) - level) / self.rate) + 1)
+
+    def acquire(self, user_id, tokens):
+        """Reserve ``tokens``; raises QuotaExceeded (with seconds to wait) if the bucket is too low"""
+        locked = self._lock(user_id)
+        try:
+            now = time.time()
+            level = self._level(user_id, now)
+            # A request bigger than the whole bucket is allowed once the bucket is full
+            if level < min(tokens, self.capacity):
+                metrics.incr('llm_quota.rejected')
+                raise QuotaExceeded(self.retry_after(level, tokens))
+            self._store(user_id, level - tokens, now)
+        finally:
+            self._unlock(user_id, locked)
+
+    def charge(self, user_id, tokens):
+        """Take (or, if negative, give back) ``tokens`` without checking the level"""
+        if not tokens:
+            return
+        locked = self._lock(user_id)
+        try:
+            now = time.time()
+            self._store(user_id, self._level(user_id, now) - tokens, now)
+        finally:
+            self._unlock(user_id, locked)
+
+
+_quota = None
+_quota_lock = threading.Lock()
+
+
+def get_quota():
+    """The process-wide TokenBucketQuota configured in settings"""
+    global _quota
+    if _quota is None:
+        with _quota_lock:
+            if _quota is None:
+                capacity = getattr(settings, 'QUIZ_LLM_QUOTA_TOKENS', 100000)
+                _quota = TokenBucketQuota(
+                    caches[getattr(settings, 'QUIZ_LLM_QUOTA_CACHE', 'default')],
+                    capacity,
+                    getattr(settings, 'QUIZ_LLM_QUOTA_REFILL_PER_HOUR', capacity),
+                )
+    return _quota
+
+
+def is_exempt(user):
+    return user.is_staff and getattr(settings, 'QUIZ_LLM_QUOTA_EXEMPT_STAFF', True)
+
+
+def reserve_tokens(user, tokens):
+    """
+    Reserve quota for a request by ``user``; returns the number of tokens
+    reserved (0 when quotas are off or the user is exempt). Raises QuotaExceeded.
+    """
+    if not quota_enabled() or is_exempt(user):
+        return 0
+    get_quota().acquire(user.id, tokens)
+    return tokens
+
+
+async def areserve_tokens(user, tokens):
+    return await sync_to_async(reserve_tokens)(user, tokens)
+
+
+def release_tokens(user, tokens):
+    """Give back a reservation for a request that never reached the LLM"""
+    if tokens and quota_enabled():
+        get_quota().charge(user.id, -tokens)
+
+
+def _window_start(when=None):
+    return (when or timezone.now()).replace(minute=0, second=0, microsecond=0)
+
+
+def _add_usage(key, counts):
+    """Add ``counts`` to the LLMUsage row for ``key``, creating it if needed"""
+    from .models import LLMUsage
+    increments = {field: F(field) + value for field, value in counts.items()}
+    quiz_id = key.pop('quiz_id')
+    # Rows are looked up by scope, the non-null stand-in for the quiz
+    key['scope'] = str(quiz_id) if quiz_id else ''
+    if LLMUsage.objects.filter(**key).update(**increments):
+        return
+    try:
+        # Savepoint, so losing the race doesn't break an enclosing transaction
+        with transaction.atomic():
+            LLMUsage.objects.create(**key, quiz_id=quiz_id, **counts)
+    except IntegrityError:
+        # A concurrent flush created the row first
+        LLMUsage.objects.filter(**key).update(**increments)
+
+
+def fold_quiz_usage(quiz_id):
+    """Move a quiz's usage into its users' quiz-less rows (before the quiz is deleted)"""
+    from .models import LLMUsage
+    rows = LLMUsage.objects.filter(quiz_id=quiz_id)
+    for row in rows:
+        _add_usage(
+            {'user_id': row.user_id, 'quiz_id': None, 'kind': row.kind, 'window_start': row.window_start},
+            {field: getattr(row, field) for field in ('calls', 'cached_calls', 'prompt_tokens', 'completion_tokens')},
+        )
+    rows.delete()
+
+
+class UsageMeter:
+    """
+    Tokens used by LLM calls made for one user (and quiz). CachedLLM calls
+    ``record()``; ``flush()`` adds what was recorded since the last flush to
+    LLMUsage and settles the quota reservation. Thread-safe, as the
+    summarize and question batches run concurrently. Usage of users exempt
+    from the quota (``charge_quota=False``) is recorded but not charged.
+    """
+
+    def __init__(self, user_id, kind, quiz_id=None, reserved=0, charge_quota=True):
+        self.user_id = user_id
+        self.kind = kind
+        self.quiz_id = quiz_id
+        self.reserved = reserved
+        self.charge_quota = charge_quota
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cached_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, prompt, response=None, cached=False):
+        """Count one call; ``response`` is an AIMessage or the reply text"""
+        content = getattr(response, 'content', response) or ''
+        usage = getattr(response, 'usage_metadata', None) or {}
+        if cached:
+            # Answered from the response cache: no tokens reach the provider
+            prompt_tokens = completion_tokens = 0
+        else:
+            prompt_tokens = usage.get('input_tokens') or count_tokens(prompt_text(prompt))
+            completion_tokens = usage.get('output_tokens') or count_tokens(content if isinstance(content, str) else '')
+        with self._lock:
+            self.calls += 1
+            self.cached_calls += int(cached)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def _take(self):
+        with self._lock:
+            counts = {
+                'calls': self.calls,
+                'cached_calls': self.cached_calls,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+            }
+            self.calls = self.cached_calls = self.prompt_tokens = self.completion_tokens = 0
+            reserved, self.reserved = self.reserved, 0
+        return counts, reserved
+
+    def flush(self):
+        """Save the usage recorded since the last flush and settle the reservation"""
+        counts, reserved = self._take()
+        used = counts['prompt_tokens'] + counts['completion_tokens']
+        if counts['calls']:
+            _add_usage({
+                'user_id': self.user_id,
+                'quiz_id': self.quiz_id,
+                'kind': self.kind,
+                'window_start': _window_start(),
+            }, counts)
+            metrics.incr(f'llm_usage.{self.kind}.tokens', used)
+        if self.charge_quota and quota_enabled() and (reserved or used):
+            # Charge the difference between what was used and what was reserved
+            get_quota().charge(self.user_id, used - reserved)
+        return used
+
+    async def aflush(self):
+        return await sync_to_async(self.flush)()
+
+
+def usage_summary(since):
+    """Per-user token totals since ``since``, with the remaining quota, largest users first"""
+    from django.db.models import Sum
+    from .models import LLMUsage
+    rows = (LLMUsage.objects.filter(window_start__gte=_window_start(since))
+            .values('user_id', 'user__username', 'kind')
+            .annotate(calls=Sum('calls'), cached_calls=Sum('cached_calls'),
+                      prompt_tokens=Sum('prompt_tokens'), completion_tokens=Sum('completion_tokens')))
+    users = {}
+    for row in rows:
+        user = users.setdefault(row['user_id'], {
+            'user_id': row['user_id'],
+            'username': row['user__username'],
+            'total_tokens': 0,
+            'kinds': {},
+        })
+        tokens = row['prompt_tokens'] + row['completion_tokens']
+        user['total_tokens'] += tokens
+        user['kinds'][row['kind']] = {
+            'calls': row['calls'],
+            'cached_calls': row['cached_calls'],
+            'prompt_tokens': row['prompt_tokens'],
+            'completion_tokens': row['completion_tokens'],
+        }
+    result = sorted(users.values(), key=lambda user: user['total_tokens'], reverse=True)
+    if quota_enabled():
+        quota = get_quota()
+        for user in result:
+            user['quota_remaining'] = int(quota.level(user['user_id']))
+    return result
@@ -0,0 +1,115 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from quiz_app import model_registry
+from quiz_app.benchmarking import parse_int_list, write_results
+from quiz_app.fake_llm import FakeChatModel
+from quiz_app.models import ChatSession, Quiz
+from quiz_app.vector_store import PDFProcessor
+from quiz_app.views import generate_ai_response, agenerate_ai_response
+
+
+def _summary(mode, clients, latencies, seconds):
+    return {
+        'mode': mode,
+        'clients': clients,
+        'requests': len(latencies),
+        'seconds': seconds,
+        'requests_per_sec': len(latencies) / seconds,
+        'p50_ms': 1000 * float(np.percentile(latencies, 50)),
+        'p95_ms': 1000 * float(np.percentile(latencies, 95)),
+    }
+
+
+class Command(BaseCommand):
+    help = ("Load test the chat reply path with the fake LLM: requests/sec per worker for the sync path "
+            "(a thread per in-flight chat) against the async path (one event loop)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', default='1,8,32,64', help="Comma separated numbers of concurrent students")
+        parser.add_argument('--requests', type=int, default=3, help="Chat turns per student")
+        parser.add_argument('--threads', type=int, default=8,
+                            help="Worker threads available to the sync path (the ASGI server's thread pool)")
+        parser.add_argument('--latency', type=float, default=0.5, help="Seconds per fake LLM reply")
+        parser.add_argument('--jitter', type=float, default=0.1)
+        parser.add_argument('--quiz', help="Quiz id to chat about (RAG path); default is a general session")
+        parser.add_argument('--fake-embeddings', action='store_true',
+                            help="Use deterministic fake embeddings instead of MiniLM")
+        parser.add_argument('--output', help="Write the results as JSON to this file (- for stdout)")
+
+    def handle(self, *args, **options):
+        llm = FakeChatModel(latency=options['latency'], jitter=options['jitter'])
+        embeddings = DeterministicFakeEmbedding(size=384) if options['fake_embeddings'] else None
+        processor = PDFProcessor(llm=llm, embeddings=embeddings, use_llm_cache=False)
+        model_registry.get_search_executor()
+
+        quiz = Quiz.objects.get(id=options['quiz']) if options['quiz'] else None
+        user = User.objects.create(username=f"bench-chat-{uuid.uuid4().hex[:12]}")
+        try:
+            max_clients = max(parse_int_list(options['clients']))
+            sessions = [
+                ChatSession.objects.create(user=quiz.creator if quiz else user, quiz=quiz, title=f"bench {i}")
+                for i in range(max_clients)
+            ]
+            # Fetch them the way the views do, with the quiz already joined
+            sessions = list(ChatSession.objects.select_related('quiz').filter(id__in=[s.id for s in sessions]))
+            # Like use_llm_cache=False: every turn must reach the model, or the async
+            # run would be served answers the sync run left in the semantic cache
+            with override_settings(QUIZ_ANSWER_CACHE=False):
+                results = self.run(processor, sessions, options)
+        finally:
+            ChatSession.objects.filter(title__startswith="bench ", user=quiz.creator if quiz else user).delete()
+            user.delete()
+
+        if options['output']:
+            write_results(options['output'], 'chat_concurrency', results, latency=options['latency'],
+                          threads=options['threads'], rag=bool(quiz))
+
+    def run(self, processor, sessions, options):
+        self.stdout.write(f"{'clients':>8} {'mode':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        results = []
+        for clients in parse_int_list(options['clients']):
+            turns = [(sessions[c], f"Student {c}, turn {t}: how does energy flow through the system?")
+                     for t in range(options['requests']) for c in range(clients)]
+
+            # Before: every in-flight chat holds a thread for the whole LLM round trip
+            def timed(session, message):
+                start = time.perf_counter()
+                generate_ai_response(session, message, processor)
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=min(options['threads'], clients)) as executor:
+                latencies = list(executor.map(lambda turn: timed(*turn), turns))
+            results.append(_summary('sync', clients, latencies, time.perf_counter() - start))
+
+            # After: all chats wait on the model concurrently on one event loop
+            async def run_async():
+                async def timed_async(session, message):
+                    turn_start = time.perf_counter()
+                    await agenerate_ai_response(session, message, processor)
+                    return time.perf_counter() - turn_start
+
+                semaphore = asyncio.Semaphore(clients)
+
+                async def bounded(turn):
+                    async with semaphore:
+                        return await timed_async(*turn)
+
+                return await asyncio.gather(*(bounded(turn) for turn in turns))
+
+            start = time.perf_counter()
+            latencies = asyncio.run(run_async())
+            results.append(_summary('async', clients, latencies, time.perf_counter() - start))
+
+            for result in results[-2:]:
+                self.stdout.write(f"{clients:>8} {result['mode']:>6} {result['requests_per_sec']:>8.1f} "
+                                  f"{result['p50_ms']:>8.0f} {result['p95_ms']:>8.0f}")
+        return results
@@ -0,0 +1,220 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from quiz_app import model_registry
+from quiz_app.benchmarking import (
+    StubChatModel, LookupEmbeddings, write_synthetic_pdf, parse_int_list, directory_size_mb, write_results,
+    run_isolated, reset_peak_rss, current_rss_mb, peak_rss_mb,
+)
+from quiz_app.embedding_cache import CachedEmbeddings
+from quiz_app.vector_backends import choose_backend, get_backend
+from quiz_app.vector_store import PDFProcessor
+
+# Text density presets: (lines per page, words per line)
+DENSITIES = {
+    'sparse': (15, 8),
+    'normal': (45, 12),
+    'dense': (60, 18),
+}
+
+# Metrics compared against a baseline, and whether higher is better
+TRACKED = {
+    'pages_per_sec': True,
+    'chunks_per_sec': True,
+    'embeddings_per_sec': True,
+    'index_build_seconds': False,
+    'save_seconds': False,
+    'load_seconds': False,
+    'end_to_end_seconds': False,
+    'peak_rss_delta_mb': False,
+}
+
+
+def _stages(pdf_path, pages, backend_name, embeddings, store_path):
+    """Time each ingestion stage on its own, in a fresh process"""
+    splitter = model_registry.get_text_splitter()
+    start = time.perf_counter()
+    documents = PyPDFLoader(pdf_path).load()
+    parse_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = splitter.split_documents(documents)
+    split_seconds = time.perf_counter() - start
+
+    texts = [chunk.page_content for chunk in chunks]
+    start = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    embed_seconds = time.perf_counter() - start
+
+    # Index build with the vectors precomputed, so it excludes the model
+    backend = choose_backend(len(chunks)) if backend_name == 'auto' else get_backend(backend_name)
+    start = time.perf_counter()
+    vector_store = backend.create(chunks, LookupEmbeddings(texts, vectors))
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    backend.save(vector_store, store_path, model_name=model_registry.EMBEDDING_MODEL_NAME)
+    save_seconds = time.perf_counter() - start
+    store_mb = directory_size_mb(store_path)
+
+    start = time.perf_counter()
+    backend.load(store_path, embeddings)
+    load_seconds = time.perf_counter() - start
+
+    return {
+        'backend': backend.name,
+        'chunks': len(chunks),
+        'parse_seconds': parse_seconds,
+        'pages_per_sec': pages / parse_seconds,
+        'split_seconds': split_seconds,
+        'chunks_per_sec': len(chunks) / split_seconds if split_seconds else 0.0,
+        'embed_seconds': embed_seconds,
+        'embeddings_per_sec': len(texts) / embed_seconds if embed_seconds else 0.0,
+        'index_build_seconds': build_seconds,
+        'save_seconds': save_seconds,
+        'load_seconds': load_seconds,
+        'store_mb': store_mb,
+    }
+
+
+def _end_to_end(pdf_path, backend_name, embeddings, streaming, batch_size):
+    """process_pdf as the app runs it, for wall time and peak memory"""
+    processor = PDFProcessor(llm=StubChatModel(), embeddings=embeddings, use_llm_cache=False)
+    reset_peak_rss()
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    processor.process_pdf(pdf_path, streaming=streaming, batch_size=batch_size,
+                          backend=None if backend_name == 'auto' else backend_name)
+    return {
+        'end_to_end_seconds': time.perf_counter() - start,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_delta_mb': peak_rss_mb() - baseline,
+    }
+
+
+def _median(runs):
+    """Merge repeated runs: median of every measurement (counts are the same in every run)"""
+    merged = dict(runs[0])
+    for key, value in runs[0].items():
+        if isinstance(value, float):
+            merged[key] = statistics.median(run[key] for run in runs)
+    return merged
+
+
+def compare(results, baseline, tolerance):
+    """Rows of (case, metric, baseline, current, change) and the list of regressions"""
+    previous = {(r['pages'], r['density']): r for r in baseline.get('results', [])}
+    rows, regressions = [], []
+    for result in results:
+        before = previous.get((result['pages'], result['density']))
+        if before is None:
+            continue
+        for metric, higher_is_better in TRACKED.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            row = (f"{result['pages']}p/{result['density']}", metric, old, new, change)
+            rows.append(row)
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(row)
+    return rows, regressions
+
+
+class Command(BaseCommand):
+    help = ("Benchmark PDF ingestion (parse, split, embed, index build, save/load) on synthetic PDFs "
+            "and write the results as JSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', default='10,100,500', help="Comma separated page counts")
+        parser.add_argument('--densities', default='sparse,normal,dense',
+                            help=f"Comma separated text densities ({', '.join(DENSITIES)})")
+        parser.add_argument('--backend', default='numpy', help="Vector backend: numpy, hnsw, faiss or auto")
+        parser.add_argument('--repeat', type=int, default=1, help="Runs per case; the median is reported")
+        parser.add_argument('--batch-size', type=int, default=None, help="Streaming embed batch size")
+        parser.add_argument('--eager', action='store_true', help="End-to-end run without streaming ingestion")
+        parser.add_argument('--fake-embeddings', action='store_true',
+                            help="Use deterministic fake embeddings instead of MiniLM (isolates parse/index cost)")
+        parser.add_argument('--output', default='bench-ingestion.json', help="Results file, or - for stdout")
+        parser.add_argument('--baseline', help="Earlier results file to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.15,
+                            help="Relative change that counts as a regression")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        densities = [d.strip() for d in options['densities'].split(',') if d.strip()]
+        unknown = [d for d in densities if d not in DENSITIES]
+        if unknown:
+            raise CommandError(f"Unknown density: {', '.join(unknown)}")
+        if options['fake_embeddings']:
+            embeddings = DeterministicFakeEmbedding(size=384)
+        else:
+            # Load once in the parent so every forked run shares the model pages.
+            # The embedding cache is bypassed: repeated runs would only measure cache hits.
+            embeddings = model_registry.get_embeddings()
+            if isinstance(embeddings, CachedEmbeddings):
+                embeddings = embeddings.embeddings
+
+        # With --output - the JSON goes to stdout, so the table goes to stderr
+        out = self.stderr if options['output'] == '-' else self.stdout
+        out.write(f"{'pages':>6} {'density':>8} {'chunks':>7} {'pages/s':>9} {'chunks/s':>10} {'emb/s':>8} "
+                  f"{'build s':>8} {'save s':>7} {'load s':>7} {'e2e s':>7} {'peak MB':>8}")
+        results = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for pages in parse_int_list(options['pages']):
+                for density in densities:
+                    lines_per_page, words_per_line = DENSITIES[density]
+                    pdf_path = write_synthetic_pdf(os.path.join(tmp, f'{pages}_{density}.pdf'), pages,
+                                                   lines_per_page=lines_per_page, words_per_line=words_per_line)
+                    runs = []
+                    for run in range(options['repeat']):
+                        store_path = os.path.join(tmp, f'store_{pages}_{density}_{run}')
+                        result = run_isolated(_stages, pdf_path, pages, options['backend'], embeddings, store_path)
+                        result.update(run_isolated(_end_to_end, pdf_path, options['backend'], embeddings,
+                                                   not options['eager'], options['batch_size']))
+                        runs.append(result)
+                    result = {
+                        'pages': pages,
+                        'density': density,
+                        'pdf_mb': os.path.getsize(pdf_path) / (1024 * 1024),
+                        **_median(runs),
+                    }
+                    results.append(result)
+                    out.write(
+                        f"{pages:>6} {density:>8} {result['chunks']:>7} {result['pages_per_sec']:>9.1f} "
+                        f"{result['chunks_per_sec']:>10.1f} {result['embeddings_per_sec']:>8.1f} "
+                        f"{result['index_build_seconds']:>8.3f} {result['save_seconds']:>7.3f} "
+                        f"{result['load_seconds']:>7.3f} {result['end_to_end_seconds']:>7.2f} "
+                        f"{result['peak_rss_delta_mb']:>8.1f}"
+                    )
+
+        write_results(
+            options['output'], 'ingestion', results,
+            backend=options['backend'],
+            streaming=not options['eager'],
+            repeat=options['repeat'],
+            embedding_model='fake' if options['fake_embeddings'] else model_registry.EMBEDDING_MODEL_NAME,
+        )
+        if options['output'] != '-':
+            out.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            rows, regressions = compare(results, baseline, options['tolerance'])
+            out.write(f"\nAgainst {options['baseline']} ({baseline.get('git_commit') or 'unknown commit'}):")
+            for case, metric, old, new, change in rows:
+                flag = ' REGRESSION' if (case, metric, old, new, change) in regressions else ''
+                out.write(f"{case:>14} {metric:>20} {old:>10.3f} -> {new:>10.3f} {change:>+8.1%}{flag}")
+            if regressions:
+                message = f"{len(regressions)} metric(s) regressed by more than {options['tolerance']:.0%}"
+                if options['fail_on_regression']:
+                    raise CommandError(message)
+                out.write(self.style.WARNING(message))
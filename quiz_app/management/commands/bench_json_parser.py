@@ -0,0 +1,150 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app.llm_json import extract_json_objects, parse_json_lenient
+
+
+def _question(rng, n):
+    words = ["energy", "cell", "system", "model", "process", "value", "it's", "\"quoted\"", "{braces}", "[list]"]
+    return {
+        'mcq': f"Question {n}: which {' '.join(rng.choice(words) for _ in range(6))}?",
+        'options': {letter: f"Option {letter} {rng.choice(words)}" for letter in 'ABCD'},
+        'correct': rng.choice('ABCD'),
+    }
+
+
+def _elements(questions, indent):
+    return [json.dumps(q, indent=indent) for q in questions]
+
+
+# Each mutation turns a list of questions into LLM-like text
+def clean(rng, qs):
+    return json.dumps(qs, indent=rng.choice([None, 2]))
+
+
+def fenced(rng, qs):
+    return f"```json\n{json.dumps(qs, indent=2)}\n```"
+
+
+def prose(rng, qs):
+    return f"Here are the questions you asked for:\n{json.dumps(qs)}\nLet me know if you'd like more!"
+
+
+def wrapper(rng, qs):
+    return json.dumps({'questions': qs})
+
+
+def python_literal(rng, qs):
+    return repr(qs)
+
+
+def trailing_commas(rng, qs):
+    return "[" + ",\n".join(e[:-1] + ",}" for e in _elements(qs, None)) + ",\n]"
+
+
+def truncated(rng, qs):
+    text = json.dumps(qs, indent=2)
+    return text[:rng.randint(len(text) // 2, len(text) - 1)]
+
+
+def missing_bracket(rng, qs):
+    return json.dumps(qs)[:-1]
+
+
+def missing_brace(rng, qs):
+    elements = _elements(qs, None)
+    i = rng.randrange(len(elements))
+    elements[i] = elements[i][:-1]
+    return "[" + ", ".join(elements) + "]"
+
+
+def broken_item(rng, qs):
+    elements = _elements(qs, None)
+    i = rng.randrange(len(elements))
+    elements[i] = elements[i].replace('"correct": "', '"correct": ', 1)
+    return "[" + ", ".join(elements) + "]"
+
+
+def missing_quote(rng, qs):
+    # An unterminated string swallows the rest of the text unless recovery resyncs
+    elements = _elements(qs, None)
+    i = rng.randrange(len(elements))
+    elements[i] = elements[i].replace('?", "options"', '?, "options"', 1)
+    return "[" + ", ".join(elements) + "]"
+
+
+def doubled_braces(rng, qs):
+    # {{...}} reads as a Python set containing a dict
+    elements = _elements(qs, None)
+    i = rng.randrange(len(elements))
+    elements[i] = '{' + elements[i] + '}'
+    return "[" + ", ".join(elements) + "]"
+
+
+def deep_nesting(rng, qs):
+    return '[' * rng.randint(1000, 5000) + json.dumps(qs)
+
+
+def random_deletions(rng, qs):
+    text = list(json.dumps(qs))
+    for _ in range(rng.randint(1, 5)):
+        del text[rng.randrange(len(text))]
+    return ''.join(text)
+
+
+MUTATIONS = [clean, fenced, prose, wrapper, python_literal, trailing_commas, truncated,
+             missing_bracket, missing_brace, broken_item, missing_quote, doubled_braces, deep_nesting,
+             random_deletions]
+
+
+def _strict(text):
+    """The old behaviour: all or nothing"""
+    try:
+        items = json.loads(text.strip().replace("```json", "").replace("```", "").strip())
+    except (ValueError, RecursionError):
+        return []
+    return items if isinstance(items, list) else []
+
+
+def _recovered(expected, items):
+    wanted = {q['mcq'] for q in expected}
+    return len({item.get('mcq') for item in items if isinstance(item, dict)} & wanted)
+
+
+class Command(BaseCommand):
+    help = "Fuzz corpus for the tolerant LLM JSON parser: questions recovered per kind of malformed output"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cases', type=int, default=300, help="Random cases per mutation")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(f"{'mutation':>17} {'strict %':>9} {'tolerant %':>11} {'us/case':>8} {'errors':>7}")
+        failures = 0
+        for mutation in MUTATIONS:
+            total = strict = tolerant = errors = 0
+            seconds = 0.0
+            for _ in range(options['cases']):
+                questions = [_question(rng, n) for n in range(rng.randint(1, 8))]
+                text = mutation(rng, questions)
+                total += len(questions)
+                strict += _recovered(questions, _strict(text))
+                start = time.perf_counter()
+                try:
+                    items = extract_json_objects(text)
+                    parse_json_lenient(text, default={})
+                except Exception as e:
+                    # The parser must never raise, whatever the input
+                    errors += 1
+                    items = []
+                    self.stderr.write(f"{mutation.__name__}: {e!r} on {text[:80]!r}")
+                seconds += time.perf_counter() - start
+                tolerant += _recovered(questions, items)
+            failures += errors
+            self.stdout.write(f"{mutation.__name__:>17} {100 * strict / total:>9.1f} {100 * tolerant / total:>11.1f} "
+                              f"{1e6 * seconds / options['cases']:>8.1f} {errors:>7}")
+        if failures:
+            raise CommandError(f"{failures} case(s) raised")
@@ -0,0 +1,63 @@
+import os
+import tempfile
+from django.core.management.base import BaseCommand
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from quiz_app import metrics, model_registry
+from quiz_app.benchmarking import time_call, write_synthetic_pdf
+from quiz_app.fake_llm import FakeChatModel
+from quiz_app.vector_store import PDFProcessor
+
+
+class Command(BaseCommand):
+    help = ("Run the PDF -> summary -> questions pipeline offline against the fake LLM "
+            "and report the time spent in each stage")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pdf', help="PDF to process (default: a synthetic one)")
+        parser.add_argument('--pages', type=int, default=20, help="Pages in the synthetic PDF")
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--difficulty', default='medium')
+        parser.add_argument('--concurrency', type=int, default=None)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--latency', type=float, default=0.3, help="Seconds per fake LLM call")
+        parser.add_argument('--jitter', type=float, default=0.1)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--fake-embeddings', action='store_true',
+                            help="Use deterministic fake embeddings instead of MiniLM (fully offline)")
+
+    def handle(self, *args, **options):
+        llm = FakeChatModel(seed=options['seed'], latency=options['latency'], jitter=options['jitter'],
+                            error_rate=options['error_rate'])
+        if options['fake_embeddings']:
+            embeddings = DeterministicFakeEmbedding(size=384)
+        else:
+            embeddings = model_registry.get_embeddings()
+        processor = PDFProcessor(llm=llm, embeddings=embeddings, max_concurrency=options['concurrency'],
+                                 use_llm_cache=False)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = options['pdf']
+            if not pdf_path:
+                pdf_path = os.path.join(tmp, 'synthetic.pdf')
+                write_synthetic_pdf(pdf_path, options['pages'], seed=options['seed'])
+
+            vector_store, ingest_seconds = time_call(processor.process_pdf, pdf_path)
+            summary, summary_seconds = time_call(processor.summarize_chunkwise, vector_store)
+            questions, question_seconds = time_call(
+                processor.generate_questions, vector_store, options['difficulty'], options['questions'],
+                summary=summary,
+            )
+
+        calls = len(processor.last_batch_stats)
+        self.stdout.write(f"{'stage':>12} {'seconds':>9}")
+        self.stdout.write(f"{'ingest':>12} {ingest_seconds:>9.2f}")
+        self.stdout.write(f"{'summarize':>12} {summary_seconds:>9.2f}")
+        self.stdout.write(f"{'questions':>12} {question_seconds:>9.2f}")
+        self.stdout.write(f"{'total':>12} {ingest_seconds + summary_seconds + question_seconds:>9.2f}")
+        self.stdout.write(f"chunks={processor.chunk_count(vector_store)} questions={len(questions)}/{options['questions']} "
+                          f"batches={calls} summary_chars={len(summary)}")
+        snapshot = metrics.snapshot()
+        for name in ('summarize.group', 'generate.batch'):
+            if name in snapshot['timings']:
+                self.stdout.write(f"{name}: {snapshot['timings'][name]}")
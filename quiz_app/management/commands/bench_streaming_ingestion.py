@@ -0,0 +1,56 @@
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from quiz_app import model_registry
+from quiz_app.benchmarking import (
+    StubChatModel, write_synthetic_pdf, parse_int_list,
+    run_isolated, reset_peak_rss, current_rss_mb, peak_rss_mb,
+)
+from quiz_app.vector_store import PDFProcessor
+
+
+def _ingest(pdf_path, pages, streaming, batch_size, embeddings):
+    processor = PDFProcessor(llm=StubChatModel(), embeddings=embeddings)
+    reset_peak_rss()
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    vector_store = processor.process_pdf(pdf_path, streaming=streaming, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    return {
+        'chunks': processor.chunk_count(vector_store),
+        'seconds': seconds,
+        'pages_per_sec': pages / seconds,
+        'peak_rss_delta_mb': peak_rss_mb() - baseline,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare peak memory and throughput of streaming vs. eager PDF ingestion on synthetic PDFs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', default='10,100,1000', help="Comma separated page counts")
+        parser.add_argument('--batch-size', type=int, default=64, help="Chunks embedded per batch in streaming mode")
+        parser.add_argument('--fake-embeddings', action='store_true',
+                            help="Use deterministic fake embeddings instead of MiniLM (isolates parse/index cost)")
+
+    def handle(self, *args, **options):
+        if options['fake_embeddings']:
+            embeddings = DeterministicFakeEmbedding(size=384)
+        else:
+            # Load once in the parent so every forked run shares the model pages
+            embeddings = model_registry.get_embeddings()
+
+        self.stdout.write(f"{'pages':>6} {'mode':>10} {'chunks':>7} {'seconds':>9} {'pages/s':>9} {'peak MB':>9}")
+        with tempfile.TemporaryDirectory() as tmp:
+            for pages in parse_int_list(options['pages']):
+                pdf_path = write_synthetic_pdf(os.path.join(tmp, f'synthetic_{pages}.pdf'), pages)
+                for streaming in (False, True):
+                    result = run_isolated(_ingest, pdf_path, pages, streaming, options['batch_size'], embeddings)
+                    mode = 'streaming' if streaming else 'eager'
+                    self.stdout.write(
+                        f"{pages:>6} {mode:>10} {result['chunks']:>7} {result['seconds']:>9.2f} "
+                        f"{result['pages_per_sec']:>9.1f} {result['peak_rss_delta_mb']:>9.1f}"
+                    )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from quiz_app.benchmarking import StubChatModel, synthetic_documents, time_call, parse_int_list
+from quiz_app.vector_store import PDFProcessor
+
+
+class Command(BaseCommand):
+    help = "Benchmark PDFProcessor.summarize_chunkwise against a stubbed LLM at different concurrency limits"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', type=int, default=30, help="Number of synthetic chunks in the store")
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds the stub LLM sleeps per call")
+        parser.add_argument('--concurrency', default='1,2,4,8', help="Comma separated concurrency limits to try")
+
+    def handle(self, *args, **options):
+        embeddings = DeterministicFakeEmbedding(size=384)
+        llm = StubChatModel(latency=options['latency'])
+        vector_store = FAISS.from_documents(synthetic_documents(options['chunks']), embeddings)
+
+        baseline = None
+        self.stdout.write(f"{'concurrency':>12} {'seconds':>10} {'speedup':>9}")
+        for concurrency in parse_int_list(options['concurrency']):
+            processor = PDFProcessor(llm=llm, embeddings=embeddings, max_concurrency=concurrency,
+                                     use_llm_cache=False)
+            _, seconds = time_call(processor.summarize_chunkwise, vector_store, max_chunks=options['chunks'])
+            baseline = baseline or seconds
+            self.stdout.write(f"{concurrency:>12} {seconds:>10.2f} {baseline / seconds:>8.2f}x")
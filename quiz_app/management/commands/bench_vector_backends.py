@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand
+from langchain_core.documents import Document
+
+from quiz_app.benchmarking import (
+    LookupEmbeddings, clustered_vectors, parse_int_list,
+    run_isolated, reset_peak_rss, current_rss_mb, peak_rss_mb,
+)
+from quiz_app.vector_backends import BACKENDS
+
+
+def _build(backend_name, store_path, texts, vectors, batch_size):
+    """Build and save a store the way ingestion does (batched appends), in a fresh process"""
+    backend = BACKENDS[backend_name]
+    embeddings = LookupEmbeddings(texts, vectors)
+    documents = [Document(page_content=text) for text in texts]
+    reset_peak_rss()
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    vector_store = backend.create(documents[:batch_size], embeddings)
+    for i in range(batch_size, len(documents), batch_size):
+        vector_store = backend.add(vector_store, documents[i:i + batch_size])
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    backend.save(vector_store, store_path)
+    return {
+        'build_seconds': build_seconds,
+        'save_seconds': time.perf_counter() - start,
+        'build_peak_mb': peak_rss_mb() - baseline,
+    }
+
+
+def _query(backend_name, store_path, queries, truth, k, ef_search=None):
+    """Load a saved store and run the queries through its retriever, as the chat does, in a fresh process"""
+    backend = BACKENDS[backend_name]
+    query_texts = [f"query {i}" for i in range(len(queries))]
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    vector_store = backend.load(store_path, LookupEmbeddings(query_texts, queries))
+    load_seconds = time.perf_counter() - start
+    search_kwargs = backend.search_kwargs(k)
+    if ef_search:
+        search_kwargs['ef_search'] = ef_search
+    retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
+    latencies = []
+    hits = 0
+    for text, expected in zip(query_texts, truth):
+        start = time.perf_counter()
+        results = retriever.invoke(text)
+        latencies.append(time.perf_counter() - start)
+        found = {int(doc.page_content.split()[1]) for doc in results}
+        hits += len(found & set(expected.tolist()))
+    return {
+        'load_seconds': load_seconds,
+        'ms_per_query': 1000 * float(np.mean(latencies)),
+        'p95_ms': 1000 * float(np.percentile(latencies, 95)),
+        'recall': hits / (k * len(queries)),
+        'query_rss_mb': current_rss_mb() - baseline,
+    }
+
+
+class Command(BaseCommand):
+    help = "Build/load time, query latency, recall and memory of the numpy, hnsw and faiss vector backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', default='300,5000,50000', help="Comma separated store sizes")
+        parser.add_argument('--backends', default=','.join(BACKENDS), help="Comma separated backend names")
+        parser.add_argument('--dim', type=int, default=384)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=64, help="Chunks appended per batch while building")
+        parser.add_argument('-k', type=int, default=3)
+        parser.add_argument('--ef-search', default='',
+                            help="Comma separated HNSW ef_search values to compare (default: QUIZ_HNSW_EF_SEARCH)")
+
+    def handle(self, *args, **options):
+        k = options['k']
+        dim = options['dim']
+        backends = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        ef_values = parse_int_list(options['ef_search']) or [None]
+        self.stdout.write(
+            f"{'chunks':>7} {'backend':>8} {'build s':>8} {'save s':>7} {'build MB':>9} {'load ms':>8} "
+            f"{'ms/query':>9} {'p95 ms':>7} {'recall@k':>9} {'query MB':>9} {'disk MB':>8}"
+        )
+
+        for count in parse_int_list(options['chunks']):
+            vectors = clustered_vectors(count, dim)
+            queries = clustered_vectors(options['queries'], dim, seed=1)
+            texts = [f"chunk {i}" for i in range(count)]
+            exact = faiss.IndexFlatL2(dim)
+            exact.add(vectors)
+            _, truth = exact.search(queries, k)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                for name in backends:
+                    store_path = os.path.join(tmp, name)
+                    built = run_isolated(_build, name, store_path, texts, vectors, options['batch_size'])
+                    disk = sum(os.path.getsize(os.path.join(store_path, f)) for f in os.listdir(store_path))
+                    for ef_search in (ef_values if name == 'hnsw' else [None]):
+                        queried = run_isolated(_query, name, store_path, queries, truth, k, ef_search)
+                        label = f"{name} ef={ef_search}" if ef_search else name
+                        self.stdout.write(
+                            f"{count:>7} {label:>8} {built['build_seconds']:>8.2f} {built['save_seconds']:>7.2f} "
+                            f"{built['build_peak_mb']:>9.1f} {1000 * queried['load_seconds']:>8.1f} "
+                            f"{queried['ms_per_query']:>9.3f} {queried['p95_ms']:>7.3f} {queried['recall']:>9.3f} "
+                            f"{queried['query_rss_mb']:>9.1f} {disk / 2**20:>8.1f}"
+                        )
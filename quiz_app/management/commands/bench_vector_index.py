@@ -0,0 +1,86 @@
+import os
+import tempfile
+import time
+import faiss
+from django.core.management.base import BaseCommand, CommandError
+from langchain_core.documents import Document
+
+from quiz_app.benchmarking import LookupEmbeddings, parse_int_list, clustered_vectors
+from quiz_app.native_store import NativeVectorStore
+
+
+def resident_bytes(store):
+    """Bytes a query touches for every row: the codes for compressed modes, the full matrix for flat"""
+    if store.index_mode == 'flat':
+        return store._vectors.nbytes + store._norms.nbytes
+    return sum(array.nbytes for array in store._quantized.values())
+
+
+class Command(BaseCommand):
+    help = "Recall@k, latency and memory of the flat vs. int8 / IVF compressed vector index modes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', default='5000,50000', help="Comma separated store sizes")
+        parser.add_argument('--dim', type=int, default=384)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('-k', type=int, default=4)
+
+    def handle(self, *args, **options):
+        k = options['k']
+        dim = options['dim']
+        self.stdout.write(f"{'chunks':>7} {'mode':>18} {'recall@k':>9} {'ms/query':>9} {'index MB':>9} {'disk MB':>8}")
+
+        for count in parse_int_list(options['chunks']):
+            vectors = clustered_vectors(count, dim)
+            queries = clustered_vectors(options['queries'], dim, seed=1)
+            # Queries go in as text, through similarity_search_with_score like a retriever's
+            query_texts = [f"query {i}" for i in range(len(queries))]
+            embeddings = LookupEmbeddings(query_texts, queries)
+            documents = [Document(page_content=f"chunk {i}") for i in range(count)]
+
+            # Ground truth and the current FAISS flat store for reference
+            faiss_index = faiss.IndexFlatL2(dim)
+            faiss_index.add(vectors)
+            start = time.perf_counter()
+            _, truth = faiss_index.search(queries, k)
+            faiss_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            self.stdout.write(f"{count:>7} {'faiss flat':>18} {1.0:>9.3f} {faiss_ms:>9.3f} "
+                              f"{vectors.nbytes / 2**20:>9.1f} {'':>8}")
+
+            runs = [('flat', {}), ('sq8', {}), ('sq8', {'rescore': False}),
+                    ('ivf_sq8', {}), ('ivf_sq8', {'rescore': False}),
+                    ('ivf_sq8', {'nprobe': 1}), ('ivf_sq8', {'nprobe': 'all'})]
+            recalls = {}
+            with tempfile.TemporaryDirectory() as tmp:
+                for mode in ('flat', 'sq8', 'ivf_sq8'):
+                    NativeVectorStore(None, vectors=vectors, documents=documents).save(
+                        os.path.join(tmp, mode), index_mode=mode)
+
+                for mode, search_kwargs in runs:
+                    path = os.path.join(tmp, mode)
+                    store = NativeVectorStore.load(path, embeddings)
+                    if search_kwargs.get('nprobe') == 'all':
+                        n_lists = len(store._quantized['centroids'])
+                        search_kwargs = dict(search_kwargs, nprobe=n_lists)
+                    hits = 0
+                    start = time.perf_counter()
+                    for text, expected in zip(query_texts, truth):
+                        results = store.similarity_search_with_score(text, k=k, **search_kwargs)
+                        found = {int(doc.page_content.split()[1]) for doc, _ in results}
+                        hits += len(found & set(expected.tolist()))
+                    ms = (time.perf_counter() - start) * 1000 / len(queries)
+                    disk = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+                    label = mode + ('' if search_kwargs.get('rescore', True) else ' (no rescore)')
+                    if 'nprobe' in search_kwargs:
+                        label += f" nprobe={search_kwargs['nprobe']}"
+                    recall = hits / (k * len(queries))
+                    recalls[label] = recall
+                    self.stdout.write(f"{count:>7} {label:>18} {recall:>9.3f} {ms:>9.3f} "
+                                      f"{resident_bytes(store) / 2**20:>9.1f} {disk / 2**20:>8.1f}")
+
+            # Probing every list scans the same rows as sq8, so the recall must match;
+            # if it doesn't, nprobe never reached the IVF search
+            all_lists = recalls[f"ivf_sq8 nprobe={n_lists}"]
+            if abs(all_lists - recalls['sq8']) > 1e-9:
+                raise CommandError(f"ivf_sq8 with every list probed gave recall {all_lists:.3f}, "
+                                   f"sq8 gave {recalls['sq8']:.3f}: nprobe is not applied")
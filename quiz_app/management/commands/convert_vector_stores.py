@@ -0,0 +1,71 @@
+import os
+import shutil
+from django.core.management.base import BaseCommand
+from langchain_community.vectorstores import FAISS
+
+from quiz_app import model_registry
+from quiz_app.models import Quiz
+from quiz_app.native_store import NativeVectorStore, is_native_store
+
+
+# Directories this command leaves next to a store: never stores to convert themselves
+TMP_SUFFIX = '.native-tmp'
+BACKUP_SUFFIX = '.faiss-backup'
+
+
+class Command(BaseCommand):
+    help = "Convert the pickled FAISS vector stores of existing quizzes to the native mmap format"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="Store directories to convert (default: every quiz's store)")
+        parser.add_argument('--dry-run', action='store_true', help="Only list the stores that would be converted")
+        parser.add_argument('--keep-backup', action='store_true', help="Keep the original directory as <name>.faiss-backup")
+
+    def handle(self, *args, **options):
+        paths = [os.path.normpath(path) for path in options['paths']]
+        if not paths:
+            # Only live stores; backups and leftovers of earlier runs sit next to them
+            quizzes = Quiz.objects.exclude(pdf_file__isnull=True).exclude(pdf_file='').only('id', 'content_hash')
+            paths = sorted({quiz.vector_store_path for quiz in quizzes})
+            if not paths:
+                self.stdout.write("No vector stores found.")
+                return
+
+        embeddings = None
+        converted = skipped = failed = 0
+        for store_path in paths:
+            if store_path.endswith((TMP_SUFFIX, BACKUP_SUFFIX)):
+                self.stdout.write(f"Skipping {store_path}: left by an earlier conversion")
+                skipped += 1
+                continue
+            if not os.path.exists(os.path.join(store_path, 'index.faiss')) or is_native_store(store_path):
+                skipped += 1
+                continue
+            if options['dry_run']:
+                self.stdout.write(f"Would convert {store_path}")
+                continue
+
+            embeddings = embeddings or model_registry.get_embeddings()
+            tmp_path = store_path + TMP_SUFFIX
+            backup_path = store_path + BACKUP_SUFFIX
+            try:
+                # A crashed run may have left a partial conversion behind
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                faiss_store = FAISS.load_local(store_path, embeddings, allow_dangerous_deserialization=True)
+                NativeVectorStore.from_faiss(faiss_store).save(tmp_path, model_name=model_registry.EMBEDDING_MODEL_NAME)
+                # Carry over files stored next to the index (saved summary etc.)
+                for name in os.listdir(store_path):
+                    if name not in ('index.faiss', 'index.pkl'):
+                        shutil.copy2(os.path.join(store_path, name), tmp_path)
+                os.rename(store_path, backup_path)
+                os.rename(tmp_path, store_path)
+                if not options['keep_backup']:
+                    shutil.rmtree(backup_path)
+                converted += 1
+                self.stdout.write(self.style.SUCCESS(f"Converted {store_path} ({faiss_store.index.ntotal} chunks)"))
+            except Exception as e:
+                failed += 1
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                self.stdout.write(self.style.ERROR(f"Failed to convert {store_path}: {e}"))
+
+        self.stdout.write(f"Converted {converted}, skipped {skipped}, failed {failed}")
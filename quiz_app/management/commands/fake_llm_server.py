@@ -0,0 +1,113 @@
+import json
+import re
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from django.core.management.base import BaseCommand
+
+from quiz_app.fake_llm import FakeChatModel, FakeLLMError
+
+
+def make_handler(model):
+    class Handler(BaseHTTPRequestHandler):
+        """Minimal OpenAI / Groq compatible chat completions endpoint"""
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                return self._send(404, {'error': {'message': f"Unknown path {self.path}"}})
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return self._send(400, {'error': {'message': "Invalid JSON body"}})
+            prompt = "\n".join(str(m.get('content', '')) for m in body.get('messages', []))
+            try:
+                content = model.reply(prompt)
+            except FakeLLMError as e:
+                return self._send(500, {'error': {'message': str(e), 'type': 'server_error'}})
+            if body.get('stream'):
+                return self._stream(body, content)
+            prompt_tokens = len(prompt) // 4 + 1
+            completion_tokens = len(content) // 4 + 1
+            self._send(200, {
+                'id': f"chatcmpl-{uuid.uuid4().hex}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model', model.model_name),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+            })
+
+        def _stream(self, body, content):
+            """Server-sent chat.completion.chunk events, one per word, then [DONE]"""
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            pieces = [{'role': 'assistant', 'content': ''}]
+            pieces += [{'content': word} for word in re.findall(r'\S+\s*', content)]
+            for i, delta in enumerate(pieces + [{}]):
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': body.get('model', model.model_name),
+                    'choices': [{
+                        'index': 0,
+                        'delta': delta,
+                        'finish_reason': 'stop' if i == len(pieces) else None,
+                    }],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = ("Serve the deterministic fake LLM over a Groq/OpenAI compatible HTTP API "
+            "(point QUIZ_LLM_BASE_URL at it)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--latency', type=float, default=0.5, help="Seconds per response")
+        parser.add_argument('--jitter', type=float, default=0.1, help="Uniform +/- seconds added to the latency")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 500")
+
+    def handle(self, *args, **options):
+        model = FakeChatModel(seed=options['seed'], latency=options['latency'], jitter=options['jitter'],
+                              error_rate=options['error_rate'])
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(model))
+        self.stdout.write(f"Fake LLM listening on http://{options['host']}:{options['port']} "
+                          f"(set QUIZ_LLM_BASE_URL to this address)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
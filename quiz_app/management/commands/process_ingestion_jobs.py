@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+
+from quiz_app import ingestion
+
+
+class Command(BaseCommand):
+    help = "Run a worker that processes queued PDF quiz ingestion jobs. Start several for parallelism."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process queued jobs and exit when the queue is empty")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--stale-after', type=int, default=30,
+                            help="Minutes after which a running job without updates is marked failed")
+        parser.add_argument('--name', default='', help="Worker name recorded on claimed jobs")
+
+    def handle(self, *args, **options):
+        worker_name = options['name'] or ingestion.default_worker_name()
+        self.stdout.write(f"Ingestion worker {worker_name} started")
+
+        while True:
+            stale = ingestion.fail_stale_jobs(options['stale_after'])
+            if stale:
+                self.stdout.write(self.style.WARNING(f"Marked {stale} stale job(s) as failed"))
+
+            job = ingestion.claim_next_job(worker_name)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Processing job {job.id} for quiz {job.quiz_id} (attempt {job.attempts})")
+            job = ingestion.run_job(job)
+            if job.status == 'succeeded':
+                self.stdout.write(self.style.SUCCESS(f"Job {job.id} succeeded"))
+            else:
+                self.stdout.write(self.style.ERROR(f"Job {job.id} failed: {job.error}"))
@@ -0,0 +1,72 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Simple in-process counters and timings for the AI pipeline.
+# Each worker process keeps its own numbers; they are exposed through the
+# staff-only metrics view and reset when the worker restarts.
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+_gauges = {}
+
+
+def incr(name, amount=1):
+    """Increase a named counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, seconds):
+    """Record one duration (in seconds) for a named timing"""
+    with _lock:
+        stat = _timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+        stat['count'] += 1
+        stat['total'] += seconds
+        stat['last'] = seconds
+        if seconds > stat['max']:
+            stat['max'] = seconds
+
+
+@contextmanager
+def timer(name):
+    """Time the wrapped block and record it under ``name``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def register_gauge(name, func):
+    """Register a callable returning a dict of live values (cache sizes etc.)"""
+    with _lock:
+        _gauges[name] = func
+
+
+def snapshot():
+    """Return a JSON-serialisable copy of all metrics"""
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            name: dict(stat, avg=(stat['total'] / stat['count']) if stat['count'] else 0.0)
+            for name, stat in _timings.items()
+        }
+        gauges = dict(_gauges)
+
+    gauge_values = {}
+    for name, func in gauges.items():
+        try:
+            gauge_values[name] = func()
+        except Exception as e:
+            gauge_values[name] = {'error': str(e)}
+
+    return {'counters': counters, 'timings': timings, 'gauges': gauge_values}
+
+
+def reset():
+    """Clear counters and timings (gauges stay registered)"""
+    with _lock:
+        _counters.clear()
+        _timings.clear()
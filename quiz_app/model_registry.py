@@ -0,0 +1,194 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from dotenv import load_dotenv
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_groq import ChatGroq
+
+from . import metrics
+from .embedding_cache import EmbeddingCache, CachedEmbeddings, cache_directory
+from .llm_cache import LLMResponseCache
+from .fake_llm import FakeChatModel
+
+load_dotenv()
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+LLM_MODEL_NAME = "gemma2-9b-it"
+DEFAULT_TEMPERATURE = 0.7
+
+# Process-wide registry of the heavy objects used by PDFProcessor.
+# The embedding model takes seconds and a few hundred MB to load, so it is
+# built once per worker and shared by every request (and thread).
+
+_lock = threading.Lock()
+_embeddings = None
+_text_splitter = None
+_llms = {}
+_llm_cache = None
+_search_executor = None
+
+
+def get_embeddings():
+    """Return the shared sentence-transformer embedding model"""
+    global _embeddings
+    start = time.perf_counter()
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                embeddings = HuggingFaceEmbeddings(
+                    model_name=EMBEDDING_MODEL_NAME,
+                    model_kwargs={'device': 'cpu'}
+                )
+                if getattr(settings, 'QUIZ_EMBEDDING_CACHE', True):
+                    # Chunks already embedded for any earlier PDF are read from disk
+                    cache_root = getattr(settings, 'QUIZ_EMBEDDING_CACHE_DIR',
+                                         os.path.join(settings.MEDIA_ROOT, 'embedding_cache'))
+                    cache = EmbeddingCache(cache_directory(cache_root, EMBEDDING_MODEL_NAME), EMBEDDING_MODEL_NAME)
+                    embeddings = CachedEmbeddings(embeddings, cache,
+                                                  batch_size=getattr(settings, 'QUIZ_EMBED_BATCH_SIZE', 64))
+                    metrics.register_gauge('embedding_cache', embeddings.stats)
+                _embeddings = embeddings
+                metrics.observe('registry.embeddings.load', time.perf_counter() - start)
+                print(f"✅ Loaded embedding model {EMBEDDING_MODEL_NAME} in {time.perf_counter() - start:.2f}s")
+                return _embeddings
+    metrics.incr('registry.embeddings.reuse')
+    metrics.observe('registry.embeddings.acquire', time.perf_counter() - start)
+    return _embeddings
+
+
+def get_text_splitter():
+    """Return the shared text splitter used to chunk PDF pages"""
+    global _text_splitter
+    if _text_splitter is None:
+        with _lock:
+            if _text_splitter is None:
+                _text_splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=1000,
+                    chunk_overlap=200,
+                    length_function=len,
+                )
+    return _text_splitter
+
+
+def llm_backend():
+    """'groq' (default) or 'fake', from QUIZ_LLM_BACKEND in settings or the environment"""
+    return getattr(settings, 'QUIZ_LLM_BACKEND', None) or os.getenv('QUIZ_LLM_BACKEND', 'groq')
+
+
+def _fake_llm_options():
+    """QUIZ_FAKE_LLM settings dict, overridable with QUIZ_FAKE_LLM_<OPTION> environment variables"""
+    options = {'seed': 0, 'latency': 0.0, 'jitter': 0.0, 'error_rate': 0.0}
+    options.update(getattr(settings, 'QUIZ_FAKE_LLM', {}))
+    for name, default in list(options.items()):
+        value = os.getenv(f'QUIZ_FAKE_LLM_{name.upper()}')
+        if value is not None:
+            options[name] = type(default)(value)
+    return options
+
+
+def get_llm(temperature=DEFAULT_TEMPERATURE):
+    """Return a shared chat model client (ChatGroq, or the offline fake) for the given temperature"""
+    start = time.perf_counter()
+    backend = llm_backend()
+    key = (backend, LLM_MODEL_NAME, temperature)
+    llm = _llms.get(key)
+    if llm is None:
+        with _lock:
+            llm = _llms.get(key)
+            if llm is None:
+                if backend == 'fake':
+                    llm = FakeChatModel(temperature=temperature, **_fake_llm_options())
+                elif backend == 'groq':
+                    groq_api_key = os.getenv("GROQ_API_KEY")
+                    if not groq_api_key:
+                        raise ValueError("GROQ_API_KEY not found in environment variables")
+                    llm = ChatGroq(
+                        model=LLM_MODEL_NAME,
+                        api_key=groq_api_key,
+                        temperature=temperature,
+                        # e.g. the fake_llm_server command, to exercise the real client offline
+                        base_url=getattr(settings, 'QUIZ_LLM_BASE_URL', None) or os.getenv('QUIZ_LLM_BASE_URL'),
+                    )
+                else:
+                    raise ValueError(f"Unknown LLM backend: {backend}")
+                _llms[key] = llm
+                metrics.observe('registry.llm.load', time.perf_counter() - start)
+                return llm
+    metrics.incr('registry.llm.reuse')
+    metrics.observe('registry.llm.acquire', time.perf_counter() - start)
+    return llm
+
+
+def get_llm_cache():
+    """Return the shared LLM response cache, or None when QUIZ_LLM_CACHE is off"""
+    global _llm_cache
+    if not getattr(settings, 'QUIZ_LLM_CACHE', True):
+        return None
+    if _llm_cache is None:
+        with _lock:
+            if _llm_cache is None:
+                # Holds students' prompts and answers: keep it out of MEDIA_ROOT, which is served publicly
+                path = getattr(settings, 'QUIZ_LLM_CACHE_PATH',
+                               os.path.join(settings.BASE_DIR, 'var', 'llm_cache.sqlite3'))
+                _llm_cache = LLMResponseCache(
+                    path,
+                    ttl=getattr(settings, 'QUIZ_LLM_CACHE_TTL', 7 * 24 * 3600),
+                    max_bytes=getattr(settings, 'QUIZ_LLM_CACHE_BYTES', 100 * 1024 * 1024),
+                )
+                metrics.register_gauge('llm_cache', _llm_cache.stats)
+    return _llm_cache
+
+
+def get_search_executor():
+    """
+    Shared, bounded thread pool for blocking vector work (embedding a query,
+    searching an index) called from async views. Its size caps how much
+    CPU-bound search runs at once, however many chats are in flight.
+    """
+    global _search_executor
+    if _search_executor is None:
+        with _lock:
+            if _search_executor is None:
+                _search_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'QUIZ_SEARCH_WORKERS', 4),
+                    thread_name_prefix='quiz-search',
+                )
+    return _search_executor
+
+
+async def run_in_search_executor(func, *args, **kwargs):
+    """Await ``func(*args, **kwargs)`` run on the search executor"""
+    loop = asyncio.get_running_loop()
+    queued = time.perf_counter()
+
+    def call():
+        metrics.observe('search_executor.wait', time.perf_counter() - queued)
+        return func(*args, **kwargs)
+
+    return await loop.run_in_executor(get_search_executor(), call)
+
+
+def warm_up():
+    """Load the embedding model and LLM client ahead of the first request"""
+    get_embeddings()
+    get_text_splitter()
+    try:
+        get_llm()
+    except ValueError as e:
+        print(f"⚠️ Skipping LLM warm-up: {e}")
+
+
+def _registry_state():
+    return {
+        'embeddings_loaded': _embeddings is not None,
+        'embedding_model': EMBEDDING_MODEL_NAME,
+        'llm_backend': llm_backend(),
+        'llm_clients': len(_llms),
+    }
+
+
+metrics.register_gauge('registry', _registry_state)
@@ -4,7 +4,7 @@ from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
 import uuid
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete
 from django.dispatch import receiver
 
 class Category(models.Model):
@@ -41,6 +41,21 @@ class Quiz(models.Model):
         ('archived', 'Archived'),
     ]
     
+    PROCESSING_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing_pdf', 'Processing PDF'),
+        ('generating_questions', 'Generating Questions'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
+    VECTOR_BACKEND_CHOICES = [
+        ('', 'Automatic (by document size)'),
+        ('numpy', 'NumPy brute force'),
+        ('hnsw', 'HNSW graph'),
+        ('faiss', 'FAISS'),
+    ]
+    
     # Core fields
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=255, db_index=True)
@@ -60,6 +75,10 @@ class Quiz(models.Model):
     # File handling
     pdf_file = models.FileField(upload_to='quiz_pdfs/%Y/%m/%d/', null=True, blank=True)
     pdf_processed = models.BooleanField(default=False)
+    processing_status = models.CharField(max_length=25, choices=PROCESSING_CHOICES, default='ready', db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text="SHA-256 of the uploaded PDF")
+    vector_backend = models.CharField(max_length=10, choices=VECTOR_BACKEND_CHOICES, blank=True,
+                                      help_text="Vector index used for this PDF (blank = QUIZ_VECTOR_BACKEND)")
     
     # Metadata
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_quizzes')
@@ -97,6 +116,10 @@ class Quiz(models.Model):
     def is_active(self):
         return self.status == 'published'
     
+    @property
+    def is_ready(self):
+        return self.processing_status == 'ready'
+    
     def can_user_attempt(self, user):
         """Check if user can take another attempt at this quiz"""
         if self.max_attempts == 0:  # Unlimited attempts
@@ -109,15 +132,82 @@ class Quiz(models.Model):
         """Get the number of attempts a user has made for this quiz"""
         return self.attempts.filter(user=user).count()
 
+    @property
+    def document_key(self):
+        """Identifies the indexed PDF; quizzes built from the same PDF share one key"""
+        if self.content_hash:
+            return f'sha256_{self.content_hash}'
+        return f'quiz_{self.id}'
+
+    @property
+    def vector_store_path(self):
+        """Directory holding this quiz's saved vector store"""
+        from django.conf import settings
+        import os
+        # Stores are content-addressed so quizzes built from the same PDF share one
+        return os.path.join(settings.MEDIA_ROOT, 'vector_stores', self.document_key)
+
+    @property
+    def summary_path(self):
+        """File holding the saved summary of this quiz's PDF"""
+        from django.conf import settings
+        from .global_index import global_index_enabled
+        import os
+        if global_index_enabled():
+            return os.path.join(settings.MEDIA_ROOT, 'vector_stores', 'global', 'summaries',
+                                f'{self.document_key}.json')
+        return os.path.join(self.vector_store_path, 'summary.json')
+
     def has_vector_store(self):
         """Check if this quiz has a vector store available"""
         if not self.pdf_file:
             return False
         
-        from django.conf import settings
         import os
-        vector_store_path = os.path.join(settings.MEDIA_ROOT, 'vector_stores', f'quiz_{self.id}')
-        return os.path.exists(vector_store_path)
+        from .global_index import global_index_enabled, get_global_index
+        if global_index_enabled():
+            return get_global_index().has_quiz(self.id)
+        return os.path.exists(self.vector_store_path)
+
+class IngestionJob(models.Model):
+    """
+    Background job that turns an uploaded PDF into quiz questions.
+    Jobs are queued in the database and picked up by the
+    ``process_ingestion_jobs`` management command.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    
+    # Job details
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True)
+    num_questions = models.PositiveIntegerField(default=10)
+    progress = models.PositiveIntegerField(default=0, validators=[MaxValueValidator(100)], help_text="Progress in percent")
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True, help_text="Worker that claimed the job")
+    reserved_tokens = models.PositiveIntegerField(default=0, help_text="LLM quota reserved when the job was queued")
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Ingestion for {self.quiz.title} ({self.status})"
 
 class Question(models.Model):
     """
@@ -324,6 +414,11 @@ class ChatSession(models.Model):
     title = models.CharField(max_length=255, default="AI Teacher Chat")
     is_active = models.BooleanField(default=True)
     
+    # Running summary of the turns that no longer fit the prompt's history budget
+    history_summary = models.TextField(blank=True, default='')
+    summarized_until = models.DateTimeField(null=True, blank=True,
+                                            help_text="Timestamp of the last message folded into the summary")
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -378,6 +473,48 @@ class ChatMessage(models.Model):
     def is_assistant_message(self):
         return self.message_type == 'assistant'
 
+class LLMUsage(models.Model):
+    """
+    LLM tokens used on behalf of a user, per quiz, kind of work and hour.
+    Rows are incremented in place (see quiz_app/llm_usage.py). When a quiz
+    is deleted its rows are folded into the user's quiz-less rows.
+    """
+    KIND_CHOICES = [
+        ('chat', 'AI Teacher Chat'),
+        ('quiz', 'Quiz Generation'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='llm_usage')
+    quiz = models.ForeignKey(Quiz, on_delete=models.SET_NULL, related_name='llm_usage', null=True, blank=True)
+    # The quiz id, or '' for quiz-less rows: unlike the nullable FK it can be
+    # part of a unique key on every database backend
+    scope = models.CharField(max_length=36, blank=True, default='', editable=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    window_start = models.DateTimeField(help_text="Start of the hour this row aggregates")
+    
+    # Counters
+    calls = models.PositiveIntegerField(default=0)
+    cached_calls = models.PositiveIntegerField(default=0, help_text="Calls answered from the LLM response cache")
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-window_start']
+        indexes = [
+            models.Index(fields=['user', 'window_start']),
+            models.Index(fields=['window_start']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'kind', 'window_start'], name='llm_usage_unique_window'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.kind} ({self.window_start.strftime('%Y-%m-%d %H:00')})"
+    
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     points = models.PositiveIntegerField(default=0)
@@ -395,3 +532,14 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
 
+@receiver(pre_delete, sender=Quiz)
+def fold_quiz_llm_usage(sender, instance, **kwargs):
+    # Keep the user's totals; SET_NULL would clash with their existing quiz-less rows
+    from .llm_usage import fold_quiz_usage
+    fold_quiz_usage(instance.id)
+
+@receiver(pre_delete, sender=Quiz)
+def release_quiz_job_reservations(sender, instance, **kwargs):
+    # Jobs still queued (or running) go with the quiz; give their quota back
+    from .ingestion import release_quiz_reservations
+    release_quiz_reservations(instance)
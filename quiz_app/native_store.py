@@ -0,0 +1,433 @@
+import json
+import os
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+# Pickle-free on-disk vector store.
+#
+# Layout of a store directory:
+#   manifest.json  {"format": "native", "version": 1, "model": ..., "dim": ..., "count": ..., "metric": "l2"}
+#   vectors.npy    float32 (count, dim) matrix, opened with mmap
+#   norms.npy      float32 squared L2 norm of every row, opened with mmap
+#   chunks.jsonl   one {"id", "text", "metadata"} object per line
+#   offsets.npy    uint64 byte offsets of each line in chunks.jsonl (count + 1 entries)
+#
+# Compressed index modes ("index" in the manifest) add:
+#   sq8:      codes.npy (int8 scalar-quantized rows), sq_min.npy / sq_scale.npy
+#             (per-dimension range), qnorms.npy (squared norms of the decoded rows)
+#   ivf_sq8:  the sq8 files plus centroids.npy, ivf_order.npy (row ids grouped by
+#             partition) and ivf_offsets.npy (start of each partition)
+#   hnsw:     hnsw.faiss, a FAISS HNSW graph over the rows (needs faiss)
+# Searches over a compressed index shortlist candidates with the int8 codes and
+# rescore the shortlist against the full-precision rows in vectors.npy.
+#
+# Opening a store only reads the manifest and maps the arrays, so it is close
+# to O(1) and every worker process shares the same page cache.
+
+MANIFEST_FILE = 'manifest.json'
+FORMAT_NAME = 'native'
+FORMAT_VERSION = 1
+
+
+INDEX_MODES = ('flat', 'sq8', 'ivf_sq8', 'hnsw')
+HNSW_FILE = 'hnsw.faiss'
+
+
+def choose_index_mode(count, sq8_min_chunks=2000, ivf_min_chunks=20000):
+    """Pick the index type for a store of ``count`` chunks"""
+    if count >= ivf_min_chunks:
+        return 'ivf_sq8'
+    if count >= sq8_min_chunks:
+        return 'sq8'
+    return 'flat'
+
+
+def is_native_store(store_path):
+    return os.path.exists(os.path.join(store_path, MANIFEST_FILE))
+
+
+def read_manifest(store_path):
+    with open(os.path.join(store_path, MANIFEST_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class NativeVectorStore(VectorStore):
+    """Brute-force L2 vector store backed by memory-mapped NumPy arrays"""
+
+    def __init__(self, embedding, vectors=None, documents=None, ids=None, store_path=None, manifest=None):
+        self.embedding = embedding
+        self.store_path = store_path
+        self.manifest = manifest or {}
+        self._fd = None
+        self._offsets = None
+        self._quantized = {}
+        self._hnsw = None
+        self._pending = []  # vectors added since the last consolidation
+        if store_path:
+            # Memory-mapped, read-only until something is added
+            self._vectors = np.load(os.path.join(store_path, 'vectors.npy'), mmap_mode='r')
+            self._norms = np.load(os.path.join(store_path, 'norms.npy'), mmap_mode='r')
+            self._offsets = np.load(os.path.join(store_path, 'offsets.npy'), mmap_mode='r')
+            # Opened up front like the mapped arrays, so the store keeps working
+            # if its directory is deleted (a replaced global index shard)
+            self._fd = os.open(os.path.join(store_path, 'chunks.jsonl'), os.O_RDONLY)
+            self._documents = None
+            self._ids = None
+            for name in _QUANTIZED_FILES.get(self.index_mode, ()):
+                self._quantized[name] = np.load(os.path.join(store_path, f'{name}.npy'), mmap_mode='r')
+            if self.index_mode == 'hnsw':
+                import faiss
+                self._hnsw = faiss.read_index(os.path.join(store_path, HNSW_FILE))
+        else:
+            self._vectors = np.asarray(vectors, dtype=np.float32) if vectors is not None else None
+            self._norms = (self._vectors ** 2).sum(axis=1) if self._vectors is not None else None
+            self._documents = list(documents or [])
+            self._ids = list(ids) if ids else [str(uuid.uuid4()) for _ in self._documents]
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    @property
+    def index_mode(self):
+        return self.manifest.get('index', 'flat')
+
+    def __len__(self):
+        count = 0 if self._vectors is None else self._vectors.shape[0]
+        return count + sum(len(vectors) for vectors in self._pending)
+
+    def _consolidate(self):
+        """Fold vectors added in batches into one matrix (avoids re-copying on every append)"""
+        if not self._pending:
+            return
+        pending = np.vstack(self._pending)
+        self._pending = []
+        norms = (pending ** 2).sum(axis=1)
+        if self._vectors is None:
+            self._vectors, self._norms = pending, norms
+        else:
+            self._vectors = np.vstack([self._vectors, pending])
+            self._norms = np.concatenate([self._norms, norms])
+
+    # --- chunk access ---------------------------------------------------
+
+    def _read_record(self, position):
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        # pread has no shared file position, so concurrent readers are safe
+        return json.loads(os.pread(self._fd, end - start, start))
+
+    def get_chunk(self, position):
+        """Return the Document stored at ``position``"""
+        if self._documents is not None:
+            return self._documents[position]
+        record = self._read_record(position)
+        return Document(page_content=record['text'], metadata=record['metadata'])
+
+    def get_chunks(self, start, end):
+        """Return the Documents at positions ``start``..``end - 1``"""
+        return [self.get_chunk(position) for position in range(start, end)]
+
+    def get_chunk_id(self, position):
+        if self._ids is not None:
+            return self._ids[position]
+        return self._read_record(position)['id']
+
+    def _materialize(self):
+        """Copy mapped data into memory so the store can be appended to"""
+        if self._documents is None:
+            count = len(self)
+            self._documents = [self.get_chunk(i) for i in range(count)]
+            self._ids = [self.get_chunk_id(i) for i in range(count)]
+            self._vectors = np.array(self._vectors)
+            self._norms = np.array(self._norms)
+            self.store_path = None
+        # Appending invalidates any compressed index; it is rebuilt on save
+        self._quantized = {}
+        self._hnsw = None
+        self.manifest = dict(self.manifest, index='flat')
+
+    # --- VectorStore API --------------------------------------------------
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        self._materialize()
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self._pending.append(np.asarray(self.embedding.embed_documents(texts), dtype=np.float32))
+        self._documents.extend(Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas))
+        self._ids.extend(ids)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, **kwargs):
+        store = cls(embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, nprobe=None, rescore=True,
+                                               rescore_factor=4, ef_search=None, **kwargs):
+        self._consolidate()
+        if not len(self):
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+
+        if self._hnsw is not None and not filter:
+            import faiss
+            params = faiss.SearchParametersHNSW(efSearch=max(ef_search or 256, k))
+            distances, candidates = self._hnsw.search(query.reshape(1, -1), k, params=params)
+            return [(self.get_chunk(int(i)), float(d)) for i, d in zip(candidates[0], distances[0]) if i >= 0]
+
+        if self._quantized and not filter:
+            candidates, distances = self._search_quantized(query, k, nprobe, rescore, rescore_factor)
+            return [(self.get_chunk(int(i)), float(d)) for i, d in zip(candidates, distances)]
+
+        # Squared L2 distance, same scoring as the default FAISS flat index
+        distances = self._norms - 2.0 * (self._vectors @ query) + float(query @ query)
+
+        if filter:
+            candidates = [i for i in np.argsort(distances) if _matches(self.get_chunk(i).metadata, filter)][:k]
+        else:
+            k = min(k, len(distances))
+            candidates = np.argpartition(distances, k - 1)[:k]
+            candidates = candidates[np.argsort(distances[candidates])]
+        return [(self.get_chunk(int(i)), float(distances[i])) for i in candidates]
+
+    def search_ranges(self, embedding, k, ranges):
+        """Exact top-k over the rows in ``ranges`` ([(start, end), ...]); returns (position, distance) pairs"""
+        self._consolidate()
+        query = np.asarray(embedding, dtype=np.float32)
+        ranges = [(start, end) for start, end in ranges if end > start]
+        if not ranges:
+            return []
+        positions = np.concatenate([np.arange(start, end) for start, end in ranges])
+        distances = np.concatenate([
+            self._norms[start:end] - 2.0 * (self._vectors[start:end] @ query) for start, end in ranges
+        ]) + float(query @ query)
+        k = min(k, len(distances))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        return [(int(positions[i]), float(distances[i])) for i in best]
+
+    def _search_quantized(self, query, k, nprobe, rescore, rescore_factor):
+        """Approximate top-k over the int8 codes, optionally rescored at full precision"""
+        q = self._quantized
+        if 'centroids' in q:
+            centroids = q['centroids']
+            nlist = centroids.shape[0]
+            nprobe = min(nlist, nprobe or max(4, nlist // 8))
+            centroid_distances = ((centroids - query) ** 2).sum(axis=1)
+            probes = np.argpartition(centroid_distances, nprobe - 1)[:nprobe]
+            rows = np.concatenate([q['ivf_order'][q['ivf_offsets'][c]:q['ivf_offsets'][c + 1]] for c in probes])
+            rows = np.sort(rows)  # sequential access into the mapped codes
+            codes = q['codes'][rows]
+            qnorms = q['qnorms'][rows]
+        else:
+            rows = np.arange(len(self))
+            codes = q['codes']
+            qnorms = q['qnorms']
+        if not len(rows):
+            return [], []
+
+        # Distance to the decoded rows: x = (code + 128) * scale + min.
+        # Codes are widened to float32 block by block to keep temporaries small.
+        scaled_query = q['sq_scale'] * query
+        offset = 128.0 * float(scaled_query.sum()) + float(q['sq_min'] @ query)
+        dots = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), 4096):
+            dots[start:start + 4096] = codes[start:start + 4096].astype(np.float32) @ scaled_query
+        approx = qnorms - 2.0 * (dots + offset) + float(query @ query)
+
+        shortlist_size = min(len(rows), k * rescore_factor if rescore else k)
+        shortlist = np.argpartition(approx, shortlist_size - 1)[:shortlist_size]
+        candidates = rows[shortlist]
+        if rescore:
+            exact = self._norms[candidates] - 2.0 * (self._vectors[candidates] @ query) + float(query @ query)
+            order = np.argsort(exact)[:k]
+            return candidates[order], exact[order]
+        order = np.argsort(approx[shortlist])[:k]
+        return candidates[order], approx[shortlist][order]
+
+    def build_index(self, mode='flat', nlist=None, seed=0, hnsw_m=32, hnsw_ef_construction=200):
+        """Build the compressed index structures for ``mode`` in memory"""
+        if mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode: {mode}")
+        self._consolidate()
+        self._quantized = {}
+        self._hnsw = None
+        if mode == 'flat' or not len(self):
+            self.manifest = dict(self.manifest, index='flat')
+            return
+
+        vectors = np.asarray(self._vectors, dtype=np.float32)
+        if mode == 'hnsw':
+            import faiss
+            self._hnsw = faiss.IndexHNSWFlat(vectors.shape[1], hnsw_m)
+            self._hnsw.hnsw.efConstruction = hnsw_ef_construction
+            self._hnsw.add(np.ascontiguousarray(vectors))
+            self.manifest = dict(self.manifest, index=mode)
+            return
+
+        sq_min = vectors.min(axis=0)
+        sq_scale = (vectors.max(axis=0) - sq_min) / 255.0
+        sq_scale[sq_scale == 0] = 1.0
+        codes = (np.rint((vectors - sq_min) / sq_scale) - 128).clip(-128, 127).astype(np.int8)
+        decoded = (codes.astype(np.float32) + 128.0) * sq_scale + sq_min
+        self._quantized.update(
+            codes=codes,
+            sq_min=sq_min.astype(np.float32),
+            sq_scale=sq_scale.astype(np.float32),
+            qnorms=(decoded ** 2).sum(axis=1).astype(np.float32),
+        )
+
+        if mode == 'ivf_sq8':
+            nlist = nlist or max(1, int(4 * np.sqrt(len(vectors))))
+            centroids, assignments = _kmeans(vectors, nlist, seed=seed)
+            order = np.argsort(assignments, kind='stable')
+            offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+            self._quantized.update(
+                centroids=centroids,
+                ivf_order=order.astype(np.int64),
+                ivf_offsets=offsets.astype(np.int64),
+            )
+        self.manifest = dict(self.manifest, index=mode)
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        # Search options (nprobe, rescore, ef_search...) come through retrievers' search_kwargs
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k=k, filter=filter,
+                                                           **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    # --- persistence ----------------------------------------------------
+
+    def save(self, store_path, model_name='', index_mode=None):
+        """Write the store in the native format"""
+        os.makedirs(store_path, exist_ok=True)
+        self._consolidate()
+        count = len(self)
+        dim = self._vectors.shape[1] if count else 0
+        if index_mode and index_mode != self.index_mode:
+            self.build_index(index_mode)
+        for name, array in self._quantized.items():
+            np.save(os.path.join(store_path, f'{name}.npy'), np.ascontiguousarray(array))
+        if self._hnsw is not None:
+            import faiss
+            faiss.write_index(self._hnsw, os.path.join(store_path, HNSW_FILE))
+
+        np.save(os.path.join(store_path, 'vectors.npy'), np.ascontiguousarray(self._vectors, dtype=np.float32))
+        np.save(os.path.join(store_path, 'norms.npy'), np.ascontiguousarray(self._norms, dtype=np.float32))
+
+        offsets = [0]
+        with open(os.path.join(store_path, 'chunks.jsonl'), 'wb') as f:
+            for position in range(count):
+                doc = self.get_chunk(position)
+                line = json.dumps({
+                    'id': self.get_chunk_id(position),
+                    'text': doc.page_content,
+                    'metadata': doc.metadata,
+                }, ensure_ascii=False).encode('utf-8') + b'\n'
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(store_path, 'offsets.npy'), np.asarray(offsets, dtype=np.uint64))
+
+        # The manifest is written last: a directory without it is not a store
+        manifest = {
+            'format': FORMAT_NAME,
+            'version': FORMAT_VERSION,
+            'model': model_name,
+            'dim': int(dim),
+            'count': count,
+            'metric': 'l2',
+            'index': self.index_mode,
+        }
+        with open(os.path.join(store_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        self.manifest = manifest
+
+    @classmethod
+    def load(cls, store_path, embedding):
+        manifest = read_manifest(store_path)
+        if manifest.get('format') != FORMAT_NAME or manifest.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported vector store format in {store_path}: {manifest}")
+        return cls(embedding, store_path=store_path, manifest=manifest)
+
+    @classmethod
+    def from_faiss(cls, faiss_store):
+        """Copy vectors and chunks out of a langchain FAISS store"""
+        count = faiss_store.index.ntotal
+        vectors = faiss_store.index.reconstruct_n(0, count) if count else None
+        ids = [faiss_store.index_to_docstore_id[i] for i in range(count)]
+        documents = [faiss_store.docstore.search(doc_id) for doc_id in ids]
+        return cls(faiss_store.embeddings, vectors=vectors, documents=documents, ids=ids)
+
+    def to_faiss(self):
+        """Copy vectors and chunks into a langchain FAISS store (no re-embedding)"""
+        from langchain_community.vectorstores import FAISS
+        self._consolidate()
+        documents = [self.get_chunk(i) for i in range(len(self))]
+        return FAISS.from_embeddings(
+            [(doc.page_content, vector.tolist()) for doc, vector in zip(documents, np.asarray(self._vectors))],
+            self.embedding,
+            metadatas=[doc.metadata for doc in documents],
+            ids=[self.get_chunk_id(i) for i in range(len(self))],
+        )
+
+    def __del__(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except (OSError, AttributeError):  # os may already be torn down at interpreter exit
+                pass
+
+
+_QUANTIZED_FILES = {
+    'sq8': ('codes', 'sq_min', 'sq_scale', 'qnorms'),
+    'ivf_sq8': ('codes', 'sq_min', 'sq_scale', 'qnorms', 'centroids', 'ivf_order', 'ivf_offsets'),
+}
+
+
+def _nearest(vectors, centroids, batch_size=4096):
+    """Index of the nearest centroid for every row, computed in batches"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        distances = centroid_norms - 2.0 * (batch @ centroids.T)
+        assignments[start:start + batch_size] = distances.argmin(axis=1)
+    return assignments
+
+
+def _kmeans(vectors, k, iterations=10, sample_size=50000, seed=0):
+    """Plain Lloyd's k-means on a sample; returns (centroids, assignment of every row)"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(sample, centroids)
+        for c in range(k):
+            members = sample[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+    return centroids.astype(np.float32), _nearest(vectors, centroids)
+
+
+def _matches(metadata, filter):
+    for key, value in filter.items():
+        if isinstance(value, (list, tuple, set)):
+            if metadata.get(key) not in value:
+                return False
+        elif metadata.get(key) != value:
+            return False
+    return True
@@ -0,0 +1,184 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from . import metrics
+
+# Near-duplicate detection for generated questions.
+#
+# Every candidate goes through three checks, cheapest first:
+#   1. exact match of the normalized text
+#   2. MinHash / LSH over word shingles: near-verbatim copies are caught by a
+#      few bucket lookups, without running the embedding model
+#   3. cosine similarity of sentence embeddings against all kept questions
+#      (one matrix product per batch), which catches paraphrases
+# Questions are only compared as whole texts, so questions that merely start
+# with the same words are no longer rejected.
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize_question(text):
+    return ' '.join(_WORD.findall(text.lower()))
+
+
+def _shingles(normalized, size=2):
+    words = normalized.split()
+    if len(words) <= size:
+        return {normalized} if normalized else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures of word shingles, using ``num_perm`` random affine hashes"""
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, normalized):
+        shingles = _shingles(normalized)
+        if not shingles:
+            return np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        hashes = np.array([
+            int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+            for s in shingles
+        ], dtype=np.uint64)
+        # uint64 arithmetic wraps, which is what the hash family wants
+        return (self._a[:, None] * hashes[None, :] + self._b[:, None]).min(axis=1)
+
+
+class QuestionDedupIndex:
+    """Kept questions of one quiz, with MinHash LSH buckets and unit-length embeddings"""
+
+    def __init__(self, embeddings, similarity_threshold=0.88, jaccard_threshold=0.7, num_perm=64, bands=16):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.jaccard_threshold = jaccard_threshold
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.bands = bands
+        self._rows_per_band = num_perm // bands
+        self._keys = {}  # normalized text -> row
+        self._signatures = []
+        self._active = []  # False for questions deleted since they were indexed
+        self._vectors = None
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(self._active)
+
+    def _embed(self, texts):
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        with metrics.timer('dedup.embed'):
+            vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _band_keys(self, signature):
+        r = self._rows_per_band
+        return [(band, signature[band * r:(band + 1) * r].tobytes()) for band in range(self.bands)]
+
+    def _add(self, key, signature, vector):
+        row = len(self._signatures)
+        self._keys[key] = row
+        self._signatures.append(signature)
+        self._active.append(True)
+        vector = vector.reshape(1, -1)
+        self._vectors = vector if self._vectors is None else np.vstack([self._vectors, vector])
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(row)
+
+    def _minhash_duplicate(self, signature):
+        candidates = {row for band_key in self._band_keys(signature) for row in self._buckets.get(band_key, ())}
+        return any(self._active[row] and np.mean(self._signatures[row] == signature) >= self.jaccard_threshold
+                   for row in candidates)
+
+    def sync(self, texts):
+        """Match the index to the saved question ``texts``; only texts not seen before are embedded"""
+        saved = {}
+        for text in texts:
+            key = normalize_question(text)
+            if key:
+                saved.setdefault(key, text)
+        with self._lock:
+            for key, row in self._keys.items():
+                self._active[row] = key in saved
+            new = [(key, text) for key, text in saved.items() if key not in self._keys]
+            vectors = self._embed([text for _, text in new])
+            for (key, _), vector in zip(new, vectors):
+                self._add(key, self.hasher.signature(key), vector)
+        metrics.incr('dedup.synced', len(new))
+
+    def select(self, texts, limit=None):
+        """
+        Decide which of ``texts`` to keep and add them to the index. Returns one
+        decision per text: 'new', 'exact', 'minhash', 'similar', or 'skipped'
+        once ``limit`` texts have been kept.
+        """
+        decisions = [None] * len(texts)
+        with self._lock:
+            # Cheap passes: exact text and MinHash, against the index and the batch itself
+            survivors, seen = [], set()
+            for i, text in enumerate(texts):
+                key = normalize_question(text)
+                if not key or key in seen or (key in self._keys and self._active[self._keys[key]]):
+                    decisions[i] = 'exact'
+                    continue
+                signature = self.hasher.signature(key)
+                if self._minhash_duplicate(signature):
+                    decisions[i] = 'minhash'
+                    continue
+                seen.add(key)
+                survivors.append((i, key, signature))
+
+            # Embedding pass over what is left, in one batch
+            vectors = self._embed([texts[i] for i, _, _ in survivors])
+            if survivors and self._vectors is not None and any(self._active):
+                similarity = vectors @ self._vectors[np.asarray(self._active)].T
+                closest = similarity.max(axis=1)
+            else:
+                closest = np.zeros(len(survivors), dtype=np.float32)
+
+            kept = []
+            for j, ((i, key, signature), vector, score) in enumerate(zip(survivors, vectors, closest)):
+                if limit is not None and len(kept) >= limit:
+                    decisions[i] = 'skipped'
+                elif score >= self.similarity_threshold or \
+                        any(float(vector @ vectors[other]) >= self.similarity_threshold for other in kept):
+                    decisions[i] = 'similar'
+                else:
+                    decisions[i] = 'new'
+                    kept.append(j)
+                    self._add(key, signature, vector)
+
+        for decision in ('new', 'exact', 'minhash', 'similar'):
+            metrics.incr(f'dedup.{decision}', decisions.count(decision))
+        return decisions
+
+
+_indexes = OrderedDict()  # quiz_id -> QuestionDedupIndex
+_indexes_lock = threading.Lock()
+
+
+def dedup_index_for_quiz(quiz_id, embeddings, saved_texts, max_quizzes=64, **kwargs):
+    """
+    The quiz's dedup index, kept across generation runs so the embeddings of
+    its existing questions are computed once; ``saved_texts`` brings it up to
+    date with the database.
+    """
+    with _indexes_lock:
+        index = _indexes.get(quiz_id)
+        if index is None or index.embeddings is not embeddings:
+            index = QuestionDedupIndex(embeddings, **kwargs)
+            _indexes[quiz_id] = index
+        _indexes.move_to_end(quiz_id)
+        while len(_indexes) > max_quizzes:
+            _indexes.popitem(last=False)
+    index.sync(saved_texts)
+    return index
@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+from . import metrics
+
+
+# Files saved next to the index that don't affect the loaded store
+_IGNORED_FILES = {'summary.json'}
+
+
+def store_signature(store_path):
+    """Fingerprint of a vector store directory: (file name, mtime, size) of every index file"""
+    signature = []
+    total_bytes = 0
+    for name in sorted(os.listdir(store_path)):
+        full_path = os.path.join(store_path, name)
+        if name not in _IGNORED_FILES and os.path.isfile(full_path):
+            stat = os.stat(full_path)
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+            total_bytes += stat.st_size
+    return tuple(signature), total_bytes
+
+
+class VectorStoreCache:
+    """
+    Bounded LRU cache of loaded vector stores, keyed by store directory
+    (quizzes built from the same PDF share one entry).
+
+    Entries are invalidated when any file in the store directory changes
+    (mtime or size), and evicted least-recently-used first once either the
+    entry limit or the memory budget is exceeded. The on-disk size of a
+    store is used as an estimate of its in-memory size.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (signature, store, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, store_path, loader):
+        """Return the store for ``key``, loading it with ``loader(store_path)`` on a miss"""
+        signature, size = store_signature(store_path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == signature:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.incr('store_cache.hit')
+                    return entry[1]
+                # Files changed on disk since we loaded them
+                self._remove(key)
+                self.invalidations += 1
+                metrics.incr('store_cache.invalidation')
+            self.misses += 1
+            metrics.incr('store_cache.miss')
+
+        with metrics.timer('store_cache.load'):
+            store = loader(store_path)
+        self.put(key, store_path, store, signature=signature, size=size)
+        return store
+
+    def put(self, key, store_path, store, signature=None, size=None):
+        """Insert a freshly built or loaded store"""
+        if signature is None:
+            signature, size = store_signature(store_path)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                # Too big to ever fit; serve it uncached
+                return
+            self._entries[key] = (signature, store, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+                metrics.incr('store_cache.eviction')
+
+    def evict(self, key):
+        """Drop the cached store for ``key`` (e.g. when the quiz is deleted)"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+vector_store_cache = VectorStoreCache(
+    max_entries=getattr(settings, 'QUIZ_VECTOR_STORE_CACHE_ENTRIES', 32),
+    max_bytes=getattr(settings, 'QUIZ_VECTOR_STORE_CACHE_BYTES', 512 * 1024 * 1024),
+)
+
+metrics.register_gauge('store_cache', vector_store_cache.stats)
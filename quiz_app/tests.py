@@ -0,0 +1,66 @@
+import random
+from django.test import SimpleTestCase
+
+from .llm_json import extract_json_objects, parse_json_lenient
+from .management.commands import bench_json_parser as corpus
+
+
+class LenientJSONCorpusTests(SimpleTestCase):
+    """The bench_json_parser corpus of malformed LLM output, as regression tests"""
+
+    cases = 40
+    # Questions each mutation may lose per case; the rest must be recovered
+    max_lost = {
+        corpus.clean: 0,
+        corpus.fenced: 0,
+        corpus.prose: 0,
+        corpus.wrapper: 0,
+        corpus.python_literal: 0,
+        corpus.trailing_commas: 0,
+        corpus.missing_bracket: 0,
+        corpus.missing_brace: 0,
+        corpus.deep_nesting: 0,
+        corpus.broken_item: 1,
+        corpus.missing_quote: 1,
+        corpus.doubled_braces: 1,
+    }
+
+    def _cases(self, mutation):
+        rng = random.Random(mutation.__name__)
+        for _ in range(self.cases):
+            questions = [corpus._question(rng, n) for n in range(rng.randint(1, 8))]
+            yield questions, mutation(rng, questions)
+
+    def test_every_mutation_is_covered(self):
+        self.assertEqual(set(corpus.MUTATIONS) - set(self.max_lost), {corpus.truncated, corpus.random_deletions})
+
+    def test_recovers_questions(self):
+        for mutation, max_lost in self.max_lost.items():
+            with self.subTest(mutation=mutation.__name__):
+                for questions, text in self._cases(mutation):
+                    recovered = corpus._recovered(questions, extract_json_objects(text))
+                    self.assertGreaterEqual(recovered, len(questions) - max_lost, text[:200])
+
+    def test_never_worse_than_strict(self):
+        for mutation in corpus.MUTATIONS:
+            with self.subTest(mutation=mutation.__name__):
+                for questions, text in self._cases(mutation):
+                    strict = corpus._recovered(questions, corpus._strict(text))
+                    self.assertGreaterEqual(corpus._recovered(questions, extract_json_objects(text)), strict)
+
+    def test_never_raises(self):
+        for mutation in corpus.MUTATIONS:
+            with self.subTest(mutation=mutation.__name__):
+                for _, text in self._cases(mutation):
+                    extract_json_objects(text)
+                    parse_json_lenient(text, default={})
+
+    def test_unterminated_string_keeps_later_items(self):
+        text = ('[{"mcq": "First?, "options": {"A": "a", "B": "b"}, "correct": "A"}, '
+                '{"mcq": "Second?", "options": {"A": "a", "B": "b"}, "correct": "B"}, '
+                '{"mcq": "Third?", "options": {"A": "a", "B": "b"}, "correct": "A"}]')
+        self.assertEqual([item['mcq'] for item in extract_json_objects(text)], ["Second?", "Third?"])
+
+    def test_truncated_stream_keeps_complete_items(self):
+        text = '[{"mcq": "First?", "correct": "A"}, {"mcq": "Second?", "correct": "B"}, {"mcq": "Thi'
+        self.assertEqual([item['mcq'] for item in extract_json_objects(text)], ["First?", "Second?"])
@@ -15,8 +15,15 @@ urlpatterns = [
     path('quiz/results/', views.quiz_results, name='quiz_results'),
     path('quiz/<uuid:quiz_id>/submit/', views.submit_quiz, name='submit_quiz'),
     path('quiz/<uuid:quiz_id>/delete/', views.delete_quiz, name='delete_quiz'),
+    path('quiz/<uuid:quiz_id>/status/', views.quiz_status, name='quiz_status'),
+    path('quiz/<uuid:quiz_id>/retry/', views.retry_quiz_ingestion, name='retry_quiz_ingestion'),
+    path('quiz/<uuid:quiz_id>/more-questions/', views.generate_more_questions, name='generate_more_questions'),
     # Chat URLs
     path('chat/', views.chat_sessions, name='chat_sessions'),
     path('chat/<uuid:session_id>/', views.chat_session, name='chat_session'),
+    path('chat/<uuid:session_id>/stream/', views.chat_stream, name='chat_stream'),
     path('chat/<uuid:session_id>/delete/', views.delete_chat_session, name='delete_chat_session'),
+    # Monitoring
+    path('metrics/', views.ai_metrics, name='ai_metrics'),
+    path('metrics/usage/', views.llm_usage_report, name='llm_usage_report'),
 ] 
\ No newline at end of file
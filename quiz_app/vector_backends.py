@@ -0,0 +1,152 @@
+import os
+from django.conf import settings
+from langchain_community.vectorstores import FAISS
+
+from .native_store import NativeVectorStore, is_native_store, read_manifest, choose_index_mode
+
+# Interchangeable vector index implementations.
+#
+#   numpy  NativeVectorStore: brute-force search over a memory-mapped matrix,
+#          int8 / IVF compressed once the document is large (QUIZ_VECTOR_INDEX_MODE)
+#   hnsw   NativeVectorStore plus a FAISS HNSW graph; approximate, but query
+#          time stays flat as the document grows
+#   faiss  langchain's FAISS store (exact, pickled docstore)
+#
+# A quiz can pin a backend (Quiz.vector_backend); otherwise QUIZ_VECTOR_BACKEND
+# is used, and "auto" picks by chunk count. Loading always follows what is on
+# disk, so stores built under an older setting keep working.
+
+
+class VectorBackend:
+    """Builds, saves, loads and queries one kind of vector store"""
+
+    name = None
+
+    def create(self, documents, embeddings):
+        """Build an in-memory store from the first batch of chunks"""
+        raise NotImplementedError
+
+    def add(self, vector_store, documents):
+        vector_store.add_documents(documents)
+        return vector_store
+
+    def save(self, vector_store, store_path, model_name=''):
+        raise NotImplementedError
+
+    def load(self, store_path, embeddings):
+        raise NotImplementedError
+
+    def owns(self, store_path):
+        """True if the directory holds a store saved by this backend"""
+        raise NotImplementedError
+
+    def search_kwargs(self, k):
+        return {'k': k}
+
+    def retriever(self, vector_store, k=3):
+        return vector_store.as_retriever(search_kwargs=self.search_kwargs(k))
+
+
+class NumpyBackend(VectorBackend):
+    name = 'numpy'
+
+    def create(self, documents, embeddings):
+        return NativeVectorStore.from_documents(documents, embeddings)
+
+    def _native(self, vector_store):
+        if isinstance(vector_store, FAISS):
+            return NativeVectorStore.from_faiss(vector_store)
+        return vector_store
+
+    def index_mode(self, count):
+        index_mode = getattr(settings, 'QUIZ_VECTOR_INDEX_MODE', 'auto')
+        if index_mode != 'auto':
+            return index_mode
+        return choose_index_mode(
+            count,
+            sq8_min_chunks=getattr(settings, 'QUIZ_SQ8_MIN_CHUNKS', 2000),
+            ivf_min_chunks=getattr(settings, 'QUIZ_IVF_MIN_CHUNKS', 20000),
+        )
+
+    def save(self, vector_store, store_path, model_name=''):
+        vector_store = self._native(vector_store)
+        vector_store.save(store_path, model_name=model_name, index_mode=self.index_mode(len(vector_store)))
+
+    def load(self, store_path, embeddings):
+        return NativeVectorStore.load(store_path, embeddings)
+
+    def owns(self, store_path):
+        return is_native_store(store_path) and read_manifest(store_path).get('index') != 'hnsw'
+
+
+class HnswBackend(NumpyBackend):
+    name = 'hnsw'
+
+    def index_mode(self, count):
+        return 'hnsw'
+
+    def owns(self, store_path):
+        return is_native_store(store_path) and read_manifest(store_path).get('index') == 'hnsw'
+
+    def search_kwargs(self, k):
+        return {'k': k, 'ef_search': getattr(settings, 'QUIZ_HNSW_EF_SEARCH', 256)}
+
+
+class FaissBackend(VectorBackend):
+    name = 'faiss'
+
+    def create(self, documents, embeddings):
+        return FAISS.from_documents(documents, embeddings)
+
+    def save(self, vector_store, store_path, model_name=''):
+        if isinstance(vector_store, NativeVectorStore):
+            vector_store = vector_store.to_faiss()
+        vector_store.save_local(store_path)
+
+    def load(self, store_path, embeddings):
+        return FAISS.load_local(store_path, embeddings, allow_dangerous_deserialization=True)
+
+    def owns(self, store_path):
+        return os.path.exists(os.path.join(store_path, 'index.faiss')) and not is_native_store(store_path)
+
+
+BACKENDS = {backend.name: backend for backend in (NumpyBackend(), HnswBackend(), FaissBackend())}
+
+
+def get_backend(name):
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown vector backend: {name}") from None
+
+
+def configured_backend(name=None):
+    """The backend name to use: an explicit choice, else QUIZ_VECTOR_BACKEND ("auto" by default)"""
+    return name or getattr(settings, 'QUIZ_VECTOR_BACKEND', 'auto')
+
+
+def choose_backend(count, hnsw_min_chunks=None):
+    """Backend for a document of ``count`` chunks when none is configured"""
+    if hnsw_min_chunks is None:
+        hnsw_min_chunks = getattr(settings, 'QUIZ_HNSW_MIN_CHUNKS', 50000)
+    return BACKENDS['hnsw'] if count >= hnsw_min_chunks else BACKENDS['numpy']
+
+
+def backend_for_path(store_path):
+    """The backend that saved the store at ``store_path``"""
+    for backend in BACKENDS.values():
+        if backend.owns(store_path):
+            return backend
+    raise FileNotFoundError(f"No vector store found at {store_path}")
+
+
+def backend_for_store(vector_store):
+    """The backend that should query an already loaded store"""
+    if isinstance(vector_store, FAISS):
+        return BACKENDS['faiss']
+    # NativeVectorStore, or a view of the global index (flat NumPy shards)
+    return BACKENDS['hnsw'] if getattr(vector_store, 'index_mode', None) == 'hnsw' else BACKENDS['numpy']
+
+
+def retriever_for(vector_store, k=3):
+    return backend_for_store(vector_store).retriever(vector_store, k=k)
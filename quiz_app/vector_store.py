@@ -389,111 +389,479 @@
 import os
 import json
 import random
-import re
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.document_loaders import PyPDFLoader
-from langchain.chains import RetrievalQA
-from langchain_groq import ChatGroq
+
+from . import metrics, model_registry
+from .native_store import NativeVectorStore
+from .vector_backends import get_backend, configured_backend, choose_backend, backend_for_path
+from .question_dedup import QuestionDedupIndex, dedup_index_for_quiz
+from .llm_json import extract_json_objects, parse_json_lenient
+from .llm_cache import CachedLLM
 
 load_dotenv()
 
-class PDFProcessor:
-    def __init__(self):
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
-
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise ValueError("GROQ_API_KEY not found in environment variables")
-
-        self.llm = ChatGroq(
-            model="gemma2-9b-it",
-            api_key=os.getenv("GROQ_API_KEY"), #change made
-            temperature=0.7
-        )
-
-    def process_pdf(self, pdf_path):
-        loader = PyPDFLoader(pdf_path)
-        pages = loader.load()
-        texts = self.text_splitter.split_documents(pages)
-        return FAISS.from_documents(texts, self.embeddings)
-
-    def save_vector_store(self, vector_store, store_path):
-        vector_store.save_local(store_path)
+SUMMARY_VERSION = 3
 
-    def load_vector_store(self, store_path):
-        return FAISS.load_local(store_path, self.embeddings, allow_dangerous_deserialization=True)
 
-    def summarize_chunkwise(self, vector_store, max_chunks=30, group_size=3):
-        """Summarize the document by summarizing chunks in groups, then combining."""
-        all_chunk_ids = list(vector_store.index_to_docstore_id.values())
-        total_chunks = len(all_chunk_ids)
-        chunk_summaries = []
+def _estimate_tokens(text):
+    """Rough token count (~4 characters per token) used for prompt budgets"""
+    return len(text) // 4 + 1
 
-        for i in range(0, min(max_chunks, total_chunks), group_size):
-            chunk_indices = list(range(i, min(i + group_size, total_chunks)))
-            chunk_ids = [all_chunk_ids[j] for j in chunk_indices]
+class PDFProcessor:
+    def __init__(self, llm=None, embeddings=None, max_concurrency=None, use_llm_cache=True, meter=None,
+                 heartbeat=None):
+        # Heavy objects come from the process-wide registry, so building a
+        # PDFProcessor per request is cheap. llm/embeddings can be injected
+        # (benchmarks, offline runs). ``meter`` (llm_usage.UsageMeter) counts
+        # the tokens of every LLM call made through cached_llm. ``heartbeat``
+        # is called from the calling thread after every summary group and
+        # question batch of the sync pipeline, so a long run shows progress.
+        self.embeddings = embeddings or model_registry.get_embeddings()
+        self.text_splitter = model_registry.get_text_splitter()
+        self.llm = llm or model_registry.get_llm()
+        # Same model behind the response cache; call sites opt in with cache=True
+        self.cached_llm = CachedLLM(self.llm, model_registry.get_llm_cache() if use_llm_cache else None, meter=meter)
+        # Max number of LLM calls in flight at once for a single PDF
+        self.max_concurrency = max_concurrency or getattr(settings, 'QUIZ_LLM_CONCURRENCY', 4)
+        # Latency / yield of each batch from the last generate_questions run
+        self.last_batch_stats = []
+        self.heartbeat = heartbeat
+
+    def _beat(self):
+        if self.heartbeat:
+            self.heartbeat()
+
+    def _build_backend(self, backend=None):
+        """Backend used to build the in-memory store (auto builds a NumPy store and decides on save)"""
+        name = configured_backend(backend)
+        return get_backend('numpy' if name == 'auto' else name)
+
+    def process_pdf(self, pdf_path, streaming=None, batch_size=None, backend=None):
+        """Process PDF and create vector store"""
+        if streaming is None:
+            streaming = getattr(settings, 'QUIZ_STREAMING_INGESTION', True)
+        cache_before = self._embedding_cache_stats()
+        if not streaming:
+            loader = PyPDFLoader(pdf_path)
+            pages = loader.load()
+            texts = self.text_splitter.split_documents(pages)
+            vector_store = self._build_backend(backend).create(texts, self.embeddings)
+        else:
+            vector_store = self.process_pdf_streaming(pdf_path, batch_size=batch_size, backend=backend)
+        self._report_embedding_cache(cache_before)
+        return vector_store
+
+    def _embedding_cache_stats(self):
+        stats = getattr(self.embeddings, 'stats', None)
+        return stats() if stats else None
+
+    def _report_embedding_cache(self, before):
+        """Print the embedding cache hit rate for one ingestion"""
+        after = self._embedding_cache_stats()
+        if before is None or after is None:
+            return
+        hits = after['hits'] - before['hits']
+        misses = after['misses'] - before['misses']
+        if hits + misses == 0:
+            return
+        embed_seconds = after['embed_seconds'] - before['embed_seconds']
+        saved = hits * (embed_seconds / misses) if misses else 0.0
+        metrics.observe('embedding_cache.saved_per_ingestion', saved)
+        print(f"🧠 Embedding cache: {hits}/{hits + misses} chunks cached ({hits / (hits + misses):.0%}), "
+              f"embedded {misses} in {embed_seconds:.1f}s, ~{saved:.1f}s saved")
+
+    def process_pdf_streaming(self, pdf_path, batch_size=None, backend=None):
+        """
+        Build the vector store page by page: pages are read lazily, chunked
+        one at a time and embedded in fixed-size batches that are appended to
+        the index, so peak memory depends on the batch size rather than on
+        the number of pages.
+        """
+        batch_size = batch_size or getattr(settings, 'QUIZ_EMBED_BATCH_SIZE', 64)
+        builder = self._build_backend(backend)
+        vector_store = None
+        batch = []
+
+        def flush(vector_store, batch):
+            if vector_store is None:
+                return builder.create(batch, self.embeddings)
+            return builder.add(vector_store, batch)
+
+        for page in PyPDFLoader(pdf_path).lazy_load():
+            batch.extend(self.text_splitter.split_documents([page]))
+            while len(batch) >= batch_size:
+                vector_store = flush(vector_store, batch[:batch_size])
+                batch = batch[batch_size:]
+
+        if batch:
+            vector_store = flush(vector_store, batch)
+        if vector_store is None:
+            raise ValueError("No text could be extracted from the PDF")
+        return vector_store
+
+    def save_vector_store(self, vector_store, store_path, backend=None):
+        """Save with the given backend name, QUIZ_VECTOR_BACKEND, or one picked by chunk count"""
+        name = configured_backend(backend)
+        if name == 'auto':
+            vector_backend = choose_backend(self.chunk_count(vector_store))
+        else:
+            vector_backend = get_backend(name)
+        vector_backend.save(vector_store, store_path, model_name=model_registry.EMBEDDING_MODEL_NAME)
+        return vector_backend.name
 
-            retriever = vector_store.as_retriever(search_kwargs={"k": len(chunk_ids), "doc_ids": chunk_ids})
-            qa_chain = RetrievalQA.from_chain_type(llm=self.llm, chain_type="stuff", retriever=retriever)
+    def load_vector_store(self, store_path):
+        # Whatever backend saved the store loads it (legacy pickled FAISS stores included)
+        vector_store = backend_for_path(store_path).load(store_path, self.embeddings)
+        if isinstance(vector_store, NativeVectorStore) and \
+                vector_store.manifest.get('model') not in ('', model_registry.EMBEDDING_MODEL_NAME):
+            print(f"⚠️ Vector store {store_path} was built with {vector_store.manifest['model']}")
+        return vector_store
+
+    def chunk_count(self, vector_store):
+        """Number of chunks stored in a vector store"""
+        if hasattr(vector_store, 'get_chunk'):  # NativeVectorStore, GlobalIndexView
+            return len(vector_store)
+        return len(vector_store.index_to_docstore_id)
+
+    def get_chunks(self, vector_store, start, end=None):
+        """Return the stored chunk Documents with positions ``start``..``end - 1``, in document order"""
+        end = self.chunk_count(vector_store) if end is None else min(end, self.chunk_count(vector_store))
+        if hasattr(vector_store, 'get_chunks'):  # NativeVectorStore, GlobalIndexView
+            return vector_store.get_chunks(start, end)
+        chunks = []
+        for position in range(start, end):
+            doc_id = vector_store.index_to_docstore_id[position]
+            chunk = vector_store.docstore.search(doc_id)
+            if hasattr(chunk, 'page_content'):  # search() returns a message string for unknown ids
+                chunks.append(chunk)
+        return chunks
+
+    def summarize_chunkwise(self, vector_store, max_chunks=None, group_size=3, max_concurrency=None,
+                            return_partials=False, max_tokens_per_call=None, fan_in=4):
+        """
+        Summarize the whole document as a tree: every chunk group is
+        summarized (leaf level), then summaries are combined level by level
+        until one is left. Calls within a level run concurrently, so latency
+        grows with the number of levels (log of the document size).
+        """
+        groups, max_concurrency, max_tokens_per_call = self._summary_plan(
+            vector_store, max_chunks, group_size, max_concurrency, max_tokens_per_call)
 
-            prompt = """
+        def summarize_group(group_number, chunk_range):
+            try:
+                with metrics.timer('summarize.group'):
+                    response = self.cached_llm.invoke(self._group_prompt(vector_store, chunk_range), cache=True)
+                return self._group_summary(group_number, response)
+            except Exception as e:
+                print(f"⚠️ Error summarizing chunk group {group_number}: {e}")
+            return None
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            # Leaf level: executor.map keeps results in group order so the
+            # combined summary is deterministic.
+            results = []
+            for summary in executor.map(summarize_group, range(1, len(groups) + 1), groups):
+                results.append(summary)
+                self._beat()
+            chunk_summaries = [summary for summary in results if summary]
+
+            # Reduce levels: combine neighbouring summaries under the token budget
+            summaries = chunk_summaries
+            level = 0
+            while len(summaries) > 1:
+                level += 1
+                batches = self._pack_summaries(summaries, max_tokens_per_call, fan_in)
+                summaries = list(executor.map(self._combine_summaries, batches))
+                print(f"✅ Summary level {level}: {len(batches)} combined summaries")
+                self._beat()
+
+        final_summary = summaries[0] if summaries else ""
+        if return_partials:
+            return final_summary, chunk_summaries
+        return final_summary
+
+    async def asummarize_chunkwise(self, vector_store, max_chunks=None, group_size=3, max_concurrency=None,
+                                   return_partials=False, max_tokens_per_call=None, fan_in=4):
+        """summarize_chunkwise() on the async LLM client; a semaphore bounds the calls in flight"""
+        groups, max_concurrency, max_tokens_per_call = self._summary_plan(
+            vector_store, max_chunks, group_size, max_concurrency, max_tokens_per_call)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def summarize_group(group_number, chunk_range):
+            try:
+                async with semaphore:
+                    with metrics.timer('summarize.group'):
+                        response = await self.cached_llm.ainvoke(self._group_prompt(vector_store, chunk_range),
+                                                                 cache=True)
+                return self._group_summary(group_number, response)
+            except Exception as e:
+                print(f"⚠️ Error summarizing chunk group {group_number}: {e}")
+            return None
+
+        async def combine(batch):
+            async with semaphore:
+                return await self._acombine_summaries(batch)
+
+        # gather keeps results in group order, as executor.map does
+        results = await asyncio.gather(*(summarize_group(number, group)
+                                         for number, group in enumerate(groups, start=1)))
+        chunk_summaries = [summary for summary in results if summary]
+
+        summaries = chunk_summaries
+        level = 0
+        while len(summaries) > 1:
+            level += 1
+            batches = self._pack_summaries(summaries, max_tokens_per_call, fan_in)
+            summaries = list(await asyncio.gather(*(combine(batch) for batch in batches)))
+            print(f"✅ Summary level {level}: {len(batches)} combined summaries")
+
+        final_summary = summaries[0] if summaries else ""
+        if return_partials:
+            return final_summary, chunk_summaries
+        return final_summary
+
+    def _summary_plan(self, vector_store, max_chunks, group_size, max_concurrency, max_tokens_per_call):
+        """Chunk ranges of the leaf groups, and the effective concurrency and token budget"""
+        total_chunks = self.chunk_count(vector_store)
+        if max_chunks:
+            total_chunks = min(max_chunks, total_chunks)
+        max_concurrency = max_concurrency or self.max_concurrency
+        max_tokens_per_call = max_tokens_per_call or getattr(settings, 'QUIZ_SUMMARY_TOKENS_PER_CALL', 3000)
+        groups = [(i, min(i + group_size, total_chunks)) for i in range(0, total_chunks, group_size)]
+        return groups, max_concurrency, max_tokens_per_call
+
+    def _group_prompt(self, vector_store, chunk_range):
+        # The group's exact chunks are sent to the LLM; no embedding or search needed
+        chunks = self.get_chunks(vector_store, *chunk_range)
+        content = "\n\n".join(chunk.page_content for chunk in chunks)
+        return f"""
             Summarize the following content in 3–4 sentences.
             Focus on key technical concepts and explanations. Avoid lists or questions.
-            """
 
-            try:
-                response = qa_chain.invoke(prompt)
-                summary = response['result'].strip()
-                if summary:
-                    chunk_summaries.append(summary)
-                    print(f"✅ Summarized chunk group {i // group_size + 1}")
-            except Exception as e:
-                print(f"⚠️ Error summarizing chunk group {i // group_size + 1}: {e}")
+            Content:
+            {content}
+            """
 
-        final_prompt = f"""
+    def _group_summary(self, group_number, response):
+        summary = response.content.strip()
+        if summary:
+            print(f"✅ Summarized chunk group {group_number}")
+            return summary
+        return None
+
+    def _pack_summaries(self, summaries, max_tokens, fan_in):
+        """Split summaries into ordered batches of at most ``fan_in`` items that fit in ``max_tokens``"""
+        batches = []
+        current = []
+        current_tokens = 0
+        for summary in summaries:
+            tokens = _estimate_tokens(summary)
+            # Always combine at least two summaries so every level shrinks
+            if len(current) >= 2 and (len(current) >= fan_in or current_tokens + tokens > max_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(summary)
+            current_tokens += tokens
+        if len(current) == 1 and batches:
+            batches[-1].append(current[0])
+        elif current:
+            batches.append(current)
+        return batches
+
+    def _combine_prompt(self, summaries):
+        return f"""
         Combine the following summaries into a single, coherent summary:
 
-        {' '.join(chunk_summaries)}
+        {' '.join(summaries)}
 
         Return a concise and readable overview of the full document.
         """
 
+    def _combine_summaries(self, summaries):
+        """Merge several summaries into one with a single LLM call"""
+        if len(summaries) == 1:
+            return summaries[0]
+
         try:
-            final_response = self.llm.invoke(final_prompt)
-            final_summary = final_response.content.strip()  # ✅ FIXED
-            return final_summary
+            with metrics.timer('summarize.combine'):
+                final_response = self.cached_llm.invoke(self._combine_prompt(summaries), cache=True)
+            return final_response.content.strip()  # ✅ FIXED
         except Exception as e:
-            print(f"❌ Final summary combination failed: {e}")
-            return "\n".join(chunk_summaries)
+            print(f"❌ Summary combination failed: {e}")
+            return "\n".join(summaries)
+
+    async def _acombine_summaries(self, summaries):
+        if len(summaries) == 1:
+            return summaries[0]
 
-    def generate_questions(self, vector_store, difficulty, num_questions, quiz_id=None):
+        try:
+            with metrics.timer('summarize.combine'):
+                final_response = await self.cached_llm.ainvoke(self._combine_prompt(summaries), cache=True)
+            return final_response.content.strip()
+        except Exception as e:
+            print(f"❌ Summary combination failed: {e}")
+            return "\n".join(summaries)
+
+    def load_summary(self, summary_path):
+        """Return the saved summary at ``summary_path`` (see Quiz.summary_path), or None"""
+        try:
+            with open(summary_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != SUMMARY_VERSION:
+            return None
+        return data
+
+    def load_or_create_summary(self, vector_store, summary_path):
+        """
+        Summaries are stored next to the vector store (or, with the global
+        index, under its summaries directory) and keyed by document. Stores are
+        content-addressed and rebuilt from scratch when the PDF changes, so a
+        saved summary stays valid for exactly as long as its store does.
+        """
+        data = self.load_summary(summary_path)
+        if data and data.get('summary'):
+            metrics.incr('summary.reused')
+            return data['summary']
+
+        with metrics.timer('summary.create'):
+            summary, partials = self.summarize_chunkwise(vector_store, return_partials=True)
+        self._save_summary(summary_path, summary, partials)
+        return summary
+
+    async def aload_or_create_summary(self, vector_store, summary_path):
+        data = await asyncio.to_thread(self.load_summary, summary_path)
+        if data and data.get('summary'):
+            metrics.incr('summary.reused')
+            return data['summary']
+
+        with metrics.timer('summary.create'):
+            summary, partials = await self.asummarize_chunkwise(vector_store, return_partials=True)
+        await asyncio.to_thread(self._save_summary, summary_path, summary, partials)
+        return summary
+
+    def _save_summary(self, summary_path, summary, partials):
+        if not partials:
+            return
+        data = {'version': SUMMARY_VERSION, 'summary': summary, 'partials': partials}
+        os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+        tmp_path = f'{summary_path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, summary_path)
+
+    def generate_questions(self, vector_store, difficulty, num_questions, quiz_id=None, max_calls=None, batch_size=5,
+                           summary=None):
         """Efficiently generate multiple MCQs from a summary using fewer LLM calls."""
-        summary = self.summarize_chunkwise(vector_store)
+        if summary is None:
+            summary = self.summarize_chunkwise(vector_store)
         print("\n📘 Summary used for question generation:\n", summary)
 
-        used_questions = set()
-        existing_questions = self.check_existing_questions(quiz_id) if quiz_id else set()
+        dedup = self.question_dedup_index(quiz_id)
         questions = []
-        max_batch = 5  # Questions per batch
+        max_batch = batch_size  # Questions per batch
         total_batches = (num_questions + max_batch - 1) // max_batch
-        generated = 0
+        # Budget of LLM calls, including top-up batches for lost questions
+        max_calls = max_calls or total_batches * 2
+        calls = 0
+        self.last_batch_stats = []
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            while len(questions) < num_questions and calls < max_calls:
+                # Dispatch enough batches to cover what is still missing
+                batch_sizes = self._missing_batches(num_questions - len(questions), max_batch, max_calls - calls)
+                futures = [
+                    executor.submit(self._generate_batch, summary, difficulty, needed, calls + offset + 1)
+                    for offset, needed in enumerate(batch_sizes)
+                ]
+                calls += len(futures)
+
+                # Single merge step over all results, in dispatch order
+                for future in futures:
+                    self._merge_batch(future.result(), dedup, questions, num_questions)
+                    self._beat()
+
+        metrics.incr('generate.calls', calls)
+        print(f"🎯 Finished generating {len(questions)} out of {num_questions} requested using {calls} LLM calls.")
+        return questions
 
-        for batch_index in range(total_batches):
-            needed = min(max_batch, num_questions - generated)
+    async def agenerate_questions(self, vector_store, difficulty, num_questions, quiz_id=None, max_calls=None,
+                                  batch_size=5, summary=None):
+        """generate_questions() on the async LLM client; deduplication runs off the event loop"""
+        if summary is None:
+            summary = await self.asummarize_chunkwise(vector_store)
+        print("\n📘 Summary used for question generation:\n", summary)
 
-            prompt = f"""
+        # Reads the quiz's saved questions from the database
+        dedup = await sync_to_async(self.question_dedup_index)(quiz_id)
+        questions = []
+        total_batches = (num_questions + batch_size - 1) // batch_size
+        max_calls = max_calls or total_batches * 2
+        calls = 0
+        self.last_batch_stats = []
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def generate(needed, batch_number):
+            async with semaphore:
+                return await self._agenerate_batch(summary, difficulty, needed, batch_number)
+
+        while len(questions) < num_questions and calls < max_calls:
+            batch_sizes = self._missing_batches(num_questions - len(questions), batch_size, max_calls - calls)
+            batches = await asyncio.gather(*(generate(needed, calls + offset + 1)
+                                             for offset, needed in enumerate(batch_sizes)))
+            calls += len(batch_sizes)
+            for batch in batches:
+                # Embedding the candidates for dedup is CPU work
+                await model_registry.run_in_search_executor(self._merge_batch, batch, dedup, questions, num_questions)
+
+        metrics.incr('generate.calls', calls)
+        print(f"🎯 Finished generating {len(questions)} out of {num_questions} requested using {calls} LLM calls.")
+        return questions
+
+    def _missing_batches(self, missing, max_batch, calls_left):
+        """Sizes of the batches to dispatch for ``missing`` questions within the call budget"""
+        batch_sizes = []
+        while missing > 0 and len(batch_sizes) < calls_left:
+            batch_sizes.append(min(max_batch, missing))
+            missing -= batch_sizes[-1]
+        return batch_sizes
+
+    def _merge_batch(self, batch, dedup, questions, num_questions):
+        """Validate and deduplicate one batch's items into ``questions``, recording its stats"""
+        valid = []
+        for q in batch['items']:
+            if self._is_valid_question(q):
+                valid.append(q)
+            else:
+                print("⚠️ Skipped invalid question:", q)
+
+        accepted = 0
+        decisions = dedup.select([q['mcq'] for q in valid], limit=num_questions - len(questions))
+        for q, decision in zip(valid, decisions):
+            if decision == 'new':
+                questions.append(q)
+                accepted += 1
+                print(f"✅ Question {len(questions)}/{num_questions} added.")
+            elif decision != 'skipped':
+                print(f"⚠️ Skipped duplicate question ({decision}):", q['mcq'])
+
+        batch['accepted'] = accepted
+        batch['yield'] = accepted / batch['requested']
+        del batch['items']
+        print(f"📦 Batch {batch['batch']}: {accepted}/{batch['requested']} accepted in {batch['seconds']:.1f}s")
+        self.last_batch_stats.append(batch)
+        metrics.incr('generate.requested', batch['requested'])
+        metrics.incr('generate.accepted', accepted)
+
+    def _question_prompt(self, summary, difficulty, needed):
+        return f"""
             Based on the following summary, generate {needed} unique {difficulty} level multiple choice questions.
 
             Summary:
@@ -514,55 +882,50 @@ class PDFProcessor:
             Do not include explanations or markdown. Just return the raw JSON array.
             """
 
-            try:
-                response = self.llm.invoke(prompt)
-                raw = response.content.strip().replace("```json", "").replace("```", "").strip()
-                try:
-                    items = json.loads(raw)
-                except json.JSONDecodeError:
-                    try:
-                        items = eval(raw)
-                    except:
-                        print("⚠️ Failed to parse response even with eval fallback.")
-                        continue
-
-                if not isinstance(items, list):
-                    print("⚠️ LLM did not return a JSON list.")
-                    continue
-
-                for q in items:
-                    if not self._is_valid_question(q):
-                        print("⚠️ Skipped invalid question:", q)
-                        continue
-
-                    qid = self._create_question_id(q)
-                    if qid in used_questions or qid in existing_questions:
-                        print("⚠️ Skipped duplicate question:", q['mcq'])
-                        continue
-
-                    used_questions.add(qid)
-                    questions.append(q)
-                    generated += 1
-                    print(f"✅ Question {generated}/{num_questions} added.")
-
-                    if generated >= num_questions:
-                        break
-
-            except Exception as e:
-                print(f"❌ Exception while generating batch {batch_index + 1}: {e}")
-
-        print(f"🎯 Finished generating {len(questions)} out of {num_questions} requested.")
-        return questions
+    def _generate_batch(self, summary, difficulty, needed, batch_number):
+        """Ask the LLM for one batch of questions; returns the parsed items and batch stats"""
+        items = []
+        start = time.perf_counter()
+        try:
+            # Batches share one prompt and rely on sampling for variety, so this bypasses the cache
+            response = self.cached_llm.invoke(self._question_prompt(summary, difficulty, needed),
+                                              cache=True, diverse=True)
+            items = self._batch_items(response)
+        except Exception as e:
+            print(f"❌ Exception while generating batch {batch_number}: {e}")
+        return self._batch_result(batch_number, needed, items, time.perf_counter() - start)
 
+    async def _agenerate_batch(self, summary, difficulty, needed, batch_number):
+        items = []
+        start = time.perf_counter()
+        try:
+            response = await self.cached_llm.ainvoke(self._question_prompt(summary, difficulty, needed),
+                                                     cache=True, diverse=True)
+            items = self._batch_items(response)
+        except Exception as e:
+            print(f"❌ Exception while generating batch {batch_number}: {e}")
+        return self._batch_result(batch_number, needed, items, time.perf_counter() - start)
+
+    def _batch_items(self, response):
+        # Keeps every complete question even if the array is malformed or cut short
+        items = extract_json_objects(response.content)
+        if not items:
+            print("⚠️ No question objects found in the LLM response.")
+            metrics.incr('generate.parse_empty')
+        return items
+
+    def _batch_result(self, batch_number, needed, items, seconds):
+        metrics.observe('generate.batch', seconds)
+        return {
+            'batch': batch_number,
+            'requested': needed,
+            'returned': len(items),
+            'seconds': seconds,
+            'items': items,
+        }
 
     def _safe_parse_json(self, text):
-        try:
-            return json.loads(text)
-        except:
-            try:
-                return eval(text)
-            except:
-                return {}
+        return parse_json_lenient(text, default={})
 
     def _is_valid_question(self, question):
         if not all(k in question for k in ['mcq', 'options', 'correct']):
@@ -575,25 +938,15 @@ class PDFProcessor:
             return False
         return True
 
-    def _create_question_id(self, question):
-        text = question['mcq'].lower().strip()
-        text = re.sub(r'[^\w\s]', '', text)
-        words = text.split()
-        sig_words = [w for w in words if len(w) > 3][:3]
-        return ' '.join(sig_words)
-
-    def _simplify_text(self, text):
-        text = text.lower().strip()
-        text = re.sub(r'[^\w\s]', '', text)
-        words = text.split()
-        sig_words = [w for w in words if len(w) > 3][:3]
-        return ' '.join(sig_words)
-
-    def check_existing_questions(self, quiz_id):
+    def question_dedup_index(self, quiz_id=None):
+        """Near-duplicate index seeded with the quiz's saved questions (cached per quiz between runs)"""
+        similarity = getattr(settings, 'QUIZ_DEDUP_SIMILARITY', 0.88)
+        if not quiz_id:
+            return QuestionDedupIndex(self.embeddings, similarity_threshold=similarity)
         from quiz_app.models import Question
         try:
-            existing_texts = Question.objects.filter(quiz_id=quiz_id).values_list('text', flat=True)
-            return {self._simplify_text(q) for q in existing_texts}
+            saved_texts = list(Question.objects.filter(quiz_id=quiz_id).values_list('text', flat=True))
         except Exception as e:
             print(f"DB Error: {e}")
-            return set()
+            saved_texts = []
+        return dedup_index_for_quiz(quiz_id, self.embeddings, saved_texts, similarity_threshold=similarity)
@@ -1,9 +1,13 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
 from django.utils import timezone
+from datetime import timedelta
 from django.conf import settings
 import os
 from langchain.chains import LLMChain
@@ -12,6 +16,7 @@ from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
 import json
 import re
+import time
 from .models import Quiz, Question, Choice, UserAnswer, QuizAttempt, ChatSession, ChatMessage, UserProfile
 from .forms import (
     UserRegistrationForm, QuizForm, QuestionForm, 
@@ -19,17 +24,24 @@ from .forms import (
     ChatMessageForm, ChatSessionForm
 )
 from .vector_store import PDFProcessor
+from .ingestion import enqueue_pdf_quiz, retry_job, hash_uploaded_file, ensure_vector_store, release_vector_store
+from .vector_backends import retriever_for
+from .global_index import global_index_enabled, get_global_index
+from .chat_memory import ChatMemory, count_tokens, format_history
+from .answer_cache import answer_lookup
+from .llm_usage import (
+    UsageMeter, QuotaExceeded, reserve_tokens, areserve_tokens, release_tokens, chat_estimate, quiz_estimate,
+    usage_summary, is_exempt,
+)
+from . import metrics, model_registry
+from django.contrib.admin.views.decorators import staff_member_required
 import requests
 from django.views.generic import FormView
 import random
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR as RETRIEVAL_QA_PROMPTS
 
-# Load environment variables
+# Load environment variables (the LLM client itself is created on demand by model_registry)
 load_dotenv()
-groq_api_key = os.getenv("GROQ_API_KEY")
-
-if not groq_api_key:
-    raise ValueError("GROQ_API_KEY not found in environment variables")
 #done
 def home(request):
     if request.user.is_authenticated:
@@ -184,13 +196,21 @@ class CreateQuizView(FormView):
             return self.handle_api_quiz(form)
 
     def handle_pdf_quiz(self, form):
-        # Reuse existing PDF quiz creation logic
+        # Store the upload and queue it; parsing, embedding and question
+        # generation run in a background worker (see quiz_app/ingestion.py)
         number_of_questions = form.cleaned_data['number_of_questions']
         print("[DEBUG] Number of questions from form (PDF):", number_of_questions)
+        try:
+            # Checked before anything is stored, so an over-quota upload costs nothing
+            reserved = reserve_tokens(self.request.user, quiz_estimate(number_of_questions))
+        except QuotaExceeded as e:
+            messages.error(self.request, f'Error creating quiz: {e}')
+            return self.form_invalid(form)
         quiz = Quiz.objects.create(
             creator=self.request.user,
             title=f"PDF Quiz {timezone.now().strftime('%Y-%m-%d %H:%M')}",
             difficulty=form.cleaned_data['difficulty'],
+            processing_status='queued',
         )
         
         try:
@@ -198,70 +218,20 @@ class CreateQuizView(FormView):
             os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
             os.makedirs(os.path.join(settings.MEDIA_ROOT, 'vector_stores'), exist_ok=True)
             
-            # Process the PDF file
+            # Save the PDF file, keyed by content so re-uploads share one vector store
             pdf_file = form.cleaned_data['pdf_file']
+            quiz.content_hash = hash_uploaded_file(pdf_file)
             quiz.pdf_file = pdf_file
             quiz.save()
             
-            pdf_path = os.path.join(settings.MEDIA_ROOT, str(quiz.pdf_file))
-            
-
-            # Initialize PDF processor
-            
-            processor = PDFProcessor()
-            
-            # Process PDF and create vector store
-            vector_store = processor.process_pdf(pdf_path)
-            
-            # Save vector store for future use
-            store_path = os.path.join(settings.MEDIA_ROOT, 'vector_stores', f'quiz_{quiz.id}')
-            os.makedirs(store_path, exist_ok=True)
-            processor.save_vector_store(vector_store, store_path)
-            
-            # Generate questions using vector store
-            print(f"Requesting {number_of_questions} questions...")
-            questions = processor.generate_questions(
-                vector_store,
-                quiz.difficulty,
-                number_of_questions,
-                quiz_id=quiz.id
-            )
-
-            if not questions:
-                raise Exception("Failed to generate questions")
-
-            print(f"Successfully generated {len(questions)} questions out of {number_of_questions} requested")
-
-            # Create questions and choices
-            question_order = 0
-            for q_data in questions:
-                question = Question.objects.create(
-                    quiz=quiz,
-                    text=q_data['mcq'],
-                    order=question_order
-                )
-                
-                choice_order = 0
-                for option_letter, option_text in q_data['options'].items():
-                    Choice.objects.create(
-                        question=question,
-                        text=option_text,
-                        is_correct=(option_letter == q_data['correct']),
-                        order=choice_order
-                    )
-                    choice_order += 1
-                question_order += 1
-
-            # Show success message with actual vs requested questions
-            if len(questions) == number_of_questions:
-                messages.success(self.request, f'Quiz created successfully with {len(questions)} questions!')
-            else:
-                messages.success(self.request, f'Quiz created with {len(questions)} questions (requested {number_of_questions}). Some questions may have been filtered due to duplicates or content limitations.')
+            enqueue_pdf_quiz(quiz, number_of_questions, reserved_tokens=reserved)
+            messages.success(self.request, f'Quiz queued! {number_of_questions} questions are being generated from your PDF. You can follow progress on the dashboard.')
             return redirect('dashboard')
 
         except Exception as e:
             messages.error(self.request, f'Error creating quiz: {str(e)}')
             quiz.delete()
+            release_tokens(self.request.user, reserved)
             return self.form_invalid(form)
 
     def handle_api_quiz(self, form):
@@ -367,6 +337,10 @@ def add_choices(request, question_id):
 def take_quiz(request, quiz_id):
     quiz = get_object_or_404(Quiz, id=quiz_id)
     
+    if not quiz.is_ready:
+        messages.warning(request, 'This quiz is still being generated. Please try again shortly.')
+        return redirect('dashboard')
+    
     # Check if user can take another attempt
     if not quiz.can_user_attempt(request.user):
         messages.warning(request, f'You have reached the maximum number of attempts ({quiz.max_attempts}) for this quiz.')
@@ -668,11 +642,8 @@ def delete_quiz(request, quiz_id):
                 if os.path.exists(pdf_path):
                     os.remove(pdf_path)
             
-            # Delete vector store files if they exist
-            vector_store_path = os.path.join(settings.MEDIA_ROOT, 'vector_stores', f'quiz_{quiz.id}')
-            if os.path.exists(vector_store_path):
-                import shutil
-                shutil.rmtree(vector_store_path)
+            # Delete vector store files unless another quiz shares them
+            release_vector_store(quiz)
         except Exception as e:
             # Log the error but don't stop the deletion
             print(f"Error cleaning up files for quiz {quiz.id}: {e}")
@@ -688,6 +659,71 @@ def delete_quiz(request, quiz_id):
         'quiz': quiz
     })
 
+@login_required
+def quiz_status(request, quiz_id):
+    """Polling endpoint reporting the background ingestion progress of a quiz"""
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
+    job = quiz.ingestion_jobs.order_by('-created_at').first()
+    
+    return JsonResponse({
+        'quiz_id': str(quiz.id),
+        'processing_status': quiz.processing_status,
+        'pdf_processed': quiz.pdf_processed,
+        'question_count': quiz.question_count,
+        'job': {
+            'id': str(job.id),
+            'status': job.status,
+            'progress': job.progress,
+            'attempts': job.attempts,
+            'error': job.error,
+            'updated_at': job.updated_at.isoformat(),
+        } if job else None,
+    })
+
+@login_required
+def generate_more_questions(request, quiz_id):
+    """Queue generation of extra questions for a PDF quiz, reusing its vector store and summary"""
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
+    
+    if request.method == 'POST':
+        if not quiz.pdf_file or not quiz.is_ready:
+            messages.warning(request, 'More questions can only be generated for finished PDF quizzes.')
+            return redirect('dashboard')
+        try:
+            number_of_questions = max(1, min(25, int(request.POST.get('number_of_questions', 5))))
+        except ValueError:
+            number_of_questions = 5
+        try:
+            reserved = reserve_tokens(request.user, quiz_estimate(number_of_questions))
+        except QuotaExceeded as e:
+            messages.error(request, str(e))
+            return redirect('dashboard')
+        enqueue_pdf_quiz(quiz, number_of_questions, reserved_tokens=reserved)
+        messages.success(request, f'Generating {number_of_questions} more questions for "{quiz.title}".')
+    return redirect('dashboard')
+
+@login_required
+def retry_quiz_ingestion(request, quiz_id):
+    """Re-queue a failed PDF ingestion job using the already uploaded PDF"""
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
+    
+    if request.method == 'POST':
+        job = quiz.ingestion_jobs.order_by('-created_at').first()
+        if not job or job.status != 'failed':
+            messages.warning(request, 'Only failed quizzes can be retried.')
+            return redirect('dashboard')
+        try:
+            reserved = reserve_tokens(request.user, quiz_estimate(job.num_questions))
+        except QuotaExceeded as e:
+            messages.error(request, str(e))
+            return redirect('dashboard')
+        if retry_job(job, reserved_tokens=reserved):
+            messages.success(request, f'Quiz "{quiz.title}" has been queued again.')
+        else:
+            release_tokens(request.user, reserved)
+            messages.warning(request, 'Only failed quizzes can be retried.')
+    return redirect('dashboard')
+
 # Chat Views
 @login_required
 def chat_sessions(request):
@@ -715,39 +751,55 @@ def strip_unsupported_chars(text):
     return re.sub(r'[\U00010000-\U0010FFFF]', '', text)
 
 @login_required
-def chat_session(request, session_id):
-    session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+async def chat_session(request, session_id):
+    # Async: the LLM round trip doesn't hold a worker thread under ASGI
+    user = await request.auser()
+    session = await aget_object_or_404(ChatSession.objects.select_related('quiz'), id=session_id, user=user)
     messages_list = []  # Start with an empty list
 
     if request.method == 'POST':
         form = ChatMessageForm(request.POST)
         if form.is_valid():
+            try:
+                # A couple of cache reads: over-quota users are turned away before any retrieval or LLM work
+                reserved = await areserve_tokens(user, chat_estimate())
+            except QuotaExceeded as e:
+                await sync_to_async(messages.error)(request, str(e))
+                return redirect('chat_session', session_id=session.id)
+            meter = UsageMeter(user.id, 'chat', quiz_id=session.quiz_id, reserved=reserved,
+                               charge_quota=not is_exempt(user))
             user_message = form.save(commit=False)
             user_message.session = session
             user_message.message_type = 'user'
             # Clean the user's message before saving
             user_message.content = strip_unsupported_chars(user_message.content)
-            user_message.save()
+            user_message.tokens_used = count_tokens(user_message.content)
+            await user_message.asave()
 
             # Generate AI response
-            ai_response_content = generate_ai_response(session, user_message.content)
+            ai_response_content = await agenerate_ai_response(session, user_message.content, meter=meter)
             
             # Clean the AI's response before saving
             cleaned_ai_content = strip_unsupported_chars(ai_response_content)
 
             # Save AI response
-            ChatMessage.objects.create(
+            await ChatMessage.objects.acreate(
                 session=session,
                 content=cleaned_ai_content,
-                message_type='assistant'
+                message_type='assistant',
+                tokens_used=count_tokens(cleaned_ai_content)
             )
             
             # After posting, load all messages for display
-            messages_list = session.messages.all().order_by('timestamp')
+            messages_list = [message async for message in session.messages.all().order_by('timestamp')]
             
             # Update last activity timestamp
             session.last_message_at = timezone.now()
-            session.save()
+            await session.asave()
+
+            # Fold old turns into the running summary once they outgrow the history budget
+            await ChatMemory(session, meter=meter).aupdate()
+            await meter.aflush()
             
             # We display the messages, so we can clear the form
             form = ChatMessageForm()
@@ -755,12 +807,17 @@ def chat_session(request, session_id):
         form = ChatMessageForm()
         # On GET request, messages_list remains empty, so history isn't shown
 
-    return render(request, 'quiz_app/chat_session.html', {
+    # Templates and context processors read request.user synchronously
+    return await sync_to_async(render)(request, 'quiz_app/chat_session.html', {
         'session': session,
         'messages': messages_list,
         'form': form
     })
 
+AI_ERROR_REPLY = ("I apologize, but I'm having trouble processing your question right now. "
+                  "Please try again or contact support if the issue persists.")
+
+
 @login_required
 def delete_chat_session(request, session_id):
     """Delete a chat session"""
@@ -776,98 +833,381 @@ def delete_chat_session(request, session_id):
         'session': session
     })
 
-def generate_ai_response(session, user_message):
-    """Generate AI response using RAG with existing vector store"""
-    try:
-        # Initialize PDF processor
-        processor = PDFProcessor()
+def _chat_context(processor, session):
+    """The session's vector store and document summary (blocking: may load or even build the store)"""
+    # Load existing vector store for the quiz if available
+    vector_store = None
+    if session.quiz and session.quiz.pdf_file:
+        try:
+            # Served from the in-process LRU cache after the first load;
+            # built from the PDF if the store is missing or unreadable
+            vector_store = ensure_vector_store(processor, session.quiz)
+        except Exception as e:
+            print(f"Error loading vector store: {e}")
+    elif not session.quiz and global_index_enabled():
+        # General sessions search across all of the user's uploaded PDFs
+        index = get_global_index()
+        if index.has_creator(session.user_id):
+            vector_store = index.view(processor.embeddings, creator_id=session.user_id)
+
+    # Reuse the document summary saved when the quiz was generated
+    document_summary = None
+    if vector_store and session.quiz:
+        saved = processor.load_summary(session.quiz.summary_path)
+        document_summary = saved['summary'] if saved else None
+    return vector_store, document_summary
+
+
+def _tutor_prompt(user_message, history_summary, history_messages, document_summary, with_context):
+    # Earlier turns as a running summary, recent ones verbatim (see ChatMemory)
+    chat_history = format_history(history_messages) or "(no earlier messages)"
+    if history_summary:
+        chat_history = f"Summary of the earlier conversation: {history_summary}\n{chat_history}"
+
+    # Create system prompt for teacher role
+    system_prompt = """You are an AI teacher assistant helping students understand the course material. 
+    You should:
+    1. Answer questions based on the provided context
+    2. Explain concepts clearly and in simple terms
+    3. Provide examples when helpful
+    4. Ask follow-up questions to encourage deeper understanding
+    5. Be encouraging and supportive
+    6. If you don't know something, say so rather than guessing
+    
+    Use the context from the uploaded PDF to provide accurate answers."""
+
+    if document_summary:
+        system_prompt += f"""
+    
+    Overview of the uploaded PDF:
+    {document_summary}"""
+
+    if with_context:
+        # Create context-aware prompt
+        return f"""
+        {system_prompt}
         
-        # Load existing vector store for the quiz if available
-        vector_store = None
-        if session.quiz and session.quiz.pdf_file:
-            # Check if vector store exists for this quiz
-            vector_store_path = os.path.join(settings.MEDIA_ROOT, 'vector_stores', f'quiz_{session.quiz.id}')
-            if os.path.exists(vector_store_path):
-                try:
-                    vector_store = processor.load_vector_store(vector_store_path)
-                    print(f"Loaded existing vector store for quiz {session.quiz.id}")
-                except Exception as e:
-                    print(f"Error loading vector store: {e}")
-                    # Fallback: recreate vector store from PDF
-                    pdf_path = os.path.join(settings.MEDIA_ROOT, str(session.quiz.pdf_file))
-                    if os.path.exists(pdf_path):
-                        vector_store = processor.process_pdf(pdf_path)
-                        # Save the recreated vector store
-                        processor.save_vector_store(vector_store, vector_store_path)
-                        print(f"Recreated and saved vector store for quiz {session.quiz.id}")
-            else:
-                # Vector store doesn't exist, create it from PDF
-                pdf_path = os.path.join(settings.MEDIA_ROOT, str(session.quiz.pdf_file))
-                if os.path.exists(pdf_path):
-                    vector_store = processor.process_pdf(pdf_path)
-                    # Save the new vector store
-                    os.makedirs(vector_store_path, exist_ok=True)
-                    processor.save_vector_store(vector_store, vector_store_path)
-                    print(f"Created and saved new vector store for quiz {session.quiz.id}")
+        Chat History:
+        {chat_history}
+        
+        Current Question: {user_message}
         
-        # Create chat history context
-        chat_history = []
-        #similar(same) to ChatMessage.objects.filter(session_id=1).order_by('-timestamp')[:10]
-        recent_messages = session.messages.order_by('-timestamp')[:10]  # Last 10 messages
-        for msg in reversed(recent_messages):  # Reverse to get chronological order
-            role = "user" if msg.message_type == "user" else "assistant"
-            chat_history.append({"role": role, "content": msg.content})
+        Please provide a helpful and educational response based on the context.
+        """
+
+    # Fallback to general response without PDF context
+    return f"""
+        {system_prompt}
         
-        # Create system prompt for teacher role
-        system_prompt = """You are an AI teacher assistant helping students understand the course material. 
-        You should:
-        1. Answer questions based on the provided context
-        2. Explain concepts clearly and in simple terms
-        3. Provide examples when helpful
-        4. Ask follow-up questions to encourage deeper understanding
-        5. Be encouraging and supportive
-        6. If you don't know something, say so rather than guessing
+        Chat History:
+        {chat_history}
         
-        Use the context from the uploaded PDF to provide accurate answers."""
+        Current Question: {user_message}
         
-        if vector_store:
-            # Use RAG with vector store
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=processor.llm,
-                chain_type="stuff",
-                retriever=vector_store.as_retriever(search_kwargs={"k": 3})
-            )
-            
-            # Create context-aware prompt
-            context_prompt = f"""
-            {system_prompt}
-            
-            Chat History:
-            {chat_history}
-            
-            Current Question: {user_message}
-            
-            Please provide a helpful and educational response based on the context.
-            """
-            
-            response = qa_chain.invoke(context_prompt)
-            return response['result']
-        else:
-            # Fallback to general response without PDF context
-            general_prompt = f"""
-            {system_prompt}
-            
-            Chat History:
-            {chat_history}
-            
-            Current Question: {user_message}
-            
-            Please provide a helpful response. Note: I don't have access to specific course materials for this session.
-            """
-            
-            response = processor.llm.invoke(general_prompt)
-            return response.content
-            
+        Please provide a helpful response. Note: I don't have access to specific course materials for this session.
+        """
+
+
+def _retrieval_prompt(processor, vector_store, context_prompt):
+    """Same retrieval and "stuff" prompt as RetrievalQA, built by hand so the answer can be streamed"""
+    documents = retriever_for(vector_store, k=3).invoke(context_prompt)
+    return RETRIEVAL_QA_PROMPTS.get_prompt(processor.llm).format_messages(
+        context="\n\n".join(doc.page_content for doc in documents),
+        question=context_prompt,
+    )
+
+
+def _cached_answer(processor, answer):
+    """A semantic cache hit for the question, counted on the meter as a cached call"""
+    content = answer.get() if answer else None
+    if content is not None and processor.cached_llm.meter is not None:
+        processor.cached_llm.meter.record(answer.question, content, cached=True)
+    return content
+
+
+def build_ai_prompt(session, user_message, processor=None, meter=None, answer=None):
+    """
+    Build the tutor prompt for a chat message. Returns (processor, prompt,
+    cacheable): with PDF context the prompt is the retrieval QA chat prompt
+    filled with the top chunks, otherwise a plain prompt that may be served
+    from the LLM response cache. ``meter`` is attached to a processor
+    created here; ``answer`` (an AnswerLookup) learns whether the prompt
+    carried chat history.
+    """
+    # Initialize PDF processor
+    processor = processor or PDFProcessor(meter=meter)
+    vector_store, document_summary = _chat_context(processor, session)
+    # Recent messages that fit the history token budget, plus the running summary
+    history_summary, history_messages = ChatMemory(session).history(current=user_message)
+    if answer is not None and (history_summary or history_messages):
+        answer.storable = False
+    prompt = _tutor_prompt(user_message, history_summary, history_messages, document_summary, bool(vector_store))
+    if vector_store:
+        return processor, _retrieval_prompt(processor, vector_store, prompt), False
+    return processor, prompt, True
+
+
+async def abuild_ai_prompt(session, user_message, processor=None, meter=None, answer=None):
+    """
+    build_ai_prompt() for async views: ORM reads are async, the vector store
+    comes through sync_to_async (usually an LRU cache hit) and the retrieval
+    search runs on the bounded search executor. ``session.quiz`` must already
+    be loaded (select_related).
+    """
+    processor = processor or await sync_to_async(PDFProcessor)(meter=meter)
+    vector_store, document_summary = await sync_to_async(_chat_context)(processor, session)
+    history_summary, history_messages = await ChatMemory(session).ahistory(current=user_message)
+    if answer is not None and (history_summary or history_messages):
+        answer.storable = False
+    prompt = _tutor_prompt(user_message, history_summary, history_messages, document_summary, bool(vector_store))
+    if vector_store:
+        prompt = await model_registry.run_in_search_executor(_retrieval_prompt, processor, vector_store, prompt)
+        return processor, prompt, False
+    return processor, prompt, True
+
+
+async def _aanswer_lookup(session, user_message, processor):
+    """answer_lookup() for async views: embedding the question runs on the search executor"""
+    if not session.quiz_id:
+        return None
+    return await model_registry.run_in_search_executor(answer_lookup, session, user_message, processor.embeddings)
+
+
+def generate_ai_response(session, user_message, processor=None, meter=None):
+    """Generate AI response using RAG with existing vector store"""
+    try:
+        processor = processor or PDFProcessor(meter=meter)
+        # A similar standalone question about the same PDF may already have been answered
+        answer = answer_lookup(session, user_message, processor.embeddings)
+        cached = _cached_answer(processor, answer)
+        if cached is not None:
+            return cached
+        processor, prompt, cacheable = build_ai_prompt(session, user_message, processor, answer=answer)
+        response = processor.cached_llm.invoke(prompt, cache=cacheable)
+        if answer:
+            answer.put(response.content)
+        return response.content
+
     except Exception as e:
         print(f"Error generating AI response: {e}")
-        return "I apologize, but I'm having trouble processing your question right now. Please try again or contact support if the issue persists."
+        return AI_ERROR_REPLY
+
+
+async def agenerate_ai_response(session, user_message, processor=None, meter=None):
+    """generate_ai_response() on the async LLM client; holds no thread while the model answers"""
+    try:
+        processor = processor or await sync_to_async(PDFProcessor)(meter=meter)
+        answer = await _aanswer_lookup(session, user_message, processor)
+        cached = _cached_answer(processor, answer)
+        if cached is not None:
+            return cached
+        processor, prompt, cacheable = await abuild_ai_prompt(session, user_message, processor, answer=answer)
+        response = await processor.cached_llm.ainvoke(prompt, cache=cacheable)
+        if answer:
+            answer.put(response.content)
+        return response.content
+
+    except Exception as e:
+        print(f"Error generating AI response: {e}")
+        return AI_ERROR_REPLY
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChatReplyStream:
+    """
+    Relays an LLM reply as server-sent events (``token`` per chunk, then
+    ``done``, or ``error``). The assistant ChatMessage is saved once, when
+    the stream ends, even if the client disconnects halfway. ``events()``
+    serves WSGI; ``aevents()`` serves ASGI without holding a worker thread
+    between chunks. Token usage goes to ``meter`` when the stream closes,
+    and a complete reply is offered to ``answer`` (an AnswerLookup).
+    """
+
+    def __init__(self, session, chunks, started, meter=None, answer=None):
+        self.session = session
+        self.chunks = chunks
+        self.started = started
+        self.meter = meter
+        self.answer = answer
+        self.parts = []
+        self.failed = False
+        self.complete = False
+
+    def _token(self, chunk):
+        chunk = strip_unsupported_chars(chunk)
+        if not self.parts:
+            # Time to first token, measured from when the request arrived
+            metrics.observe('chat.ttft', time.perf_counter() - self.started)
+        self.parts.append(chunk)
+        return _sse('token', {'text': chunk})
+
+    def _error(self, error):
+        print(f"Error streaming AI response: {error}")
+        metrics.incr('chat.stream.error')
+        self.failed = True
+        if not self.parts:
+            self.parts.append(AI_ERROR_REPLY)
+        return _sse('error', {'message': AI_ERROR_REPLY})
+
+    def _save(self):
+        content = ''.join(self.parts).strip()
+        metrics.observe('chat.stream', time.perf_counter() - self.started)
+        metrics.incr('chat.stream.chunks', len(self.parts))
+        if not content:
+            return None
+        if self.answer is not None and self.complete:
+            self.answer.put(content)
+        message = ChatMessage.objects.create(session=self.session, content=content, message_type='assistant',
+                                             tokens_used=count_tokens(content))
+        self.session.last_message_at = timezone.now()
+        self.session.save()
+        return message
+
+    def _done(self, message):
+        return _sse('done', {
+            'message_id': str(message.id) if message else None,
+            'timestamp': message.timestamp.isoformat() if message else None,
+            'failed': self.failed,
+        })
+
+    def _close_chunks(self):
+        # On a disconnect the LLM stream is closed here, so its partial usage is counted before the flush
+        close = getattr(self.chunks, 'close', None)
+        if close:
+            close()
+
+    def events(self):
+        message = None
+        try:
+            try:
+                for chunk in self.chunks:
+                    if chunk:
+                        yield self._token(chunk)
+                self.complete = True
+            except Exception as e:
+                yield self._error(e)
+            finally:
+                message = self._save()
+            yield self._done(message)
+            # After the reply is delivered, so it never delays the stream
+            ChatMemory(self.session, meter=self.meter).update()
+        finally:
+            if self.meter is not None:
+                self._close_chunks()
+                self.meter.flush()
+
+    async def _achunks(self):
+        if hasattr(self.chunks, '__aiter__'):
+            async for chunk in self.chunks:
+                yield chunk
+            return
+        # A blocking stream: each chunk is awaited from a worker thread
+        next_chunk = sync_to_async(next, thread_sensitive=False)
+        chunks = iter(self.chunks)
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+
+    async def aevents(self):
+        message = None
+        try:
+            try:
+                async for chunk in self._achunks():
+                    if chunk:
+                        yield self._token(chunk)
+                self.complete = True
+            except Exception as e:
+                yield self._error(e)
+            finally:
+                message = await sync_to_async(self._save)()
+            yield self._done(message)
+            await ChatMemory(self.session, meter=self.meter).aupdate()
+        finally:
+            if self.meter is not None:
+                aclose = getattr(self.chunks, 'aclose', None)
+                if aclose:
+                    await aclose()
+                else:
+                    self._close_chunks()
+                await self.meter.aflush()
+
+
+@login_required
+@require_POST
+async def chat_stream(request, session_id):
+    """Post a chat message and stream the AI teacher's reply as server-sent events"""
+    started = time.perf_counter()
+    user = await request.auser()
+    session = await aget_object_or_404(ChatSession.objects.select_related('quiz'), id=session_id, user=user)
+    form = ChatMessageForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    try:
+        reserved = await areserve_tokens(user, chat_estimate())
+    except QuotaExceeded as e:
+        response = JsonResponse({'error': str(e)}, status=429)
+        if e.retry_after:
+            response['Retry-After'] = str(e.retry_after)
+        return response
+    meter = UsageMeter(user.id, 'chat', quiz_id=session.quiz_id, reserved=reserved,
+                       charge_quota=not is_exempt(user))
+
+    user_message = form.save(commit=False)
+    user_message.session = session
+    user_message.message_type = 'user'
+    user_message.content = strip_unsupported_chars(user_message.content)
+    user_message.tokens_used = count_tokens(user_message.content)
+    await user_message.asave()
+
+    is_asgi = isinstance(request, ASGIRequest)
+    answer = None
+    try:
+        processor = await sync_to_async(PDFProcessor)(meter=meter)
+        answer = await _aanswer_lookup(session, user_message.content, processor)
+        cached = _cached_answer(processor, answer)
+        if cached is not None:
+            # Served whole from the semantic answer cache
+            chunks, answer = iter([cached]), None
+        else:
+            # Retrieval happens here, before the first byte is sent
+            processor, prompt, cacheable = await abuild_ai_prompt(session, user_message.content, processor,
+                                                                  answer=answer)
+            if is_asgi:
+                chunks = processor.cached_llm.astream(prompt, cache=cacheable)
+            else:
+                # WSGI iterates the response in a plain thread, outside any event loop
+                chunks = processor.cached_llm.stream(prompt, cache=cacheable)
+    except Exception as e:
+        print(f"Error preparing AI response: {e}")
+        chunks, answer = iter([AI_ERROR_REPLY]), None
+
+    stream = ChatReplyStream(session, chunks, started, meter=meter, answer=answer)
+    response = StreamingHttpResponse(
+        stream.aevents() if is_asgi else stream.events(),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+@staff_member_required
+def ai_metrics(request):
+    """Per-worker counters and timings for the AI pipeline (staff only)"""
+    return JsonResponse(metrics.snapshot())
+
+@staff_member_required
+def llm_usage_report(request):
+    """LLM tokens per user over the last ``?hours=`` (default 24), with each user's remaining quota (staff only)"""
+    try:
+        hours = max(1, int(request.GET.get('hours', 24)))
+    except ValueError:
+        hours = 24
+    return JsonResponse({
+        'hours': hours,
+        'users': usage_summary(timezone.now() - timedelta(hours=hours)),
+    })